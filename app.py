@@ -13,29 +13,40 @@ from fastapi import (
 
 from auth import *
 from middleware.http_logging import register_http_logging
+from middleware.metrics import register_http_metrics
 from websocket.endpoint import websocket_endpoint
+from websocket.registry import connection_registry
 
 # FastAPI 安全和响应模块
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 
 # 日志和异步处理
 import logging
 import os
-import aiohttp
+import time
+import asyncio
 
 # 科学计算和音频处理
 from contextlib import asynccontextmanager
-import numpy as np
-import webrtcvad
+from typing import Optional
 
 # 自定义功能模块
+from utils.admission import Priority, admit, set_request_context
 from utils.transcribe import transcribe_file
-from utils.synthesize import synthesize_text
+from utils.synthesize import synthesize_text_stream
 from websocket.data_handlers import WsDataHandlerRegistry
 from websocket.data_handler_config import ws_configure_data_handlers
 from services.chat_sessions import ChatSessionManager
 from services.word_generator import generate_words_service
+from services.llm_client import llm_client
+from services.vocab_pool import vocab_pool
+from services.sentence_cache import sentence_cache_stats
+from services.conversation import stream_conversation_audio
+from utils.metrics import LatencyStats, REGISTRY
+from utils.model_registry import model_registry, PRELOAD_MODELS
+from utils.redis_client import check_redis_health
+from utils.inference import inference_client, is_remote
 
 # # 设置日志级别（默认 INFO
 # log_level = os.getenv("LOG_LEVEL", "DEBUG").upper()
@@ -63,13 +74,26 @@ logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: 创建全局 ClientSession
-    session = aiohttp.ClientSession()
-    app.state.http_session = session
-    ChatSessionManager.get_instance().http_session = session
+    # Startup: 创建 MySQL 连接池，LLM 连接池在第一次请求时创建
+    ChatSessionManager.get_instance().start_background_tasks()
+    # 后台检查并补充词库
+    vocab_pool.start()
+    vocab_pool.request_refill()
+    # 所有 WebSocket 连接的 PING 超时和 token 过期检查
+    connection_registry.start()
+    app.state.db_pool = await create_db_pool()
+    # 后台并行加载模型，不阻塞启动；加载完成前 /readyz 返回 503
+    app.state.model_preload = asyncio.create_task(
+        model_registry.preload(PRELOAD_MODELS)
+    )
     yield
-    # Shutdown: 关闭 ClientSession
-    await session.close()
+    # Shutdown: 关闭 LLM 连接池和数据库连接池
+    app.state.model_preload.cancel()
+    await ChatSessionManager.get_instance().stop()
+    await vocab_pool.stop()
+    await connection_registry.stop()
+    await llm_client.close()
+    await close_db_pool(app.state.db_pool)
 
 
 # FastAPI 实例
@@ -78,42 +102,132 @@ ws_data_handler_registry = WsDataHandlerRegistry()
 ws_configure_data_handlers(ws_data_handler_registry)
 chat_session_manager = ChatSessionManager.get_instance()
 
-# Initialize VAD
-vad = webrtcvad.Vad()
-vad.set_mode(3)  # Most aggressive mode
-
 
 # 中间件：记录请求详细信息
 register_http_logging(app)
+# 中间件：按路由记录请求耗时，通过 /metrics 输出
+register_http_metrics(app)
+
+
+login_latency = LatencyStats("login_latency")
+
+
+def client_ip(request: Request) -> str:
+    # nginx 反向代理会设置 X-Real-IP
+    return request.headers.get("x-real-ip") or (
+        request.client.host if request.client else "unknown"
+    )
 
 
 # 登录端点
 @app.post("/login")
 async def login(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db_and_cursor: tuple = Depends(get_db),
 ):
-    user = await get_user(form_data.username, db_and_cursor)
-    if not user or not verify_password(form_data.password, user["hashed_password"]):
+    start = time.perf_counter()
+    try:
+        # 先限流再查库和校验密码，被限流的请求不占用数据库连接和 bcrypt 线程
+        login_ip_limiter.hit(client_ip(request))
+        login_user_limiter.hit(form_data.username)
+
+        # 查完用户立即归还连接，bcrypt 排队和校验期间不占用连接池
+        async with db_cursor(request.app.state.db_pool) as db_and_cursor:
+            user = await get_user(form_data.username, db_and_cursor)
+        # bcrypt 校验放到专用线程池，不阻塞事件循环
+        if not user or not await verify_password_async(
+            form_data.password, user["hashed_password"]
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Incorrect username or password",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        login_user_limiter.reset(form_data.username)
+        access_token = create_access_token(data={"sub": user["username"]})
+        return {"access_token": access_token, "token_type": "bearer"}
+    finally:
+        login_latency.observe(time.perf_counter() - start)
+
+
+# 存活探测：进程能响应即可
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+# 就绪探测：预加载的模型已加载，数据库连接池和 Redis 可用
+@app.get("/readyz")
+async def readyz(request: Request):
+    if is_remote():
+        models_ready = await inference_client.ping()
+    else:
+        models_ready = all(
+            model_registry.is_loaded(name)
+            for name in PRELOAD_MODELS
+            if model_registry.is_registered(name)
+        )
+    db = await check_db_health(request.app.state.db_pool)
+    redis_ready = await check_redis_health()
+    result = {
+        "ready": models_ready and db["healthy"] and redis_ready,
+        "models": model_registry.status(),
+        "inference_mode": "remote" if is_remote() else "local",
+        "db": db["healthy"],
+        "redis": redis_ready,
+    }
+    if not result["ready"]:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect username or password",
-            headers={"WWW-Authenticate": "Bearer"},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=result
         )
-    access_token = create_access_token(data={"sub": user["username"]})
-    return {"access_token": access_token, "token_type": "bearer"}
+    return result
+
+
+# 数据库健康探测
+@app.get("/health/db")
+async def db_health(request: Request):
+    result = await check_db_health(request.app.state.db_pool)
+    if not result["healthy"]:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=result
+        )
+    return result
+
+
+# LLM 客户端状态：熔断器、重试次数、各调用方的耗时直方图和例句缓存命中情况
+@app.get("/health/llm")
+async def llm_health():
+    return {**llm_client.stats(), "sentence_cache": sentence_cache_stats()}
+
+
+# 本进程的 WebSocket 连接数和在线用户数
+@app.get("/health/ws")
+async def ws_health():
+    return connection_registry.stats()
+
+
+# Prometheus 指标（文本格式）。只在内网抓取，nginx 不对外暴露该路径
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
 
 # some of the APIs are called only by curl for debug,
 # not called by app, like transcribe, synthesize
 # 语音转文字端点（需要认证）
+# audio_format=pcm_s16le 时 file 为 16kHz 单声道原始 PCM，跳过解码并裁剪静音
 @app.post("/transcribe")
 async def transcribe_audio(
     file: UploadFile = File(...),
+    audio_format: Optional[str] = Form(None),
     current_user: dict = Depends(get_current_user),
 ):
     logger.info(f"transcribe_audio called by user: {current_user['username']}")
+    set_request_context(current_user["username"], Priority.DEBUG)
     # 使用 transcribe.py 的 transcribe_file 函数
-    transcription = await transcribe_file(file.file)
+    transcription = await transcribe_file(file.file, audio_format=audio_format)
 
     logger.debug(f"Transcription result: {transcription}")
 
@@ -127,25 +241,28 @@ async def synthesize_speech(
     current_user: dict = Depends(get_current_user),
 ):
     logger.info(f"synthesize_speech called by user: {current_user['username']}")
-    audio_stream = await synthesize_text(text)
-    return StreamingResponse(audio_stream, media_type="audio/mpeg")
+    set_request_context(current_user["username"], Priority.DEBUG)
+    # 按句子流式合成，第一句合成完即开始返回
+    return StreamingResponse(synthesize_text_stream(text), media_type="audio/mpeg")
 
 
 # chat（需要认证）
 @app.post("/conversation")
 async def conversation_with_llm(
     file: UploadFile = File(...),
+    audio_format: Optional[str] = Form(None),
     current_user: dict = Depends(get_current_user),
 ):
     # logger.info(f'current_user {current_user}')
     logger.info(f"conversation_with_llm called by user: {current_user['username']}")
-    transcription = await transcribe_file(file.file)
-    chat_session = await chat_session_manager.get_session(current_user["username"])
-    await chat_session.add_message("user", transcription)
-    response = await chat_session.conversation_with_llm(transcription)
-    logger.info(f"response from LLM is: {response}")
-    await chat_session.add_message("assistant", response)
-    audio_stream = await synthesize_text(response)
+    set_request_context(current_user["username"], Priority.DEFAULT)
+    # 任一阶段过载时在转录之前就拒绝
+    admit("asr", "llm", "tts")
+    transcription = await transcribe_file(file.file, audio_format=audio_format)
+    # LLM 流式输出，每句生成后立即合成并返回音频
+    audio_stream = await stream_conversation_audio(
+        current_user["username"], transcription
+    )
     return StreamingResponse(audio_stream, media_type="audio/mpeg")
 
 
@@ -155,6 +272,7 @@ async def generate_words(
     request: Request,
     current_user: dict = Depends(get_current_user),
 ):
+    set_request_context(current_user["username"], Priority.DEFAULT)
     try:
         payload = await request.json()
     except Exception:
@@ -166,9 +284,7 @@ async def generate_words(
             payload = payload["words"]
 
     # logger.info(f"payload is {payload}")
-    return await generate_words_service(
-        payload, current_user["username"], request.app.state.http_session
-    )
+    return await generate_words_service(payload, current_user["username"])
 
 
 @app.websocket("/ws")
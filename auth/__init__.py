@@ -1,5 +1,9 @@
 from .jwt_utils import (
     get_db,
+    db_cursor,
+    create_db_pool,
+    close_db_pool,
+    check_db_health,
     get_user,
     get_current_user,
     get_token_http,
@@ -7,10 +11,22 @@ from .jwt_utils import (
     create_access_token,
     get_expiry_time,
     verify_password,
+    decode_token,
 )
+from .user_cache import invalidate_user, auth_cache_stats
+from .password import (
+    verify_password_async,
+    hash_password_async,
+    password_executor_stats,
+)
+from .rate_limit import login_user_limiter, login_ip_limiter
 
 __all__ = [
     "get_db",
+    "db_cursor",
+    "create_db_pool",
+    "close_db_pool",
+    "check_db_health",
     "get_user",
     "get_current_user",
     "get_token_http",
@@ -18,4 +34,12 @@ __all__ = [
     "create_access_token",
     "get_expiry_time",
     "verify_password",
+    "decode_token",
+    "invalidate_user",
+    "auth_cache_stats",
+    "verify_password_async",
+    "hash_password_async",
+    "password_executor_stats",
+    "login_user_limiter",
+    "login_ip_limiter",
 ]
@@ -16,14 +16,21 @@ from fastapi import (
     status,
     WebSocket,
 )
+from starlette.requests import HTTPConnection
 
 # 异步 MySQL 数据库
-from aiomysql import create_pool
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from aiomysql import create_pool, Pool
 from aiomysql.cursors import DictCursor
 
 # 时间和日期处理
 from datetime import datetime, timedelta, timezone
 
+from utils.metrics import Counter, LatencyStats
+from .user_cache import get_cached_token, cache_token, get_cached_user, cache_user
+
 logger = logging.getLogger(__name__)
 
 # JWT 配置
@@ -31,6 +38,18 @@ JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-please-change-this
 ALGORITHM = "HS256"
 JWT_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_TOKEN_EXPIRE_MINUTES", 300))
 
+# 数据库连接池配置
+MYSQL_HOST = os.getenv("MYSQL_HOST", "db")
+DB_POOL_MINSIZE = int(os.getenv("DB_POOL_MINSIZE", 1))
+DB_POOL_MAXSIZE = int(os.getenv("DB_POOL_MAXSIZE", 10))
+# 连接超过该秒数后回收重建，需小于 MySQL 的 wait_timeout
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 3600))
+# 连接池耗尽时最多等待的秒数
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 5))
+
+db_pool_wait = LatencyStats("db_pool_wait")
+db_pool_timeouts = Counter("db_pool_timeouts")
+
 # 密码哈希
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -39,10 +58,20 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
 # JWT 辅助函数
+def decode_token(token: str) -> dict:
+    """
+    验证并解码 token，验证结果按 token 哈希缓存到 exp，避免重复做 HMAC 校验。
+    验证失败抛出 JWTError。
+    """
+    payload = get_cached_token(token)
+    if payload is None:
+        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
+        cache_token(token, payload)
+    return payload
+
+
 def get_expiry_time(token):
-    return jwt.decode(token, JWT_SECRET_KEY, algorithms=["HS256"]).get(
-        "exp", float("inf")
-    )
+    return decode_token(token).get("exp", float("inf"))
 
 
 def create_access_token(data: dict):
@@ -57,18 +86,84 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
-# 数据库连接
-async def get_db():
-    async with create_pool(
-        host="db",
+# 数据库连接池
+async def create_db_pool() -> Pool:
+    """
+    创建全局共享的 MySQL 连接池，在 app 的 lifespan 中调用一次。
+    """
+    pool = await create_pool(
+        host=MYSQL_HOST,
         user=os.getenv("MYSQL_USER", "root"),
         password=os.getenv("MYSQL_PASSWORD", "mysqlpassword"),
         db=os.getenv("MYSQL_DATABASE", "stts"),
+        minsize=DB_POOL_MINSIZE,
+        maxsize=DB_POOL_MAXSIZE,
+        pool_recycle=DB_POOL_RECYCLE,
         cursorclass=DictCursor,
-    ) as pool:
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                yield conn, cursor
+    )
+    logger.info(
+        f"MySQL pool created: host={MYSQL_HOST}, "
+        f"minsize={DB_POOL_MINSIZE}, maxsize={DB_POOL_MAXSIZE}"
+    )
+    return pool
+
+
+async def close_db_pool(pool: Pool):
+    pool.close()
+    await pool.wait_closed()
+    logger.info("MySQL pool closed")
+
+
+@asynccontextmanager
+async def db_cursor(pool: Pool):
+    """
+    从连接池取连接和游标，并记录等待连接的耗时。
+    """
+    start = time.perf_counter()
+    try:
+        conn = await asyncio.wait_for(pool.acquire(), DB_POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        db_pool_timeouts.inc()
+        logger.error("Timed out waiting for a MySQL connection")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database busy",
+        )
+    finally:
+        db_pool_wait.observe(time.perf_counter() - start)
+    try:
+        async with conn.cursor() as cursor:
+            yield conn, cursor
+    finally:
+        pool.release(conn)
+
+
+async def check_db_health(pool: Pool) -> dict:
+    """
+    数据库健康探测：执行 SELECT 1，并返回连接池状态和等待统计。
+    """
+    healthy = True
+    try:
+        async with db_cursor(pool) as (_, cursor):
+            await cursor.execute("SELECT 1")
+            await cursor.fetchone()
+    except Exception as e:
+        logger.warning(f"MySQL health probe failed: {e}")
+        healthy = False
+    return {
+        "healthy": healthy,
+        "size": pool.size,
+        "freesize": pool.freesize,
+        "maxsize": pool.maxsize,
+        "wait": db_pool_wait.snapshot(),
+        "timeouts": db_pool_timeouts.value,
+    }
+
+
+# 数据库连接，从 app.state.db_pool 获取（HTTP 和 WebSocket 通用）
+async def get_db(conn: HTTPConnection):
+    async with db_cursor(conn.app.state.db_pool) as db_and_cursor:
+        yield db_and_cursor
 
 
 # HTTP token 提取
@@ -95,11 +190,12 @@ async def get_token_websocket(websocket: WebSocket):
 
 # 通用用户验证
 async def get_current_user(
-    token: str = Depends(get_token_http), db_and_cursor: tuple = Depends(get_db)
+    conn: HTTPConnection, token: str = Depends(get_token_http)
 ):
     """
     验证 JWT token 并返回用户。
     默认用于 HTTP 端点，WebSocket 端点会覆盖 token 依赖。
+    用户记录先查进程内缓存，未命中时才从连接池取连接查询数据库。
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -108,18 +204,22 @@ async def get_current_user(
     )
 
     try:
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = await get_user(username, db_and_cursor)
 
+    user = get_cached_user(username)
     if user is None:
-        raise credentials_exception
+        async with db_cursor(conn.app.state.db_pool) as db_and_cursor:
+            user = await get_user(username, db_and_cursor)
+        if user is None:
+            raise credentials_exception
+        cache_user(user)
 
-    logger.info(f"get_current_user: {username}")
+    logger.debug(f"get_current_user: {username}")
 
     return user
 
@@ -0,0 +1,79 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+from utils.metrics import Counter, Gauge, LatencyStats
+from .jwt_utils import pwd_context
+
+logger = logging.getLogger(__name__)
+
+# bcrypt 是 CPU 密集型操作（单次 100~300ms），放到专用线程池，不占用事件循环和默认线程池
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", 2))
+# 排队 + 执行中的任务上限，超过时直接返回 503，避免登录风暴拖垮整个 worker
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", 16))
+PASSWORD_RETRY_AFTER = int(os.getenv("PASSWORD_RETRY_AFTER", 2))
+
+_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_WORKERS, thread_name_prefix="password"
+)
+_pending = 0
+
+password_queue_wait = LatencyStats("password_queue_wait")
+password_hash_latency = LatencyStats("password_hash_latency")
+password_rejected = Counter("password_rejected")
+password_pending = Gauge("password_executor_pending", fn=lambda: _pending)
+
+
+async def _run_bounded(func, *args):
+    """
+    在专用线程池中执行 func，队列满时抛出 503。
+    """
+    global _pending
+    if _pending >= PASSWORD_QUEUE_LIMIT:
+        password_rejected.inc()
+        logger.warning(f"Password executor saturated, pending={_pending}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, please retry later",
+            headers={"Retry-After": str(PASSWORD_RETRY_AFTER)},
+        )
+
+    submitted = time.perf_counter()
+
+    def timed():
+        started = time.perf_counter()
+        password_queue_wait.observe(started - submitted)
+        try:
+            return func(*args)
+        finally:
+            password_hash_latency.observe(time.perf_counter() - started)
+
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, timed)
+    finally:
+        _pending -= 1
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_bounded(pwd_context.verify, plain_password, hashed_password)
+
+
+async def hash_password_async(plain_password: str) -> str:
+    return await _run_bounded(pwd_context.hash, plain_password)
+
+
+def password_executor_stats() -> dict:
+    return {
+        "pending": _pending,
+        "queue_limit": PASSWORD_QUEUE_LIMIT,
+        "workers": PASSWORD_WORKERS,
+        "queue_wait": password_queue_wait.snapshot(),
+        "hash_latency": password_hash_latency.snapshot(),
+        "rejected": password_rejected.value,
+    }
@@ -0,0 +1,66 @@
+import os
+import time
+import logging
+from collections import deque
+from typing import Hashable
+
+from fastapi import HTTPException, status
+
+from utils.metrics import Counter
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    滑动窗口限流：每个 key 在 window 秒内最多 max_attempts 次。
+    状态保存在进程内，多 worker 时每个 worker 分别计数。
+    """
+
+    def __init__(
+        self, name: str, max_attempts: int, window: float, maxsize: int = 100000
+    ):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.window = window
+        self._attempts = TTLCache(f"{name}_keys", maxsize, window)
+        self.limited = Counter(f"{name}_limited")
+
+    def hit(self, key: Hashable):
+        """
+        记录一次尝试，超过限制时抛出 429，并在 Retry-After 中给出剩余等待秒数。
+        """
+        now = time.monotonic()
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            attempts = deque()
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+
+        if len(attempts) >= self.max_attempts:
+            self.limited.inc()
+            retry_after = max(1, int(attempts[0] + self.window - now) + 1)
+            logger.warning(f"Rate limited by {self.name}: {key}")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many login attempts, please retry later",
+                headers={"Retry-After": str(retry_after)},
+            )
+
+        attempts.append(now)
+        self._attempts.set(key, attempts)
+
+    def reset(self, key: Hashable):
+        self._attempts.pop(key)
+
+
+# 登录限流配置
+LOGIN_RATE_WINDOW = float(os.getenv("LOGIN_RATE_WINDOW", 60))
+LOGIN_RATE_LIMIT_PER_USER = int(os.getenv("LOGIN_RATE_LIMIT_PER_USER", 10))
+LOGIN_RATE_LIMIT_PER_IP = int(os.getenv("LOGIN_RATE_LIMIT_PER_IP", 30))
+
+login_user_limiter = RateLimiter(
+    "login_user", LOGIN_RATE_LIMIT_PER_USER, LOGIN_RATE_WINDOW
+)
+login_ip_limiter = RateLimiter("login_ip", LOGIN_RATE_LIMIT_PER_IP, LOGIN_RATE_WINDOW)
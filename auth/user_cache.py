@@ -0,0 +1,57 @@
+import os
+import time
+import hashlib
+import logging
+from typing import Optional
+
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# 用户记录缓存：TTL 要短，修改密码等操作之后最多这么久就会失效
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))
+USER_CACHE_MAXSIZE = int(os.getenv("USER_CACHE_MAXSIZE", 10000))
+# 已验证 token 的缓存，条目在 token 的 exp 到期时失效
+TOKEN_CACHE_MAXSIZE = int(os.getenv("TOKEN_CACHE_MAXSIZE", 10000))
+
+user_cache = TTLCache("auth_user_cache", USER_CACHE_MAXSIZE, USER_CACHE_TTL)
+token_cache = TTLCache("auth_token_cache", TOKEN_CACHE_MAXSIZE, 0)
+
+
+def _token_key(token: str) -> str:
+    # 不直接用 token 作为键，避免在内存里多保存一份明文 token
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def get_cached_token(token: str) -> Optional[dict]:
+    """返回已验证过的 token payload，未命中返回 None"""
+    return token_cache.get(_token_key(token))
+
+
+def cache_token(token: str, payload: dict):
+    """缓存验证通过的 token payload，直到 exp 为止"""
+    exp = payload.get("exp")
+    if exp is None:
+        return
+    token_cache.set(_token_key(token), payload, ttl=float(exp) - time.time())
+
+
+def get_cached_user(username: str) -> Optional[dict]:
+    return user_cache.get(username)
+
+
+def cache_user(user: dict):
+    user_cache.set(user["username"], user)
+
+
+def invalidate_user(username: str):
+    """
+    修改密码或删除用户后调用，清除该用户的记录缓存。
+    token 缓存只保存 payload，下次请求会重新从数据库加载用户。
+    """
+    user_cache.pop(username)
+    logger.info(f"Invalidated cached user: {username}")
+
+
+def auth_cache_stats() -> dict:
+    return {"user": user_cache.stats(), "token": token_cache.stats()}
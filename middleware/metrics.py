@@ -0,0 +1,29 @@
+import time
+from fastapi import Request
+
+from utils.metrics import histogram
+
+
+def register_http_metrics(app):
+    @app.middleware("http")
+    async def record_latency(request: Request, call_next):
+        """
+        按 方法、路由模板、状态码 记录 HTTP 请求耗时（http_request_seconds）。
+        使用路由模板（如 /ws）而不是实际路径作为标签，避免标签数量无限增长；
+        没有匹配到路由的请求记为 "unmatched"。
+        流式响应只统计到响应头发出为止。
+        """
+        start = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            histogram(
+                "http_request_seconds",
+                method=request.method,
+                route=getattr(route, "path", "unmatched"),
+                status=status_code,
+            ).observe(time.perf_counter() - start)
@@ -0,0 +1,596 @@
+"""
+端到端压测：在本进程内启动 app（uvicorn），ASR/TTS 使用桩模型，LLM 使用本地桩服务，
+MySQL 使用内存桩连接池，Redis 使用 fakeredis，不需要 GPU、网络和 docker。
+N 个并发用户各自循环 login → conversation（HTTP）→ synthesize → conversation（WebSocket），
+按阶段输出 p50/p95/p99 耗时和吞吐，并把结果连同 git 提交写入 JSON，便于跨提交比较。
+
+桩的耗时固定（STUB_ASR_DELAY_MS、STUB_TTS_DELAY_MS、--llm-token-ms），
+音频由固定种子生成，同一台机器上不同提交的结果可以直接比较。
+
+用法:
+    python3 scripts/bench_e2e.py --users 8 --iterations 5
+    python3 scripts/bench_e2e.py --users 32 --compare bench_results/e2e-<old>.json
+    python3 scripts/bench_e2e.py --redis-url redis://localhost:6379/15   # 真实 Redis
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import subprocess
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = "bench-password"
+STAGES = [
+    "login",
+    "conversation_first_audio",
+    "conversation",
+    "synthesize_first_audio",
+    "synthesize",
+    "ws_connect",
+    "ws_conversation_first_audio",
+    "ws_conversation",
+]
+
+
+def configure_env(args):
+    """在导入 app 之前设置环境变量：桩模型、LLM 地址、关闭缓存和限流"""
+    os.environ.update(
+        {
+            "ASR_BACKEND": "stub",
+            "TTS_BACKEND": "stub",
+            "INFERENCE_MODE": "local",
+            "LLM_API_URL": f"http://127.0.0.1:{args.llm_port}/v1/chat/completions",
+            "LLM_API_KEY": "stub",
+            "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+            # 每个用户在每轮都登录，不能被登录限流拦下
+            "LOGIN_RATE_LIMIT_PER_USER": "1000000",
+            "LOGIN_RATE_LIMIT_PER_IP": "1000000",
+            # 词库低水位为 0：启动时不调用 LLM 补充词库
+            "VOCAB_POOL_LOW": "0",
+        }
+    )
+    if args.ws_fragment_size:
+        # 服务端回复使用相同的分片大小
+        os.environ["WS_FRAGMENT_SIZE"] = str(args.ws_fragment_size)
+    if not args.tts_cache:
+        # 桩 LLM 每次回复相同，开启缓存时 TTS 阶段几乎都是命中
+        os.environ["TTS_CACHE_MEMORY_BYTES"] = "0"
+        os.environ["TTS_CACHE_DISK_BYTES"] = "0"
+
+
+class StubCursor:
+    """只实现 app 用到的查询：SELECT 1 和按用户名查用户"""
+
+    def __init__(self, users: dict):
+        self._users = users
+        self._row = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, query: str, args=None):
+        if "FROM users" in query:
+            self._row = self._users.get(args[0])
+        else:
+            self._row = {"1": 1}
+
+    async def fetchone(self):
+        return self._row
+
+
+class StubConnection:
+    def __init__(self, users: dict):
+        self._users = users
+
+    def cursor(self):
+        return StubCursor(self._users)
+
+
+class StubPool:
+    """aiomysql 连接池的内存替身，用户表为 {username: row}"""
+
+    def __init__(self, users: dict, maxsize: int = 10):
+        self._users = users
+        self._free = asyncio.Semaphore(maxsize)
+        self.maxsize = maxsize
+        self.size = maxsize
+
+    @property
+    def freesize(self) -> int:
+        return self._free._value
+
+    async def acquire(self):
+        await self._free.acquire()
+        return StubConnection(self._users)
+
+    def release(self, conn):
+        self._free.release()
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+def make_pcm(seconds: float, seed: int) -> bytes:
+    """固定种子生成 16kHz int16 PCM：类似语音的正弦波加噪声，首尾各 0.3s 静音"""
+    rng = np.random.default_rng(seed)
+    rate = 16000
+    t = np.arange(int(rate * seconds)) / rate
+    voice = 12000 * np.sin(2 * np.pi * 200 * t) + rng.integers(-4000, 4000, t.size)
+    silence = np.zeros(int(rate * 0.3))
+    pcm = np.concatenate([silence, voice, silence])
+    return np.clip(pcm, -20000, 20000).astype(np.int16).tobytes()
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+        self.errors = {stage: 0 for stage in STAGES}
+
+    def add(self, stage: str, seconds: float):
+        self.samples[stage].append(seconds)
+
+    @asynccontextmanager
+    async def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.errors[stage] += 1
+            raise
+        self.add(stage, time.perf_counter() - start)
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """最近秩法，结果只取决于样本本身"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(np.ceil(q * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    result = {}
+    for stage in STAGES:
+        values = sorted(recorder.samples[stage])
+        result[stage] = {
+            "count": len(values),
+            "errors": recorder.errors[stage],
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+            "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+            "throughput_rps": round(len(values) / elapsed, 3) if elapsed else 0.0,
+        }
+    return result
+
+
+def parse_server_stages(text: str) -> dict:
+    """从 /metrics 中取出 pipeline_stage_seconds 各阶段的次数和平均耗时"""
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        if not line.startswith("pipeline_stage_seconds_"):
+            continue
+        name, value = line.rsplit(" ", 1)
+        stage = name.split('stage="', 1)[1].split('"', 1)[0]
+        if name.startswith("pipeline_stage_seconds_sum"):
+            sums[stage] = float(value)
+        elif name.startswith("pipeline_stage_seconds_count"):
+            counts[stage] = int(float(value))
+    return {
+        stage: {
+            "count": counts[stage],
+            "mean_ms": round(sums.get(stage, 0.0) / counts[stage] * 1000, 3),
+        }
+        for stage in sorted(counts)
+        if counts[stage]
+    }
+
+
+async def read_stream(response, recorder: Recorder, first_stage: str, start: float):
+    first = True
+    size = 0
+    async for chunk in response.aiter_bytes():
+        if first and chunk:
+            first = False
+            recorder.add(first_stage, time.perf_counter() - start)
+        size += len(chunk)
+    return size
+
+
+async def ws_send(ws, message: bytes, fragment_size: int, state: dict):
+    """整条发送，或按 fragment_size 分片发送并遵守服务端的额度（TYPE_CREDIT）"""
+    from websocket.protocol import WebSocketProtocol
+
+    if not fragment_size:
+        await ws.send(message)
+        return
+    parsed = WebSocketProtocol.parse_message(message)
+    payload = parsed["payload"]
+    state["message_id"] += 1
+    for seq, offset in enumerate(range(0, len(payload), fragment_size)):
+        chunk = payload[offset : offset + fragment_size]
+        while state["credit"] < len(chunk):
+            # 上传过程中服务端只会回复 TYPE_CREDIT 或 TYPE_ERROR
+            await ws_handle(ws, await asyncio.wait_for(ws.recv(), 60), state)
+        state["credit"] -= len(chunk)
+        await ws.send(
+            WebSocketProtocol.build_fragment(
+                0,
+                state["message_id"],
+                seq,
+                parsed["type"],
+                chunk,
+                final=offset + fragment_size >= len(payload),
+            )
+        )
+
+
+async def ws_handle(ws, data: bytes, state: dict):
+    """处理一条服务端消息，返回完整的 (type, json, binary)，分片未完成时返回 None"""
+    from websocket.protocol import WebSocketProtocol
+
+    parsed = WebSocketProtocol.parse_message(data)
+    if not parsed:
+        return None
+    if parsed["type"] == WebSocketProtocol.TYPE_CREDIT:
+        state["credit"] += WebSocketProtocol.parse_credit(parsed["payload"])
+        return None
+    if parsed["type"] == WebSocketProtocol.TYPE_FRAGMENT:
+        assembler = state["assembler"]
+        fragment = WebSocketProtocol.parse_fragment(parsed["payload"])
+        parsed = assembler.feed(parsed["direction"], fragment)
+        if parsed is not None:
+            assembler.release(parsed["length"])
+        credit = assembler.grant()
+        if credit:
+            await ws.send(WebSocketProtocol.build_credit(0, credit))
+        if parsed is None:
+            return None
+    body = WebSocketProtocol.parse_data_payload(parsed["payload"])
+    if parsed["type"] == WebSocketProtocol.TYPE_ERROR or body["json_data"].get("error"):
+        raise RuntimeError(body["json_data"].get("error"))
+    return parsed["type"], body["json_data"], body["binary_data"]
+
+
+async def ws_conversation(ws, pcm: bytes, recorder: Recorder, args, state: dict):
+    from websocket.protocol import WebSocketProtocol
+
+    state["next_request_id"] = request_id = state.get("next_request_id", 0) + 1
+    message = WebSocketProtocol.build_message(
+        direction=0,
+        type_=WebSocketProtocol.TYPE_DATA,
+        json_data={
+            "request_id": request_id,
+            "data_type": "conversation",
+            "audio_format": "pcm_s16le",
+            "stream_audio": True,
+        },
+        binary_data=pcm,
+    )
+    start = time.perf_counter()
+    async with recorder.time("ws_conversation"):
+        await ws_send(ws, message, args.ws_fragment_size, state)
+        first = True
+        while True:
+            result = await ws_handle(ws, await asyncio.wait_for(ws.recv(), 60), state)
+            if result is None or result[0] not in (
+                WebSocketProtocol.TYPE_DATA,
+                WebSocketProtocol.TYPE_PUSH,
+            ):
+                continue
+            _, json_data, binary_data = result
+            if json_data.get("request_id") != request_id:
+                raise RuntimeError(f"Unexpected request_id in {json_data}")
+            if first and binary_data:
+                first = False
+                recorder.add("ws_conversation_first_audio", time.perf_counter() - start)
+            if json_data.get("audio_final"):
+                break
+
+
+async def run_user(index: int, args, base_url: str, recorder: Recorder, pcm: bytes):
+    import httpx
+    import websockets
+    from websocket.fragmentation import WS_FRAGMENT_WINDOW, FragmentAssembler
+
+    username = f"bench_user_{index}"
+    rng = random.Random(args.seed + index)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        ws = None
+        try:
+            for iteration in range(args.iterations):
+                # 错开各用户的请求，避免所有用户完全同步
+                await asyncio.sleep(rng.uniform(0, args.think_ms / 1000))
+                try:
+                    async with recorder.time("login"):
+                        response = await client.post(
+                            "/login", data={"username": username, "password": PASSWORD}
+                        )
+                        response.raise_for_status()
+                    token = response.json()["access_token"]
+                    headers = {"Authorization": f"Bearer {token}"}
+
+                    start = time.perf_counter()
+                    async with recorder.time("conversation"):
+                        async with client.stream(
+                            "POST",
+                            "/conversation",
+                            headers=headers,
+                            files={"file": ("speech.pcm", pcm)},
+                            data={"audio_format": "pcm_s16le"},
+                        ) as response:
+                            response.raise_for_status()
+                            await read_stream(
+                                response, recorder, "conversation_first_audio", start
+                            )
+
+                    start = time.perf_counter()
+                    async with recorder.time("synthesize"):
+                        async with client.stream(
+                            "POST",
+                            "/synthesize",
+                            headers=headers,
+                            data={"text": args.synthesize_text},
+                        ) as response:
+                            response.raise_for_status()
+                            await read_stream(
+                                response, recorder, "synthesize_first_audio", start
+                            )
+
+                    if ws is None:
+                        url = base_url.replace("http", "ws", 1) + f"/ws?token={token}"
+                        async with recorder.time("ws_connect"):
+                            ws = await websockets.connect(url, max_size=None)
+                        ws_state = {
+                            "message_id": 0,
+                            "credit": WS_FRAGMENT_WINDOW,
+                            "assembler": FragmentAssembler(),
+                        }
+                    await ws_conversation(ws, pcm, recorder, args, ws_state)
+                except Exception as e:
+                    if args.verbose:
+                        print(f"{username} iteration {iteration}: {e!r}")
+        finally:
+            if ws is not None:
+                await ws.close()
+
+
+def git_info() -> dict:
+    def git(*cmd):
+        try:
+            return subprocess.run(
+                ["git", *cmd], cwd=ROOT, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "subject": git("log", "-1", "--format=%s"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def print_report(result: dict, baseline: dict = None):
+    header = f"{'stage':<30}{'count':>7}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rps':>9}"
+    if baseline:
+        header += f"{'Δp50':>9}{'Δp95':>9}"
+    print(header)
+    for stage, stats in result["stages"].items():
+        line = (
+            f"{stage:<30}{stats['count']:>7}{stats['errors']:>5}"
+            f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+            f"{stats['throughput_rps']:>9.2f}"
+        )
+        old = (baseline or {}).get("stages", {}).get(stage)
+        if old:
+            for key in ("p50_ms", "p95_ms"):
+                if old[key]:
+                    line += f"{(stats[key] - old[key]) / old[key] * 100:>+8.1f}%"
+                else:
+                    line += f"{'-':>9}"
+        print(line)
+    if result["server_stages"]:
+        print("\nserver-side pipeline stages (from /metrics):")
+        for stage, stats in result["server_stages"].items():
+            print(f"  {stage:<28}{stats['count']:>7}{stats['mean_ms']:>10.1f} ms mean")
+    print(
+        f"\n{result['config']['users']} users x {result['config']['iterations']} "
+        f"iterations in {result['elapsed_seconds']:.1f}s, commit "
+        f"{(result['git']['commit'] or 'unknown')[:10]}"
+        f"{' (dirty)' if result['git']['dirty'] else ''}"
+    )
+
+
+async def main(args):
+    configure_env(args)
+    # 先于 app 的模块配置日志（services.chat_sessions 导入时会调用 basicConfig）
+    logging.basicConfig(level=os.environ["LOG_LEVEL"].upper())
+
+    import uvicorn
+    from aiohttp import web
+
+    import utils.redis_client as redis_module
+
+    if args.redis_url:
+        import redis.asyncio as redis
+
+        redis_module.redis_client = redis.Redis.from_url(
+            args.redis_url, decode_responses=True
+        )
+    else:
+        import fakeredis
+
+        redis_module.redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    # redis_client 替换之后才导入 app，各模块拿到的是替换后的客户端
+    import app as app_module
+    from auth import hash_password_async
+    from stub_llm_server import create_app
+
+    hashed = await hash_password_async(PASSWORD)
+    users = {
+        f"bench_user_{i}": {
+            "username": f"bench_user_{i}",
+            "hashed_password": hashed,
+        }
+        for i in range(args.users)
+    }
+
+    async def create_stub_pool():
+        return StubPool(users, maxsize=args.db_pool_size)
+
+    app_module.create_db_pool = create_stub_pool
+
+    llm_runner = web.AppRunner(
+        create_app(token_delay=args.llm_token_ms / 1000), access_log=None
+    )
+    await llm_runner.setup()
+    await web.TCPSite(llm_runner, "127.0.0.1", args.llm_port).start()
+
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app_module.app,
+            host="127.0.0.1",
+            port=args.port,
+            log_level="warning",
+        )
+    )
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if server_task.done():
+            raise SystemExit("uvicorn failed to start")
+        await asyncio.sleep(0.05)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    pcm = make_pcm(args.audio_seconds, args.seed)
+    recorder = Recorder()
+    try:
+        import httpx
+
+        # 等模型（桩）加载完成，避免第一批请求包含加载耗时
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            for _ in range(100):
+                if (await client.get("/readyz")).status_code == 200:
+                    break
+                await asyncio.sleep(0.1)
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(run_user(i, args, base_url, recorder, pcm) for i in range(args.users))
+        )
+        elapsed = time.perf_counter() - start
+
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            metrics_text = (await client.get("/metrics")).text
+    finally:
+        server.should_exit = True
+        await server_task
+        await llm_runner.cleanup()
+
+    from utils.stub_models import (
+        STUB_ASR_DELAY_MS,
+        STUB_TTS_DELAY_MS,
+        STUB_TTS_MS_PER_CHAR,
+    )
+
+    result = {
+        "benchmark": "e2e",
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": git_info(),
+        "host": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "config": {
+            "users": args.users,
+            "iterations": args.iterations,
+            "seed": args.seed,
+            "audio_seconds": args.audio_seconds,
+            "think_ms": args.think_ms,
+            "llm_token_ms": args.llm_token_ms,
+            "stub_asr_delay_ms": STUB_ASR_DELAY_MS,
+            "stub_tts_delay_ms": STUB_TTS_DELAY_MS,
+            "stub_tts_ms_per_char": STUB_TTS_MS_PER_CHAR,
+            "tts_cache": args.tts_cache,
+            "ws_fragment_size": args.ws_fragment_size,
+            "redis": "real" if args.redis_url else "fakeredis",
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "stages": summarize(recorder, elapsed),
+        "server_stages": parse_server_stages(metrics_text),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != result["config"]:
+            print("warning: baseline was run with a different configuration\n")
+    print_report(result, baseline)
+
+    output = args.output
+    if output is None:
+        commit = (result["git"]["commit"] or "unknown")[:10]
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(ROOT, "bench_results", f"e2e-{commit}-{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end benchmark with stubs")
+    parser.add_argument("--users", type=int, default=8, help="并发用户数")
+    parser.add_argument("--iterations", type=int, default=5, help="每个用户的循环次数")
+    parser.add_argument("--audio-seconds", type=float, default=1.5)
+    parser.add_argument(
+        "--think-ms", type=float, default=200, help="每轮开始前的随机等待上限"
+    )
+    parser.add_argument(
+        "--llm-token-ms", type=float, default=20, help="桩 LLM 每个 token 的耗时"
+    )
+    parser.add_argument(
+        "--synthesize-text",
+        default="The quick brown fox jumps over the lazy dog. It was a sunny day.",
+    )
+    parser.add_argument("--tts-cache", action="store_true", help="保留 TTS 音频缓存")
+    parser.add_argument(
+        "--ws-fragment-size",
+        type=int,
+        default=0,
+        help="WebSocket 上传按该大小分片（TYPE_FRAGMENT），0 为整条发送",
+    )
+    parser.add_argument("--db-pool-size", type=int, default=10)
+    parser.add_argument(
+        "--redis-url", default=None, help="使用真实 Redis 而不是 fakeredis"
+    )
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--llm-port", type=int, default=18081)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default=None, help="结果 JSON 路径")
+    parser.add_argument("--compare", default=None, help="与之前的结果 JSON 比较")
+    parser.add_argument("--verbose", action="store_true")
+    asyncio.run(main(parser.parse_args()))
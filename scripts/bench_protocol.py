@@ -0,0 +1,136 @@
+"""
+WebSocket 协议编解码基准：对比旧实现（切片 + 拼接）和当前实现（memoryview + pack_into）
+在 1-10 MB 音频负载下每帧的耗时和峰值内存（tracemalloc）。
+峰值内存以负载大小为单位（peak/size），约等于一帧处理过程中同时存在的音频副本数。
+
+用法:
+    python3 scripts/bench_protocol.py
+    python3 scripts/bench_protocol.py --sizes 1 5 10 --repeat 50
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import struct
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from websocket.protocol import WebSocketProtocol  # noqa: E402
+
+JSON_DATA = {"data_type": "conversation", "audio_format": "pcm_s16le"}
+MB = 1024 * 1024
+
+
+def legacy_parse(data: bytes):
+    """旧实现：payload、json、binary 各切片复制一次"""
+    length = struct.unpack("!I", data[2:6])[0]
+    payload = data[6 : 6 + length]
+    offset = 0
+    json_length = struct.unpack("!I", payload[offset : offset + 4])[0]
+    offset += 4
+    json_obj = json.loads(payload[offset : offset + json_length].decode("utf-8"))
+    offset += json_length
+    binary_length = struct.unpack("!I", payload[offset : offset + 4])[0]
+    offset += 4
+    binary_data = payload[offset : offset + binary_length]
+    return json_obj, binary_data
+
+
+def legacy_build(direction: int, type_: int, json_data: dict, binary_data):
+    """旧实现：getvalue() 复制一次，每个 + 再复制一次"""
+    json_bytes = json.dumps(json_data).encode("utf-8")
+    binary_bytes = (
+        binary_data.getvalue() if isinstance(binary_data, io.BytesIO) else binary_data
+    )
+    payload = (
+        struct.pack("!I", len(json_bytes))
+        + json_bytes
+        + struct.pack("!I", len(binary_bytes))
+        + binary_bytes
+    )
+    return struct.pack("!BBI", direction, type_, len(payload)) + payload
+
+
+def current_parse(data: bytes):
+    message = WebSocketProtocol.parse_message(data)
+    parsed = WebSocketProtocol.parse_data_payload(message["payload"])
+    return parsed["json_data"], parsed["binary_data"]
+
+
+def current_build(direction: int, type_: int, json_data: dict, binary_data):
+    return WebSocketProtocol.build_message(direction, type_, json_data, binary_data)
+
+
+def measure(func, repeat: int):
+    """返回 (每次平均耗时秒, 单次调用的峰值新增字节)"""
+    func()  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    seconds = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak - baseline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket protocol codec benchmark")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 10])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(
+        f"{'case':<22}{'size':>7}{'impl':>9}{'time ms':>10}"
+        f"{'peak MB':>10}{'peak/size':>11}"
+    )
+    for size_mb in args.sizes:
+        size = int(size_mb * MB)
+        audio = os.urandom(size)
+        frame = bytes(
+            WebSocketProtocol.build_message(
+                0, WebSocketProtocol.TYPE_DATA, JSON_DATA, audio
+            )
+        )
+        assert legacy_parse(frame) == (JSON_DATA, audio)
+        json_obj, view = current_parse(frame)
+        assert json_obj == JSON_DATA and view == audio
+        assert bytes(current_build(1, 3, JSON_DATA, io.BytesIO(audio))) == legacy_build(
+            1, 3, JSON_DATA, io.BytesIO(audio)
+        )
+
+        mp3 = io.BytesIO(audio)
+        cases = [
+            ("parse upload", lambda: legacy_parse(frame), lambda: current_parse(frame)),
+            (
+                "build reply (BytesIO)",
+                lambda: legacy_build(1, 3, JSON_DATA, mp3),
+                lambda: current_build(1, 3, JSON_DATA, mp3),
+            ),
+            (
+                "build reply (bytes)",
+                lambda: legacy_build(1, 3, JSON_DATA, audio),
+                lambda: current_build(1, 3, JSON_DATA, audio),
+            ),
+        ]
+        for name, legacy, current in cases:
+            for impl, func in (("legacy", legacy), ("current", current)):
+                seconds, peak = measure(func, args.repeat)
+                print(
+                    f"{name:<22}{size_mb:>6g}M{impl:>9}{seconds * 1000:>10.3f}"
+                    f"{peak / MB:>10.2f}{peak / size:>10.2f}x"
+                )
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+会话存储基准：对比旧方案（分布式锁 + 整个会话 JSON SET）和新方案
+（RPUSH + LTRIM + HSET 一次 pipeline）每轮对话的耗时和写入字节数。
+
+默认使用 fakeredis（只比较写入字节数和客户端开销），
+指定 --redis-url 时连接真实 Redis，耗时包含网络往返。
+
+用法:
+    python3 scripts/bench_session_storage.py --turns 200
+    python3 scripts/bench_session_storage.py --redis-url redis://localhost:6379/15
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import services.chat_sessions as chat_sessions  # noqa: E402
+from services.chat_sessions import ChatSession, system_prompt  # noqa: E402
+
+USER_TEXT = "Yesterday I go to the museum with my friend and we see many old paintings."
+ASSISTANT_TEXT = (
+    "You should say: Yesterday I went to the museum with my friend and we saw "
+    "many old paintings. That sounds delightful! Which artistic movement do you "
+    "find most captivating? | captivating: /ˈkæptɪveɪtɪŋ/,迷人的 |"
+)
+
+
+class ByteCounter:
+    """包装 Redis 连接的 send_packed_command，统计发往 Redis 的字节数"""
+
+    def __init__(self, client):
+        self.bytes = 0
+        pool = client.connection_pool
+        original = pool.get_connection
+
+        async def get_connection(*args, **kwargs):
+            conn = await original(*args, **kwargs)
+            if not getattr(conn, "_bench_wrapped", False):
+                send = conn.send_packed_command
+
+                async def send_packed_command(command, *a, **kw):
+                    chunks = [command] if isinstance(command, bytes) else command
+                    self.bytes += sum(len(c) for c in chunks)
+                    return await send(command, *a, **kw)
+
+                conn.send_packed_command = send_packed_command
+                conn._bench_wrapped = True
+            return conn
+
+        pool.get_connection = get_connection
+
+
+async def legacy_save(client, username: str, messages: list):
+    """
+    旧方案：加锁后把整个会话序列化为一个 JSON 字符串写入。
+    redis-py 的 Lock 释放时执行 Lua 脚本（fakeredis 默认不支持），
+    这里用 SET NX PX / DEL 模拟，往返次数相同。
+    """
+    lock_key = f"lock:chat:{username}"
+    await client.set(lock_key, "1", nx=True, px=5000)
+    try:
+        session_data = {
+            "system_prompt": system_prompt,
+            "max_tokens": chat_sessions.MAX_TOKENS_ONCE,
+            "messages": messages,
+        }
+        await client.set(f"chat_session:{username}", json.dumps(session_data))
+    finally:
+        await client.delete(lock_key)
+
+
+async def bench_legacy(client, counter: ByteCounter, turns: int):
+    counter.bytes = 0
+    session = ChatSession(username=None)
+    latencies = []
+    for _ in range(turns):
+        for role, text in (("user", USER_TEXT), ("assistant", ASSISTANT_TEXT)):
+            await session.add_message(role, text)
+            start = time.perf_counter()
+            await legacy_save(client, "bench_legacy", list(session.messages))
+            latencies.append(time.perf_counter() - start)
+    return latencies, counter.bytes
+
+
+async def bench_append(client, counter: ByteCounter, turns: int):
+    counter.bytes = 0
+    session = ChatSession(username="bench_append")
+    latencies = []
+    for _ in range(turns):
+        for role, text in (("user", USER_TEXT), ("assistant", ASSISTANT_TEXT)):
+            message = {"role": role, "content": text}
+            tokens = session._append(message)
+            session._truncate_to_max_tokens()
+            session._unsaved.append({**message, "tokens": tokens})
+            start = time.perf_counter()
+            await session._save_to_redis()
+            latencies.append(time.perf_counter() - start)
+    written = counter.bytes
+    start = time.perf_counter()
+    loaded = await ChatSession.load_from_redis("bench_append")
+    load_seconds = time.perf_counter() - start
+    assert loaded.get_messages() == session.get_messages(), "window mismatch"
+    assert loaded._total_tokens() == session._total_tokens(), "token total mismatch"
+    return latencies, written, load_seconds
+
+
+def report(name: str, latencies: list, written: int, turns: int):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{name:<8} writes={len(latencies):5d}  "
+        f"p50={statistics.median(latencies) * 1000:7.3f} ms  "
+        f"p95={p95 * 1000:7.3f} ms  "
+        f"bytes/turn={written / turns:9.0f}  total={written / 1024:9.1f} KiB"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Chat session storage benchmark")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--redis-url", default=None)
+    args = parser.parse_args()
+
+    if args.redis_url:
+        import redis.asyncio as redis
+
+        client = redis.Redis.from_url(args.redis_url, decode_responses=True)
+    else:
+        import fakeredis
+
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    chat_sessions.redis_client = client
+    await client.delete(
+        "chat_session:bench_legacy",
+        "chat_session:bench_append:messages",
+        "chat_session:bench_append:meta",
+    )
+
+    counter = ByteCounter(client)
+    legacy_latencies, legacy_bytes = await bench_legacy(client, counter, args.turns)
+    append_latencies, append_bytes, load_seconds = await bench_append(
+        client, counter, args.turns
+    )
+    report("legacy", legacy_latencies, legacy_bytes, args.turns)
+    report("append", append_latencies, append_bytes, args.turns)
+    print(f"load window: {load_seconds * 1000:.3f} ms")
+    await client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""
+本地 LLM 桩服务，兼容 OpenAI /v1/chat/completions，支持 "stream": true 的 SSE 输出。
+不需要网络和 API key，用于测试流式对话和压测。
+
+用法:
+    python3 scripts/stub_llm_server.py [port] [token_delay_ms]
+    LLM_API_URL=http://127.0.0.1:8081/v1/chat/completions uvicorn app:app
+"""
+import sys
+import json
+import asyncio
+from aiohttp import web
+
+REPLY = (
+    "That sounds like a wonderful weekend. You should say: I went to the zoo yesterday. "
+    "Which animal impressed you the most? Some people find the behaviour of primates "
+    "remarkably sophisticated! "
+    "| sophisticated: /səˈfɪstɪkeɪtɪd/,复杂的，老练的 "
+    "| primate: /ˈpraɪmeɪt/,灵长类动物 |"
+)
+
+
+def _tokens(text: str):
+    # 按单词切分，模拟 LLM 逐 token 输出
+    words = text.split(" ")
+    for i, word in enumerate(words):
+        yield word if i == len(words) - 1 else word + " "
+
+
+def create_app(
+    token_delay: float = 0.02, reply: str = REPLY, fail_first: int = 0
+) -> web.Application:
+    """fail_first: 前 N 个请求返回 503，用于测试重试和熔断"""
+    state = {"requests": 0}
+
+    async def chat_completions(request: web.Request):
+        payload = await request.json()
+        state["requests"] += 1
+        if state["requests"] <= fail_first:
+            return web.json_response({"error": "overloaded"}, status=503)
+        if not payload.get("stream"):
+            await asyncio.sleep(token_delay * len(reply.split()))
+            return web.json_response(
+                {"choices": [{"message": {"role": "assistant", "content": reply}}]}
+            )
+
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+        )
+        await response.prepare(request)
+        for token in _tokens(reply):
+            await asyncio.sleep(token_delay)
+            chunk = {"choices": [{"delta": {"content": token}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app["state"] = state
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    delay_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    web.run_app(create_app(delay_ms / 1000), host="127.0.0.1", port=port)
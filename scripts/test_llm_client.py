@@ -0,0 +1,126 @@
+"""
+LLM 客户端测试：启动本地 LLM 桩服务，验证 503 重试、熔断、对冲请求和耗时统计。
+不加载 ASR/TTS 模型，不需要 Redis。
+
+用法:
+    python3 scripts/test_llm_client.py
+"""
+
+import os
+import sys
+import asyncio
+
+from aiohttp import web
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+PORT = 18082
+os.environ["LLM_API_URL"] = f"http://127.0.0.1:{PORT}/v1/chat/completions"
+os.environ.setdefault("LLM_API_KEY", "stub")
+os.environ["LLM_RETRY_BASE_DELAY"] = "0.01"
+os.environ["LLM_MAX_RETRIES"] = "2"
+os.environ["LLM_BREAKER_FAILURES"] = "3"
+os.environ["LLM_BREAKER_RESET"] = "0.5"
+os.environ["LLM_HEDGE_DELAY_MS"] = "50"
+
+from stub_llm_server import REPLY, create_app  # noqa: E402
+import services.llm_client as llm_module  # noqa: E402
+from services.llm_client import LLMClient  # noqa: E402
+
+PAYLOAD = {"model": "stub", "messages": [{"role": "user", "content": "hi"}]}
+
+
+async def serve(app: web.Application) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    return runner
+
+
+async def test_retry():
+    # 前两个请求 503，第三次成功
+    app = create_app(token_delay=0, fail_first=2)
+    runner = await serve(app)
+    client = LLMClient()
+    try:
+        assert await client.complete(PAYLOAD, endpoint="test") == REPLY
+        assert app["state"]["requests"] == 3
+        assert client.retries.value == 2
+        assert client.breaker.state == "closed"
+        assert client.stats()["latency"]["test"]["count"] == 1
+    finally:
+        await client.close()
+        await runner.cleanup()
+    print("retry ok")
+
+
+async def test_circuit_breaker():
+    app = create_app(token_delay=0, fail_first=100)
+    runner = await serve(app)
+    client = LLMClient()
+    try:
+        try:
+            await client.complete(PAYLOAD)
+            raise AssertionError("expected failure")
+        except HTTPException as e:
+            assert e.status_code == 502, e.status_code
+        assert client.breaker.state == "open"
+        requests = app["state"]["requests"]
+
+        # 熔断期间不访问上游
+        try:
+            await client.complete(PAYLOAD)
+            raise AssertionError("expected circuit open")
+        except HTTPException as e:
+            assert e.status_code == 503 and "Retry-After" in e.headers
+        assert app["state"]["requests"] == requests
+
+        # 冷却后放行探测请求，上游恢复后关闭熔断
+        app["state"]["requests"] = 1000
+        await asyncio.sleep(0.6)
+        assert await client.complete(PAYLOAD) == REPLY
+        assert client.breaker.state == "closed"
+    finally:
+        await client.close()
+        await runner.cleanup()
+    print("circuit breaker ok")
+
+
+async def test_hedge():
+    # 第一个请求很慢，对冲请求先返回
+    app = web.Application()
+    state = {"requests": 0}
+
+    async def handler(request):
+        state["requests"] += 1
+        if state["requests"] == 1:
+            await asyncio.sleep(2)
+        return web.json_response({"choices": [{"message": {"content": "fast"}}]})
+
+    app.router.add_post("/v1/chat/completions", handler)
+    runner = await serve(app)
+    client = LLMClient()
+    try:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        assert await client.complete(PAYLOAD) == "fast"
+        assert loop.time() - start < 1, "hedged request did not win"
+        assert client.hedged.value == 1
+    finally:
+        await client.close()
+        await runner.cleanup()
+    print("hedge ok")
+
+
+async def main():
+    assert llm_module.LLM_HEDGE_DELAY_MS == 50
+    await test_retry()
+    await test_circuit_breaker()
+    await test_hedge()
+    print("Test sucessfully")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
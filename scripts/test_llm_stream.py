@@ -0,0 +1,57 @@
+"""
+流式 LLM 回复测试：启动本地 LLM 桩服务，验证 SSE 解析、分句以及在 "|" 处停止。
+不加载 ASR/TTS 模型，不需要 Redis。
+
+用法:
+    python3 scripts/test_llm_stream.py
+"""
+import os
+import sys
+import time
+import asyncio
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+PORT = 18081
+os.environ["LLM_API_URL"] = f"http://127.0.0.1:{PORT}/v1/chat/completions"
+os.environ.setdefault("LLM_API_KEY", "stub")
+os.environ.setdefault("LLM_MODEL", "stub")
+
+from stub_llm_server import REPLY, create_app  # noqa: E402
+from services.chat_sessions import ChatSession  # noqa: E402
+from services.llm_client import llm_client  # noqa: E402
+from services.reply_stream import ReplySentenceSplitter, reply_sentences  # noqa: E402
+
+
+async def test_llm_stream():
+    runner = web.AppRunner(create_app(token_delay=0.01))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+    try:
+        session = ChatSession(username=None)
+        splitter = ReplySentenceSplitter()
+        start = time.perf_counter()
+        sentences = []
+        async for sentence in reply_sentences(
+            session.conversation_with_llm_stream("I go to zoo yesterday"), splitter
+        ):
+            elapsed = time.perf_counter() - start
+            print(f"{elapsed * 1000:7.1f} ms  {sentence}")
+            sentences.append(sentence)
+    finally:
+        await llm_client.close()
+        await runner.cleanup()
+
+    assert splitter.full_text == REPLY, "full text mismatch"
+    assert splitter.reply_text == REPLY[: REPLY.index("|")].strip()
+    assert all("|" not in s for s in sentences), "trailer leaked into sentences"
+    assert " ".join(sentences) == splitter.reply_text
+    print("Test sucessfully")
+
+
+if __name__ == "__main__":
+    asyncio.run(test_llm_stream())
@@ -1,34 +1,47 @@
 import json
 import os
+import time
+import uuid
 import redis.asyncio as redis
 from collections import deque
-from typing import Dict, List
+from typing import AsyncIterator, Dict, List
 import logging
 import asyncio
-import aiohttp
-from fastapi import HTTPException
+from services.llm_client import llm_client
+from utils.redis_client import redis_client
+from utils.ttl_cache import TTLCache
+from utils.tokens import count_tokens
+from utils.metrics import Gauge, stage
 
 # env vars passed from docker-compose, Dockerfile to here
-LLM_API_URL = os.getenv("LLM_API_URL")
-LLM_API_KEY = os.getenv("LLM_API_KEY")
 LLM_MODEL = os.getenv("LLM_MODEL")
-HTTP_PROXY = os.getenv("HTTP_PROXY")
 
 MAX_TOKENS_ONCE = int(os.getenv("MAX_TOKENS_ONCE", 3000))
 MAX_TOKENS_TOTAL = int(os.getenv("MAX_TOKENS_TOTAL", 30000))
 
+# 每个 worker 内存中最多缓存的会话数，超出时淘汰最久未使用的会话
+SESSION_CACHE_MAXSIZE = int(os.getenv("SESSION_CACHE_MAXSIZE", 1000))
+# 会话空闲超过该秒数后从内存中移除（Redis 中仍保留，下次访问重新加载）
+SESSION_IDLE_TTL = int(os.getenv("SESSION_IDLE_TTL", 1800))
+# Redis 中会话的过期时间，每次写入时刷新
+SESSION_REDIS_TTL = int(os.getenv("SESSION_REDIS_TTL", 7 * 24 * 3600))
+# 后台清理内存中空闲会话的间隔
+SESSION_SWEEP_INTERVAL = int(os.getenv("SESSION_SWEEP_INTERVAL", 60))
+# 一次性迁移：给旧版本留下的没有过期时间的会话键补上 EXPIRE，
+# 只由拿到锁的一个 worker 执行，完成后写入标记，之后启动不再扫描
+SESSION_TTL_BACKFILL_LOCK = "chat_session_ttl_backfill:lock"
+SESSION_TTL_BACKFILL_DONE = "chat_session_ttl_backfill:done"
+# 会话写入后通过该频道通知其他 worker 丢弃本地缓存
+SESSION_INVALIDATE_CHANNEL = os.getenv(
+    "SESSION_INVALIDATE_CHANNEL", "chat_session:invalidate"
+)
+# Redis 消息列表最多保留的消息条数（LTRIM），加载时只读取上下文窗口内的消息
+SESSION_HISTORY_MAX = int(os.getenv("SESSION_HISTORY_MAX", 200))
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Redis 客户端（异步）
-redis_client = redis.Redis(
-    host="redis",  # 替换为你的 Redis 主机
-    port=6379,  # 替换为你的 Redis 端口
-    db=0,
-    decode_responses=True,  # 自动解码为字符串
-)
-
 system_prompt = (
     "You are a helpful English teacher to have a chat with a student, alway reply in English. "
     "Correct error on grammar, for example student sai 'Why you did not to school? I go to school yesterday',"
@@ -40,6 +53,12 @@ system_prompt = (
     " This part is not mandatory if there is no."
 )
 
+# 尚未完成的 write-behind 写入，关闭时需要等待
+_pending_saves = set()
+# 本进程的标识，忽略自己发出的失效通知
+WORKER_ID = uuid.uuid4().hex
+
+
 # TODO: don't allow username with special chars
 class ChatSession:
     def __init__(
@@ -58,8 +77,20 @@ class ChatSession:
         self.max_tokens = max_tokens
         self.username = username
         self.messages = deque([self.system_message])  # 初始化包含 system 消息
-        if username:
-            asyncio.create_task(self._save_to_redis())  # 异步保存到 Redis
+        # 与 messages 一一对应的 token 数，每条消息只计算一次，并维护总数
+        self._token_counts = deque([count_tokens(system_prompt)])
+        self._token_total = self._token_counts[0]
+        self._dirty = False
+        self._save_task: asyncio.Task = None
+        # 尚未写入 Redis 的新消息（带 tokens 字段），下次 flush 时 RPUSH
+        self._unsaved: List[Dict] = []
+        # system_prompt 和 max_tokens 不变，只在第一次写入时写入 hash
+        self._meta_saved = False
+        # 上次写入后从上下文窗口移除的消息数，写入时从 Redis 中的窗口大小减去
+        self._evicted = 0
+        # 会话版本号，每次写入 Redis 加 1；与 Redis 中的版本不一致说明本地副本已过期
+        self.version = 0
+        self.stale = False
 
     @classmethod
     def get_instance(cls) -> "ChatSessionManager":
@@ -74,10 +105,6 @@ class ChatSession:
         :param my_words: 用户输入
         :return: LLM 回复
         """
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {LLM_API_KEY}",
-        }
         payload = {
             "model": LLM_MODEL,
             "messages": self.get_messages() + [{"role": "user", "content": my_words}],
@@ -85,34 +112,35 @@ class ChatSession:
             # "messages": [{"role": "assistant", "content": system_prompt}] + [{"role": "user", "content": my_words}],
             "max_tokens": MAX_TOKENS_ONCE,
         }
+        with stage("llm").time():
+            return await llm_client.complete(payload, endpoint="chat")
 
-        manager = ChatSessionManager.get_instance()
-        # 优先使用全局 session，如果没有则创建临时 session
-        if getattr(manager, "http_session", None):
-            return await self._send_llm_request(manager.http_session, headers, payload)
-        else:
-            async with aiohttp.ClientSession() as session:
-                return await self._send_llm_request(session, headers, payload)
-
-    async def _send_llm_request(self, session, headers, payload):
+    async def conversation_with_llm_stream(self, my_words: str) -> AsyncIterator[str]:
+        """
+        与 LLM 交互（流式，"stream": true），逐个产出回复的文本片段。
+        :param my_words: 用户输入
+        """
+        payload = {
+            "model": LLM_MODEL,
+            "messages": self.get_messages() + [{"role": "user", "content": my_words}],
+            "max_tokens": MAX_TOKENS_ONCE,
+        }
+        # 只累计等待上游的时间：yield 之后调用方合成语音、等待客户端的时间不计入 llm 阶段
+        tokens = llm_client.stream(payload, endpoint="chat_stream")
+        upstream = 0.0
         try:
-            async with session.post(
-                LLM_API_URL, headers=headers, json=payload, proxy=HTTP_PROXY
-            ) as response:
-                if response.status != 200:
-                    logger.error(
-                        f"LLM API request failed: {response.status} - {response.reason}"
-                    )
-                    raise HTTPException(
-                        status_code=500, detail="Failed to communicate with LLM"
-                    )
-                data = await response.json()
-                # logger.info(f"response is {response}")
-                content = data["choices"][0]["message"]["content"]
-                return content
-        except aiohttp.ClientError as e:
-            logger.error(f"LLM API error: {str(e)}")
-            raise HTTPException(status_code=500, detail="LLM API error")
+            while True:
+                start = time.perf_counter()
+                try:
+                    token = await tokens.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    upstream += time.perf_counter() - start
+                yield token
+        finally:
+            await tokens.aclose()
+            stage("llm").observe(upstream)
 
     # TODO: for simplicity, don't consider multiple chat with same username
     async def add_message(self, role: str, content: str):
@@ -121,103 +149,220 @@ class ChatSession:
         :param role: 消息角色（user/assistant）
         :param content: 消息内容
         """
-        self.messages.append({"role": role, "content": content})
+        message = {"role": role, "content": content}
+        tokens = self._append(message)
         self._truncate_to_max_tokens()
         if self.username:
+            self._unsaved.append({**message, "tokens": tokens})
+            self.schedule_save()
+
+    def schedule_save(self):
+        """
+        write-behind：标记会话已修改，由后台 task 写入 Redis，调用方不等待。
+        写入进行中又有新修改时，当前写入完成后再写一次，多次修改合并为一次写入。
+        """
+        self._dirty = True
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._flush())
+            _pending_saves.add(self._save_task)
+            self._save_task.add_done_callback(_pending_saves.discard)
+
+    async def _flush(self):
+        while self._dirty:
+            self._dirty = False
             await self._save_to_redis()
 
+    async def flush(self):
+        """等待尚未完成的写入"""
+        if self._save_task is not None:
+            await self._save_task
+
+    @property
+    def has_pending_writes(self) -> bool:
+        """还有尚未写入 Redis 的修改（包括正在写入的）"""
+        return (
+            bool(self._unsaved)
+            or self._dirty
+            or (self._save_task is not None and not self._save_task.done())
+        )
+
     def get_messages(self) -> List[Dict[str, str]]:
         """
         获取当前会话的所有消息。
         """
         return list(self.messages)
 
-    def _estimate_tokens(self, message: Dict[str, str]) -> int:
+    def _append(self, message: Dict[str, str], tokens: int = None) -> int:
         """
-        估算单个消息的 token 数（简化为单词数 * 1.3）。
+        追加一条消息并累加 token 总数，返回该消息的 token 数。
+        已知 token 数（例如从 Redis 加载）时不再重新计算。
         """
-        return int(len(message["content"].split()) * 1.3)
+        if tokens is None:
+            tokens = count_tokens(message["content"])
+        self.messages.append(message)
+        self._token_counts.append(tokens)
+        self._token_total += tokens
+        return tokens
 
     def _total_tokens(self) -> int:
         """
-        计算所有消息的总 token 数。
+        所有消息的总 token 数。
         """
-        return sum(self._estimate_tokens(m) for m in self.messages)
+        return self._token_total
 
     def _truncate_to_max_tokens(self):
         """
         如果总 token 数超过限制，移除最早的 user/assistant 消息，保留 system 消息。
         """
-        while self._total_tokens() > self.max_tokens and len(self.messages) > 1:
-            self.messages.popleft()
-            if self.messages[0]["role"] == "system":
-                continue
-            else:
-                break
+        while self._token_total > self.max_tokens and len(self.messages) > 1:
+            del self.messages[1]
+            self._token_total -= self._token_counts[1]
+            del self._token_counts[1]
+            self._evicted += 1
+
+    @staticmethod
+    def _keys(username: str):
+        """会话在 Redis 中的两个键：消息列表和元数据 hash"""
+        return f"chat_session:{username}:messages", f"chat_session:{username}:meta"
 
     async def _save_to_redis(self):
         """
-        将会话数据保存到 Redis，使用分布式锁防止并发覆盖。
+        把新消息追加到 Redis 列表（RPUSH + LTRIM），并更新元数据 hash，
+        在一个 MULTI/EXEC pipeline 中一次往返完成，不需要分布式锁。
+        每次只写入新增的消息，写入量与历史长度无关。
+        hash 中的 window 是上下文窗口内的消息数，按增量（新增 - 移除）HINCRBY 更新，
+        多个 worker 同时写入时增量可以叠加。
+        同一个 pipeline 中递增版本号并发布失效通知；如果递增后的版本号不是本地版本 + 1，
+        说明其他 worker 在此期间写入过，本地副本标记为过期，下次访问时从 Redis 重新加载。
         """
         if not self.username:
             return
-        lock = redis_client.lock(
-            f"lock:chat:{self.username}",
-            timeout=5,  # 锁 5 秒后自动释放
-            blocking_timeout=1,  # 最多等待 1 秒获取锁
-        )
-        async with lock:
-            try:
-                session_data = {
-                    "system_prompt": self.system_message["content"],
-                    "max_tokens": self.max_tokens,
-                    "messages": list(self.messages),
-                }
-                await redis_client.set(
-                    f"chat_session:{self.username}", json.dumps(session_data)
+        messages_key, meta_key = self._keys(self.username)
+        pending, self._unsaved = self._unsaved, []
+        evicted, self._evicted = self._evicted, 0
+        try:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                if pending:
+                    pipe.rpush(messages_key, *(json.dumps(m) for m in pending))
+                    pipe.ltrim(messages_key, -SESSION_HISTORY_MAX, -1)
+                    pipe.expire(messages_key, SESSION_REDIS_TTL)
+                if not self._meta_saved:
+                    pipe.hset(
+                        meta_key,
+                        mapping={
+                            "system_prompt": self.system_message["content"],
+                            "max_tokens": self.max_tokens,
+                        },
+                    )
+                pipe.hincrby(meta_key, "window", len(pending) - evicted)
+                pipe.hincrby(meta_key, "version", 1)
+                pipe.expire(meta_key, SESSION_REDIS_TTL)
+                pipe.publish(
+                    SESSION_INVALIDATE_CHANNEL,
+                    json.dumps({"username": self.username, "worker": WORKER_ID}),
                 )
-                logger.debug(f"Saved session for user: {self.username}")
-            except redis.RedisError as e:
-                logger.error(
-                    f"Failed to save session to Redis for user {self.username}: {str(e)}"
+                results = await pipe.execute()
+            self._meta_saved = True
+            version = results[-3]
+            if version != self.version + 1:
+                self.stale = True
+                logger.info(
+                    f"Session for user {self.username} was modified by another worker"
                 )
+            self.version = version
+            logger.debug(f"Saved {len(pending)} messages for user: {self.username}")
+        except redis.RedisError as e:
+            # 写入失败时保留未写入的消息，下次写入时重试
+            self._unsaved[:0] = pending
+            self._evicted += evicted
+            logger.error(
+                f"Failed to save session to Redis for user {self.username}: {str(e)}"
+            )
 
     @classmethod
     async def load_from_redis(cls, username: str) -> "ChatSession":
         """
-        从 Redis 加载会话，如果不存在则返回 None。
+        从 Redis 加载会话，只读取上下文窗口内的最近消息，如果不存在则返回 None。
+        旧格式（整个会话一个 JSON 字符串）的会话会被迁移到新格式。
         """
+        messages_key, meta_key = cls._keys(username)
         try:
-            session_data = await redis_client.get(f"chat_session:{username}")
-            if session_data:
-                data = json.loads(session_data)
-                session = cls(
-                    system_prompt=data["system_prompt"],
-                    max_tokens=data["max_tokens"],
-                    username=username,
-                )
-                session.messages = deque(data["messages"])
-                logger.debug(f"Loaded session for user: {username}")
-                return session
-            logger.debug(f"No session found for user: {username}")
-            return None
-        except (redis.RedisError, json.JSONDecodeError) as e:
+            meta = await redis_client.hgetall(meta_key)
+            if not meta:
+                return await cls._migrate_legacy(username)
+            window = max(int(meta.get("window", 0)), 0)
+            items = (
+                await redis_client.lrange(messages_key, -window, -1) if window else []
+            )
+            session = cls(
+                system_prompt=meta["system_prompt"],
+                max_tokens=int(meta["max_tokens"]),
+                username=username,
+            )
+            for item in items:
+                message = json.loads(item)
+                tokens = message.pop("tokens", None)
+                session._append(message, tokens)
+            # 并发写入时窗口可能略大，按 token 限制截断，移除的数量在下次写入时同步
+            session._truncate_to_max_tokens()
+            session._meta_saved = True
+            session.version = int(meta.get("version", 0))
+            logger.debug(f"Loaded session for user: {username}")
+            return session
+        except (redis.RedisError, json.JSONDecodeError, KeyError) as e:
             logger.error(
                 f"Failed to load session from Redis for user {username}: {str(e)}"
             )
             return None
 
+    @classmethod
+    async def _migrate_legacy(cls, username: str) -> "ChatSession":
+        """把旧格式 chat_session:{username} 的 JSON 会话转换为列表 + hash"""
+        legacy_key = f"chat_session:{username}"
+        session_data = await redis_client.get(legacy_key)
+        if not session_data:
+            logger.debug(f"No session found for user: {username}")
+            return None
+        data = json.loads(session_data)
+        session = cls(
+            system_prompt=data["system_prompt"],
+            max_tokens=data["max_tokens"],
+            username=username,
+        )
+        for message in data["messages"]:
+            if message["role"] != "system":
+                tokens = session._append(message)
+                session._unsaved.append({**message, "tokens": tokens})
+        session._truncate_to_max_tokens()
+        await session._save_to_redis()
+        if not session._unsaved:
+            await redis_client.delete(legacy_key)
+        logger.info(f"Migrated legacy session for user: {username}")
+        return session
+
 
 # uvicorn --workers N 多 worker 不会导致多线程竞争使用单例的问题，
-# 但会导致每个进程有自己的 ChatSessionManager 实例，会话通过redis来保持同步
+# 但会导致每个进程有自己的 ChatSessionManager 实例，会话通过redis来保持同步：
+# 每次写入递增版本号并在 SESSION_INVALIDATE_CHANNEL 上发布通知，
+# 其他 worker 收到后丢弃本地缓存；订阅断开期间每次读取都检查 Redis 中的版本号
 class ChatSessionManager:
     _instance = None
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(ChatSessionManager, cls).__new__(cls)
-            cls._instance.sessions = {}
-            cls._instance.http_session = None
+            # 容量和空闲时间有上限的 LRU，内存占用不随用户总数增长
+            cls._instance.sessions = TTLCache(
+                "chat_sessions", SESSION_CACHE_MAXSIZE, SESSION_IDLE_TTL
+            )
+            cls._instance.sweeper_task = None
+            cls._instance.listener_task = None
+            cls._instance.backfill_task = None
+            # 订阅正常时本地缓存由失效通知保持一致，否则读取时检查版本号
+            cls._instance.listening = False
+            cls._instance.cached_gauge = Gauge(
+                "chat_sessions_cached", fn=lambda: len(cls._instance.sessions)
+            )
             logger.info("ChatSessionManager singleton initialized")
         return cls._instance
 
@@ -241,31 +386,144 @@ class ChatSessionManager:
         :param max_tokens: 最大 token 数（用于新会话）
         :return: ChatSession 对象
         """
-        if username in self.sessions:
-            return self.sessions[username]
+        session = self.sessions.get(username)
+        if session is not None and not await self._is_current(session):
+            session = None
+        if session is None:
+            session = await ChatSession.load_from_redis(username)
+        if session is None:
+            session = ChatSession(
+                system_prompt=system_prompt, max_tokens=max_tokens, username=username
+            )
+            session.schedule_save()
+        # 每次访问都重新放入缓存，刷新空闲时间
+        self.sessions.set(username, session)
+        return session
 
-        session = await ChatSession.load_from_redis(username)
-        if session:
-            self.sessions[username] = session
-            return session
+    async def _is_current(self, session: ChatSession) -> bool:
+        """本地缓存的会话是否仍是最新版本"""
+        if session.stale:
+            return False
+        if self.listening or session.has_pending_writes:
+            # 订阅正常时过期的会话已被移除；本地有未写入的修改时由写入检测冲突
+            return True
+        try:
+            _, meta_key = ChatSession._keys(session.username)
+            version = await redis_client.hget(meta_key, "version")
+        except redis.RedisError as e:
+            logger.warning(f"Failed to check session version: {e}")
+            return True
+        return int(version or 0) == session.version
 
-        session = ChatSession(
-            system_prompt=system_prompt, max_tokens=max_tokens, username=username
+    def start_background_tasks(self):
+        """在 lifespan 中启动后台清理任务、失效通知订阅和旧会话键的过期时间迁移"""
+        if self.sweeper_task is None or self.sweeper_task.done():
+            self.sweeper_task = asyncio.create_task(self._sweep_loop())
+        if self.listener_task is None or self.listener_task.done():
+            self.listener_task = asyncio.create_task(self._listen_invalidations())
+        if self.backfill_task is None:
+            self.backfill_task = asyncio.create_task(self._backfill_redis_ttl())
+
+    async def stop(self):
+        """停止后台任务，并等待所有 write-behind 写入完成"""
+        for task in (self.sweeper_task, self.listener_task, self.backfill_task):
+            if task is not None:
+                task.cancel()
+        if _pending_saves:
+            await asyncio.gather(*_pending_saves, return_exceptions=True)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+            try:
+                await self.cleanup_sessions()
+            except Exception as e:
+                logger.error(f"Session sweep failed: {e}")
+
+    async def _listen_invalidations(self):
+        """订阅失效通知，丢弃被其他 worker 修改过的本地会话；断开后重连"""
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(SESSION_INVALIDATE_CHANNEL)
+                # 订阅建立前可能错过通知，丢弃本地缓存的会话；
+                # 还有修改未写入的会话保留，否则重新加载会读到缺少最新一轮的历史
+                for username, session in self.sessions.items():
+                    if not session.has_pending_writes:
+                        self.sessions.pop(username)
+                self.listening = True
+                logger.info(f"Subscribed to {SESSION_INVALIDATE_CHANNEL}")
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    data = json.loads(message["data"])
+                    if data["worker"] != WORKER_ID:
+                        self.sessions.pop(data["username"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Session invalidation listener failed: {e}")
+            finally:
+                self.listening = False
+                await pubsub.aclose()
+            await asyncio.sleep(1)
+
+    async def cleanup_sessions(self):
+        """
+        移除内存中空闲超时的会话（未写完的修改由各自的 write-behind task 继续写入）。
+        Redis 中的会话键写入时都带 EXPIRE，这里不访问 Redis。
+        """
+        expired = self.sessions.expire()
+        logger.debug(
+            f"Cleaned up sessions: evicted {expired} idle, cached {len(self.sessions)}"
         )
-        self.sessions[username] = session
-        return session
 
-    # TODO: clean up sessions using asyncio.create_task
-    # async def cleanup_sessions(self, ttl_seconds: int = 3600):
-    #     async with self._redis as r:
-    #         keys = await r.keys("session:*")
-    #         current_time = time.time()
-    #         for key in keys:
-    #             session_data = await r.get(key)
-    #             session = json.loads(session_data)
-    #             if session.get("last_active", current_time) <= current_time - ttl_seconds:
-    #                 await r.delete(key)
-    #         logger.debug(f"Cleaned up sessions, remaining: {len(await r.keys('session:*'))}")
+    async def _backfill_redis_ttl(self):
+        """
+        一次性迁移：用 SCAN 遍历 Redis，给旧版本留下的没有过期时间的会话键补上 EXPIRE。
+        每页的 TTL 和 EXPIRE 各用一次 pipeline；多 worker 时只有拿到锁的 worker 执行，
+        完成后写入 SESSION_TTL_BACKFILL_DONE，之后启动直接跳过。
+        """
+        try:
+            if await redis_client.exists(SESSION_TTL_BACKFILL_DONE):
+                return
+            if not await redis_client.set(
+                SESSION_TTL_BACKFILL_LOCK, WORKER_ID, nx=True, ex=600
+            ):
+                return
+        except redis.RedisError as e:
+            logger.warning(f"Skipped session TTL backfill: {e}")
+            return
+        try:
+            fixed = 0
+            cursor = 0
+            while True:
+                cursor, keys = await redis_client.scan(
+                    cursor, match="chat_session:*", count=500
+                )
+                if keys:
+                    async with redis_client.pipeline(transaction=False) as pipe:
+                        for key in keys:
+                            pipe.ttl(key)
+                        ttls = await pipe.execute()
+                        missing = [key for key, ttl in zip(keys, ttls) if ttl == -1]
+                        for key in missing:
+                            pipe.expire(key, SESSION_REDIS_TTL)
+                        if missing:
+                            await pipe.execute()
+                    fixed += len(missing)
+                await redis_client.expire(SESSION_TTL_BACKFILL_LOCK, 600)
+                if cursor == 0:
+                    break
+            await redis_client.set(SESSION_TTL_BACKFILL_DONE, "1")
+            logger.info(f"Session TTL backfill done, set expiry on {fixed} keys")
+        except redis.RedisError as e:
+            logger.error(f"Session TTL backfill failed: {e}")
+        finally:
+            try:
+                await redis_client.delete(SESSION_TTL_BACKFILL_LOCK)
+            except redis.RedisError:
+                pass
 
     # async def add_message(self, username: str, role: str, content: str):
     #     """
@@ -1,31 +1,111 @@
 import io
 import logging
-from typing import Dict, Union
+from typing import AsyncIterator, Dict, Optional, Tuple, Union
 from websocket.protocol import WebSocketProtocol
-from services.chat_sessions import ChatSessionManager
+from services.chat_sessions import ChatSession, ChatSessionManager
+from services.reply_stream import ReplySentenceSplitter, reply_sentences
+from utils.admission import admit
 from utils.transcribe import transcribe_file
-from utils.synthesize import synthesize_text
+from utils.audio import PCM_SAMPLE_RATE
+from utils.synthesize import synthesize_text, synthesize_sentence_stream
 
 logger = logging.getLogger(__name__)
 
 
+async def stream_conversation_turn(
+    chat_session: ChatSession, transcription: str, splitter: ReplySentenceSplitter
+) -> AsyncIterator[Tuple[str, bytes]]:
+    """
+    一轮流式对话：LLM 流式输出，每凑齐一句立即送入 TTS，按顺序产出 (句子, MP3 数据)。
+    生词部分（"|" 之后）不朗读。结束（包括中途关闭）后把去掉生词部分的回复写入会话历史，
+    完整回复可从 splitter.full_text 获取。
+    """
+    await chat_session.add_message("user", transcription)
+    tokens = chat_session.conversation_with_llm_stream(transcription)
+    sentences = reply_sentences(tokens, splitter)
+    audio_stream = synthesize_sentence_stream(sentences)
+    try:
+        async for sentence, audio in audio_stream:
+            yield sentence, audio
+    finally:
+        # 中途结束（客户端断开、出错）时逐层关闭，立即释放 LLM 流、准入名额和未完成的合成
+        await audio_stream.aclose()
+        await sentences.aclose()
+        await tokens.aclose()
+        logger.info(f"response from LLM is: {splitter.full_text}")
+        # 中途结束时记录已生成的部分，会话历史中 user 和 assistant 保持成对
+        if splitter.reply_text:
+            await chat_session.add_message("assistant", splitter.reply_text)
+
+
+async def stream_conversation_audio(
+    username: str, transcription: str
+) -> AsyncIterator[bytes]:
+    """
+    HTTP /conversation 使用：先等到第一段音频再返回迭代器，
+    这样 LLM 请求失败时仍能以 HTTPException 返回错误状态码，而不是中断的音频流。
+    """
+    chat_session = await ChatSessionManager.get_instance().get_session(username)
+    turn = stream_conversation_turn(chat_session, transcription, ReplySentenceSplitter())
+    try:
+        _, first = await turn.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def audio():
+        try:
+            if first is None:
+                return
+            yield first
+            async for _, chunk in turn:
+                yield chunk
+        finally:
+            # 客户端断开时 StreamingResponse 只关闭本生成器，turn 需要显式关闭
+            await turn.aclose()
+
+    return audio()
+
+
 async def handle_conversation(
     parsed_data: Dict[str, Union[Dict, bytes]],
     username: str,
-) -> bytes:
+    context: Optional[Dict] = None,
+) -> Optional[bytes]:
     """
     处理 WebSocket 的 conversation 消息（TYPE_DATA, data_type=conversation）。
     执行音频转录、LLM 交互和语音合成，返回二进制响应。
+    json_data 中 audio_format 为 "pcm_s16le" 时，binary_data 是 16kHz 单声道原始 PCM，
+    直接送入模型，不经过容器解码。
+    json_data 中 stream_audio 为 true 时，LLM 和 TTS 流水线执行，按句子流式发送音频，
+    见 _stream_reply_audio。
     """
     logger.info("It is conversation audio from client")
-    audio_file = io.BytesIO(parsed_data["binary_data"])
-    logger.info(f"audio_file size {len(audio_file.getvalue())}")
+    # 任一阶段过载时在转录之前就拒绝
+    admit("asr", "llm", "tts")
+    json_data = parsed_data["json_data"]
+    audio_format = json_data.get("audio_format")
+    binary_data = parsed_data["binary_data"]
+    logger.info(f"audio size {len(binary_data)}, format {audio_format}")
 
     # 使用单例获取 ChatSessionManager
     chat_session_manager = ChatSessionManager.get_instance()
 
-    transcription = await transcribe_file(audio_file)
+    if audio_format:
+        transcription = await transcribe_file(
+            binary_data,
+            audio_format=audio_format,
+            sample_rate=json_data.get("sample_rate", PCM_SAMPLE_RATE),
+        )
+    else:
+        transcription = await transcribe_file(io.BytesIO(binary_data))
     chat_session = await chat_session_manager.get_session(username)
+
+    if json_data.get("stream_audio") and context is not None:
+        await _stream_reply_audio(
+            context["send_bytes"], chat_session, transcription
+        )
+        return None
+
     await chat_session.add_message("user", transcription)
     response = await chat_session.conversation_with_llm(transcription)
     logger.info(f"response from LLM is: {response}")
@@ -46,3 +126,75 @@ async def handle_conversation(
     return WebSocketProtocol.build_message(
         direction=1, type_=WebSocketProtocol.TYPE_DATA, **response_data
     )
+
+
+async def _stream_reply_audio(send_bytes, chat_session: ChatSession, transcription: str):
+    """
+    LLM 边生成边合成，按句子流式发送回复音频：
+    - 第一句合成完后发送 TYPE_DATA，json 为
+      {"A": 转录文本, "text": 句子, "audio_seq": 0, "audio_final": false}，带第一段音频
+    - 之后每句发送 TYPE_PUSH，json 为
+      {"data_type": "conversation_audio", "text": 句子, "audio_seq": n, "audio_final": false}
+    - 最后发送一个不带音频的 TYPE_PUSH，audio_final 为 true，"B" 为 LLM 完整回复（含生词部分）
+    各段音频均为完整的 MP3 帧，客户端按 audio_seq 顺序拼接或依次播放。
+    """
+    splitter = ReplySentenceSplitter()
+    seq = 0
+    async for sentence, chunk in stream_conversation_turn(
+        chat_session, transcription, splitter
+    ):
+        if seq == 0:
+            message = WebSocketProtocol.build_message(
+                direction=1,
+                type_=WebSocketProtocol.TYPE_DATA,
+                json_data={
+                    "A": transcription,
+                    "text": sentence,
+                    "audio_seq": 0,
+                    "audio_final": False,
+                },
+                binary_data=chunk,
+            )
+        else:
+            message = WebSocketProtocol.build_message(
+                direction=0,
+                type_=WebSocketProtocol.TYPE_PUSH,
+                json_data={
+                    "data_type": "conversation_audio",
+                    "text": sentence,
+                    "audio_seq": seq,
+                    "audio_final": False,
+                },
+                binary_data=chunk,
+            )
+        await send_bytes(message)
+        seq += 1
+
+    if seq == 0:
+        # 没有可合成的内容，仍然回复文本
+        await send_bytes(
+            WebSocketProtocol.build_message(
+                direction=1,
+                type_=WebSocketProtocol.TYPE_DATA,
+                json_data={
+                    "A": transcription,
+                    "B": splitter.full_text,
+                    "audio_seq": 0,
+                    "audio_final": True,
+                },
+            )
+        )
+        return
+
+    await send_bytes(
+        WebSocketProtocol.build_message(
+            direction=0,
+            type_=WebSocketProtocol.TYPE_PUSH,
+            json_data={
+                "data_type": "conversation_audio",
+                "B": splitter.full_text,
+                "audio_seq": seq,
+                "audio_final": True,
+            },
+        )
+    )
@@ -0,0 +1,400 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, Optional
+
+import aiohttp
+from fastapi import HTTPException
+
+from utils.admission import StageQueue
+from utils.metrics import Counter, Histogram, counter, histogram
+from utils.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# env vars passed from docker-compose, Dockerfile to here
+LLM_API_URL = os.getenv("LLM_API_URL")
+LLM_API_KEY = os.getenv("LLM_API_KEY")
+HTTP_PROXY = os.getenv("HTTP_PROXY")
+
+# 连接池：长连接复用，避免每次请求重新建立 TLS 连接
+LLM_POOL_LIMIT = int(os.getenv("LLM_POOL_LIMIT", 100))
+LLM_POOL_LIMIT_PER_HOST = int(os.getenv("LLM_POOL_LIMIT_PER_HOST", 32))
+LLM_KEEPALIVE_TIMEOUT = float(os.getenv("LLM_KEEPALIVE_TIMEOUT", 60))
+LLM_DNS_CACHE_TTL = int(os.getenv("LLM_DNS_CACHE_TTL", 300))
+# 超时（秒）：建立连接、两次读取之间的间隔、整个请求
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 5))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", 60))
+LLM_TOTAL_TIMEOUT = float(os.getenv("LLM_TOTAL_TIMEOUT", 180))
+# 429/5xx/连接错误时的重试次数，退避时间为 [0, min(最大值, 基数 * 2^n)] 内的随机值
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 0.5))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", 8))
+# 对冲请求：非流式请求超过该时间（毫秒）未返回时再发一个相同请求，先返回的生效；0 关闭
+LLM_HEDGE_DELAY_MS = int(os.getenv("LLM_HEDGE_DELAY_MS", 0))
+# 同时进行的上游请求数上限，以及超过上限时排队的请求数上限（见 utils/admission.py）
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", 64))
+# 熔断：连续失败次数达到阈值后熔断，期间直接返回 503，冷却后放行一个探测请求
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", 5))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", 30))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# LLM 阶段的准入队列：按优先级和用户排队，对话和单词生成共用
+llm_stage = StageQueue("llm", LLM_MAX_CONCURRENCY, LLM_QUEUE_SIZE)
+
+
+class UpstreamError(Exception):
+    """上游返回可重试的错误（429/5xx、连接错误、超时）"""
+
+    def __init__(self, message: str, status: Optional[int] = None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    熔断器：closed（正常）→ 连续失败达到阈值 → open（拒绝请求）
+    → 冷却时间到 → half-open（只放行一个探测请求）→ 成功则 closed，失败则再次 open。
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.rejected = Counter(f"{name}_rejected")
+
+    def allow(self):
+        """请求前调用，熔断期间抛出 503"""
+        if self.state == "open":
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                self._reject(remaining)
+            self.state = "half_open"
+            logger.info(f"Circuit breaker {self.name} half-open")
+        if self.state == "half_open":
+            if self._probing:
+                self._reject(self.reset_timeout)
+            self._probing = True
+
+    def _reject(self, retry_after: float):
+        self.rejected.inc()
+        raise HTTPException(
+            status_code=503,
+            detail="LLM temporarily unavailable",
+            headers={"Retry-After": str(max(1, int(retry_after)))},
+        )
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info(f"Circuit breaker {self.name} closed")
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(
+                    f"Circuit breaker {self.name} open after {self.failures} failures"
+                )
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """请求未得出结果（例如被取消）时释放探测名额"""
+        self._probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "rejected": self.rejected.value,
+        }
+
+
+class LLMClient:
+    """
+    OpenAI 兼容接口的 LLM 客户端，对话和单词生成共用：
+    共享连接池、超时、带抖动的重试、可选的对冲请求、熔断、并发上限，
+    并按 endpoint（调用方）记录耗时直方图。
+    """
+
+    def __init__(self, api_url: str = LLM_API_URL, api_key: str = LLM_API_KEY):
+        self.api_url = api_url
+        self.api_key = api_key
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._stage = llm_stage
+        self.breaker = CircuitBreaker("llm", LLM_BREAKER_FAILURES, LLM_BREAKER_RESET)
+        self.latency: Dict[str, Histogram] = {}
+        self.retries = Counter("llm_retries")
+        self.hedged = Counter("llm_hedged")
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # 第一次使用时创建（需要在事件循环中），lifespan 关闭时 close()
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=LLM_POOL_LIMIT,
+                limit_per_host=LLM_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=LLM_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=LLM_DNS_CACHE_TTL,
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=LLM_TOTAL_TIMEOUT,
+                sock_connect=LLM_CONNECT_TIMEOUT,
+                sock_read=LLM_READ_TIMEOUT,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _histogram(self, name: str, metric: str = "llm_request_seconds") -> Histogram:
+        # self.latency 的键用于 /health/llm，同一直方图也以 endpoint 标签输出到 /metrics
+        key = name if metric == "llm_request_seconds" else f"{name}_first_token"
+        if key not in self.latency:
+            self.latency[key] = histogram(metric, endpoint=name)
+        return self.latency[key]
+
+    def _count_tokens(
+        self, endpoint: str, payload: dict, data: Optional[dict], text: str
+    ):
+        """记录 prompt/completion token 数：优先使用上游返回的 usage，否则本地估算"""
+        usage = (data or {}).get("usage") or {}
+        prompt = usage.get("prompt_tokens")
+        if prompt is None:
+            prompt = sum(
+                count_tokens(str(message.get("content", "")))
+                for message in payload.get("messages", [])
+            )
+        completion = usage.get("completion_tokens")
+        if completion is None:
+            completion = count_tokens(text)
+        counter("llm_tokens", endpoint=endpoint, kind="prompt").inc(prompt)
+        counter("llm_tokens", endpoint=endpoint, kind="completion").inc(completion)
+
+    def _headers(self) -> dict:
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+        }
+
+    def _check_config(self):
+        if not self.api_url or not self.api_key:
+            logger.error("LLM configuration missing")
+            raise HTTPException(status_code=500, detail="Server configuration error")
+
+    async def _check_status(self, response: aiohttp.ClientResponse):
+        if response.status == 200:
+            return
+        error_text = await response.text()
+        logger.error(f"LLM API Error: {response.status} - {error_text[:500]}")
+        if response.status in RETRYABLE_STATUS:
+            retry_after = response.headers.get("Retry-After")
+            raise UpstreamError(
+                f"LLM returned {response.status}",
+                status=response.status,
+                retry_after=(
+                    float(retry_after)
+                    if retry_after and retry_after.isdigit()
+                    else None
+                ),
+            )
+        # 4xx（请求本身有问题）不重试，也不计入熔断
+        raise HTTPException(status_code=response.status, detail=error_text)
+
+    async def _post_json(self, payload: dict) -> dict:
+        try:
+            async with self.session.post(
+                self.api_url, headers=self._headers(), json=payload, proxy=HTTP_PROXY
+            ) as response:
+                await self._check_status(response)
+                return await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise UpstreamError(f"LLM connection error: {e!r}")
+
+    async def _hedged_post_json(self, payload: dict) -> dict:
+        """超过 LLM_HEDGE_DELAY_MS 未返回时再发一个请求，取先成功的结果"""
+        if LLM_HEDGE_DELAY_MS <= 0:
+            return await self._post_json(payload)
+
+        first = asyncio.ensure_future(self._post_json(payload))
+        done, _ = await asyncio.wait({first}, timeout=LLM_HEDGE_DELAY_MS / 1000)
+        # 并发已满时不再对冲，避免在上游变慢时放大负载
+        if done or not self._stage.try_acquire():
+            return await first
+
+        self.hedged.inc()
+        pending = {first, asyncio.ensure_future(self._post_json(payload))}
+        try:
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            self._stage.release()
+
+    async def _with_retries(self, call, endpoint: str):
+        """熔断检查 + 重试；UpstreamError 重试，重试用尽后转换为 HTTPException"""
+        attempt = 0
+        while True:
+            self.breaker.allow()
+            try:
+                result = await call()
+            except UpstreamError as e:
+                self.breaker.record_failure()
+                if attempt >= LLM_MAX_RETRIES:
+                    logger.error(
+                        f"LLM {endpoint} failed after {attempt + 1} tries: {e}"
+                    )
+                    if e.status == 429:
+                        raise HTTPException(
+                            status_code=503,
+                            detail="LLM rate limited",
+                            headers={"Retry-After": str(int(e.retry_after or 1))},
+                        )
+                    raise HTTPException(status_code=502, detail="LLM upstream error")
+                delay = random.uniform(
+                    0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2**attempt)
+                )
+                if e.retry_after is not None:
+                    delay = max(delay, min(e.retry_after, LLM_RETRY_MAX_DELAY))
+                attempt += 1
+                self.retries.inc()
+                logger.warning(
+                    f"LLM {endpoint} retry {attempt}/{LLM_MAX_RETRIES} in {delay:.2f}s: {e}"
+                )
+                await asyncio.sleep(delay)
+                continue
+            except HTTPException:
+                # 4xx 说明上游可用
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def complete(self, payload: dict, endpoint: str = "chat") -> str:
+        """
+        非流式请求，返回回复文本。
+        :param payload: OpenAI chat/completions 请求体
+        :param endpoint: 调用方名称，用于分别统计耗时
+        """
+        self._check_config()
+        start = time.perf_counter()
+        try:
+            async with self._stage.slot():
+                data = await self._with_retries(
+                    lambda: self._hedged_post_json(payload), endpoint
+                )
+        finally:
+            self._histogram(endpoint).observe(time.perf_counter() - start)
+        try:
+            content = data["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            logger.error(f"Unexpected LLM response format: {data}")
+            raise HTTPException(
+                status_code=500, detail="Invalid response format from LLM"
+            )
+        self._count_tokens(endpoint, payload, data, content or "")
+        return content
+
+    async def stream(self, payload: dict, endpoint: str = "chat") -> AsyncIterator[str]:
+        """
+        流式请求（"stream": true），解析 SSE 响应并逐个产出文本片段。
+        只在收到第一个字节之前重试，已经开始输出后出错直接抛出。
+        额外记录首个片段的耗时（llm_first_token_seconds）。
+        """
+        self._check_config()
+        payload = {**payload, "stream": True}
+        start = time.perf_counter()
+        first_token = True
+        tokens = []
+        async with self._stage.slot():
+            response = await self._with_retries(
+                lambda: self._open_stream(payload), endpoint
+            )
+            try:
+                async for line in response.content:
+                    line = line.strip()
+                    if not line.startswith(b"data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(data)
+                        token = chunk["choices"][0]["delta"].get("content")
+                    except (json.JSONDecodeError, KeyError, IndexError) as e:
+                        logger.warning(f"Skipped malformed LLM stream chunk: {e}")
+                        continue
+                    if token:
+                        if first_token:
+                            first_token = False
+                            self._histogram(
+                                endpoint, "llm_first_token_seconds"
+                            ).observe(time.perf_counter() - start)
+                        tokens.append(token)
+                        yield token
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"LLM stream error: {e!r}")
+                self.breaker.record_failure()
+                raise HTTPException(status_code=502, detail="LLM stream interrupted")
+            finally:
+                response.release()
+                self._histogram(endpoint).observe(time.perf_counter() - start)
+                self._count_tokens(endpoint, payload, None, "".join(tokens))
+
+    async def _open_stream(self, payload: dict) -> aiohttp.ClientResponse:
+        try:
+            response = await self.session.post(
+                self.api_url, headers=self._headers(), json=payload, proxy=HTTP_PROXY
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise UpstreamError(f"LLM connection error: {e!r}")
+        try:
+            await self._check_status(response)
+        except BaseException:
+            response.release()
+            raise
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "circuit_breaker": self.breaker.stats(),
+            "retries": self.retries.value,
+            "hedged": self.hedged.value,
+            "in_flight": self._stage.in_flight,
+            "queued": self._stage.waiting,
+            "latency": {
+                name: histogram.snapshot() for name, histogram in self.latency.items()
+            },
+        }
+
+
+llm_client = LLMClient()
@@ -0,0 +1,78 @@
+import re
+import logging
+from typing import AsyncIterator, List
+
+logger = logging.getLogger(__name__)
+
+# 回复末尾的生词部分以 "|" 开头，例如 " | bureaucracy: /bjʊəˈrɒkrəsi/,官僚主义 |"
+TRAILER_DELIMITER = "|"
+# 句末标点后跟空白即认为一句结束
+_SENTENCE_END_RE = re.compile(r"[.!?;。！？；]\s")
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?;。！？；])\s+")
+
+
+class ReplySentenceSplitter:
+    """
+    把 LLM 流式返回的文本片段拼成完整句子。
+    遇到 "|" 后停止产出句子（生词部分不需要朗读），但继续收集完整回复文本。
+    """
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._buffer = ""
+        self._in_trailer = False
+
+    @property
+    def full_text(self) -> str:
+        """LLM 的完整回复，包括生词部分"""
+        return "".join(self._parts)
+
+    @property
+    def reply_text(self) -> str:
+        """去掉生词部分后的回复"""
+        text = self.full_text
+        index = text.find(TRAILER_DELIMITER)
+        return (text[:index] if index != -1 else text).strip()
+
+    def feed(self, token: str) -> List[str]:
+        """送入一个文本片段，返回已经完整的句子"""
+        self._parts.append(token)
+        if self._in_trailer:
+            return []
+
+        self._buffer += token
+        index = self._buffer.find(TRAILER_DELIMITER)
+        if index != -1:
+            self._in_trailer = True
+            rest, self._buffer = self._buffer[:index], ""
+            return [s.strip() for s in _SENTENCE_SPLIT_RE.split(rest) if s.strip()]
+
+        sentences = []
+        while True:
+            match = _SENTENCE_END_RE.search(self._buffer)
+            if not match:
+                break
+            sentence = self._buffer[: match.start() + 1].strip()
+            self._buffer = self._buffer[match.end() :]
+            if sentence:
+                sentences.append(sentence)
+        return sentences
+
+    def finish(self) -> List[str]:
+        """LLM 输出结束，返回剩余的最后一句"""
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest and not self._in_trailer else []
+
+
+async def reply_sentences(
+    tokens: AsyncIterator[str], splitter: ReplySentenceSplitter
+) -> AsyncIterator[str]:
+    """
+    把 LLM 的 token 流转换成句子流，每凑齐一句立即产出，
+    以便送入 TTS，不必等待 LLM 输出完整回复。
+    """
+    async for token in tokens:
+        for sentence in splitter.feed(token):
+            yield sentence
+    for sentence in splitter.finish():
+        yield sentence
@@ -0,0 +1,180 @@
+import os
+import json
+import asyncio
+import logging
+from typing import Dict, List, Set
+
+import redis.asyncio as redis
+from fastapi import HTTPException
+
+from services.llm_client import llm_client
+from utils.metrics import Counter
+from utils.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+MAX_TOKENS_ONCE = int(os.getenv("MAX_TOKENS_ONCE", 4096))
+# 单词例句在 Redis 中的缓存时间
+SENTENCE_CACHE_TTL = int(os.getenv("SENTENCE_CACHE_TTL", 7 * 24 * 3600))
+
+hits = Counter("sentence_cache_hits")
+misses = Counter("sentence_cache_misses")
+coalesced = Counter("sentence_cache_coalesced")
+
+# 正在向 LLM 请求的单词 -> future，同一单词的并发请求共用一次 LLM 调用
+_inflight: Dict[str, asyncio.Future] = {}
+# 进行中的 _fetch 任务，保留引用避免任务在完成前被垃圾回收
+_fetch_tasks: Set[asyncio.Task] = set()
+
+
+def _normalize(word: str) -> str:
+    return word.strip().lower()
+
+
+def _cache_key(word: str) -> str:
+    return f"sentence:{word}"
+
+
+def sentences_prompt(words: List[str]) -> str:
+    return (
+        f'Generate one short English sentence for each word in this list: "{" ".join(words)}", '
+        "for practice. Return only the sentences in this json format, "
+        'with each word as the key: {"word1": "sentence1", "word2": "sentence2", ...}.'
+    )
+
+
+async def _generate(words: List[str]) -> Dict[str, str]:
+    """一次 LLM 调用为多个单词生成例句，返回 单词 -> 例句"""
+    upstream_payload = {
+        "model": LLM_MODEL,
+        "messages": [{"role": "user", "content": sentences_prompt(words)}],
+        "max_tokens": MAX_TOKENS_ONCE,
+    }
+    content = await llm_client.complete(upstream_payload, endpoint="sentences")
+    try:
+        data = json.loads(content)
+        if isinstance(data, list):
+            # 兼容按顺序返回的句子列表
+            data = dict(zip(words, data))
+        return {_normalize(word): str(sentence) for word, sentence in data.items()}
+    except (json.JSONDecodeError, AttributeError) as e:
+        logger.error(f"Unexpected LLM response format: {content} ({e})")
+        raise HTTPException(status_code=500, detail="Invalid response format from LLM")
+
+
+async def _store(sentences: Dict[str, str]):
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for word, sentence in sentences.items():
+                pipe.set(_cache_key(word), sentence, ex=SENTENCE_CACHE_TTL)
+            await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to cache sentences: {e}")
+
+
+async def _fetch_one(word: str, future: asyncio.Future):
+    """批量结果中缺少的单词单独请求一次，失败只影响这个单词"""
+    try:
+        sentence = (await _generate([word])).get(word)
+        if sentence is None:
+            raise HTTPException(
+                status_code=500, detail="Invalid response format from LLM"
+            )
+    except Exception as e:
+        logger.error(f"LLM returned no sentence for word {word}: {e}")
+        future.set_exception(e)
+        return
+    await _store({word: sentence})
+    future.set_result(sentence)
+
+
+async def _fetch(words: List[str], futures: Dict[str, asyncio.Future]):
+    """为缓存中没有的单词调用 LLM，写入缓存，并完成对应的 future"""
+    try:
+        sentences = await _generate(words)
+        found = {word: sentences[word] for word in words if word in sentences}
+        if found:
+            await _store(found)
+        for word, sentence in found.items():
+            futures[word].set_result(sentence)
+        retry = [word for word in words if word not in found]
+        if retry:
+            logger.warning(f"LLM returned no sentence for {retry}, retrying")
+            await asyncio.gather(*(_fetch_one(word, futures[word]) for word in retry))
+    except asyncio.CancelledError:
+        for word in words:
+            futures[word].cancel()
+        raise
+    except Exception as e:
+        for word in words:
+            if not futures[word].done():
+                futures[word].set_exception(e)
+    finally:
+        for word in words:
+            _inflight.pop(word, None)
+
+
+async def get_sentences(words: List[str]) -> List[str]:
+    """
+    为每个单词返回一个例句，顺序与输入一致。
+    先批量查 Redis 缓存；缓存中没有的单词合并成一次 LLM 调用，
+    其他请求正在获取的单词直接等待同一个 future，不重复调用 LLM。
+    LLM 没有返回例句的单词会单独重试，仍然失败的单词返回空字符串。
+    """
+    keys = list(dict.fromkeys(_normalize(word) for word in words))
+    try:
+        cached = await redis_client.mget([_cache_key(word) for word in keys])
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read sentence cache: {e}")
+        cached = [None] * len(keys)
+
+    results: Dict[str, str] = {}
+    waiting: Dict[str, asyncio.Future] = {}
+    missing: List[str] = []
+    for word, sentence in zip(keys, cached):
+        if sentence is not None:
+            results[word] = sentence
+        elif word in _inflight:
+            waiting[word] = _inflight[word]
+        else:
+            missing.append(word)
+    hits.inc(len(results))
+    coalesced.inc(len(waiting))
+    misses.inc(len(missing))
+
+    if missing:
+        loop = asyncio.get_running_loop()
+        futures = {word: loop.create_future() for word in missing}
+        _inflight.update(futures)
+        waiting.update(futures)
+        # 在独立 task 中调用 LLM，发起请求的连接断开时，等待同一单词的其他请求不受影响
+        task = asyncio.create_task(_fetch(missing, futures))
+        _fetch_tasks.add(task)
+        task.add_done_callback(_fetch_tasks.discard)
+        logger.info(
+            f"Sentence cache: {len(results)} hits, {len(missing)} to generate, "
+            f"{len(waiting) - len(missing)} in flight"
+        )
+
+    if waiting:
+        values = await asyncio.gather(
+            *(asyncio.shield(future) for future in waiting.values()),
+            return_exceptions=True,
+        )
+        failed = [value for value in values if isinstance(value, BaseException)]
+        # 只有部分单词失败时这些单词返回空字符串，全部失败才让请求失败
+        if failed and len(failed) == len(keys):
+            raise failed[0]
+        for word, value in zip(waiting.keys(), values):
+            results[word] = "" if isinstance(value, BaseException) else value
+    return [results[_normalize(word)] for word in words]
+
+
+def sentence_cache_stats() -> dict:
+    return {
+        "hits": hits.value,
+        "misses": misses.value,
+        "coalesced": coalesced.value,
+        "in_flight": len(_inflight),
+    }
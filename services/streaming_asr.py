@@ -0,0 +1,221 @@
+import os
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, Union
+
+from fastapi import HTTPException
+
+from websocket.protocol import WebSocketProtocol
+from utils.audio import (
+    PCM_FORMAT,
+    PCM_SAMPLE_RATE,
+    VAD_FRAME_MS,
+    VAD_PADDING_MS,
+    create_vad,
+)
+from utils.transcribe import transcribe_file
+
+logger = logging.getLogger(__name__)
+
+# 语音结束后连续静音超过该时长即判定一句话结束
+STREAM_ENDPOINT_SILENCE_MS = int(os.getenv("STREAM_ENDPOINT_SILENCE_MS", 600))
+# 说话过程中每积累这么多新音频就推送一次中间结果
+STREAM_PARTIAL_INTERVAL_MS = int(os.getenv("STREAM_PARTIAL_INTERVAL_MS", 1000))
+# 单句最长时长，超过时强制结束
+STREAM_MAX_UTTERANCE_MS = int(os.getenv("STREAM_MAX_UTTERANCE_MS", 30000))
+
+# 兼容 scripts/test_websocket_VAD.py：一句话结束时发送的文本信号
+STOP_RECORDING_SIGNAL = "stop_recording"
+
+
+class StreamingTranscriber:
+    """
+    一个 WebSocket 连接上的一路流式转录。
+    客户端持续发送 20~30ms 的 16kHz int16 PCM 块，这里逐帧做 VAD 端点检测，
+    说话过程中定期推送中间结果（asr_partial）。检测到语音结束时立即推送 asr_endpoint
+    （带 signal: "stop_recording"），转录完成后推送最终结果（asr_final），失败时推送 asr_error。
+    转录都在后台 task 中进行，不阻塞接收循环。
+    """
+
+    def __init__(
+        self,
+        send_bytes: Callable[[bytes], Awaitable[None]],
+        stream_id: str = "default",
+        send_text: Optional[Callable[[str], Awaitable[None]]] = None,
+    ):
+        """
+        :param send_bytes: 发送二进制协议消息的协程函数
+        :param stream_id: 流 ID，推送消息中原样带回
+        :param send_text: 若提供，检测到语音结束时额外发送文本 "stop_recording"
+        """
+        self.send_bytes = send_bytes
+        self.send_text = send_text
+        self.stream_id = stream_id
+        self.frame_bytes = PCM_SAMPLE_RATE * VAD_FRAME_MS // 1000 * 2
+        # 每路流一个 VAD 实例，在事件循环中使用，不与线程池中的 trim_silence 共享
+        self._vad = create_vad()
+
+        self._pending = bytearray()  # 不足一帧的剩余数据
+        self._padding = deque(maxlen=max(1, VAD_PADDING_MS // VAD_FRAME_MS))
+        self._speech = bytearray()  # 当前这句话的音频
+        self._speaking = False
+        self._silent_frames = 0
+        self._frames_since_partial = 0
+        self._partial_task: Optional[asyncio.Task] = None
+        self._tasks = set()
+
+    async def feed(self, chunk: Union[bytes, memoryview]):
+        """送入一块 PCM 数据"""
+        self._pending.extend(chunk)
+        frame_bytes = self.frame_bytes
+        offset = 0
+        while len(self._pending) - offset >= frame_bytes:
+            frame = bytes(self._pending[offset : offset + frame_bytes])
+            offset += frame_bytes
+            self._on_frame(frame)
+        del self._pending[:offset]
+
+    def _on_frame(self, frame: bytes):
+        speech = self._vad.is_speech(frame, PCM_SAMPLE_RATE)
+
+        if not self._speaking:
+            if not speech:
+                self._padding.append(frame)
+                return
+            # 语音开始，带上前面的一小段静音作为余量
+            self._speaking = True
+            for padded in self._padding:
+                self._speech.extend(padded)
+            self._padding.clear()
+
+        self._speech.extend(frame)
+        self._silent_frames = 0 if speech else self._silent_frames + 1
+        self._frames_since_partial += 1
+
+        utterance_ms = len(self._speech) // 2 * 1000 // PCM_SAMPLE_RATE
+        if (
+            self._silent_frames * VAD_FRAME_MS >= STREAM_ENDPOINT_SILENCE_MS
+            or utterance_ms >= STREAM_MAX_UTTERANCE_MS
+        ):
+            self._finalize()
+        elif self._frames_since_partial * VAD_FRAME_MS >= STREAM_PARTIAL_INTERVAL_MS:
+            self._partial()
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _partial(self):
+        # 上一次中间结果还没算完就跳过，避免转录请求堆积
+        if self._partial_task is not None and not self._partial_task.done():
+            return
+        self._frames_since_partial = 0
+        self._partial_task = self._spawn(
+            self._transcribe_and_push(bytes(self._speech), final=False)
+        )
+
+    def _finalize(self):
+        if self._partial_task is not None and not self._partial_task.done():
+            self._partial_task.cancel()
+        self._partial_task = None
+        audio = bytes(self._speech)
+        self._speech = bytearray()
+        self._speaking = False
+        self._silent_frames = 0
+        self._frames_since_partial = 0
+        self._spawn(self._end_utterance(audio))
+
+    async def flush(self):
+        """客户端主动结束当前这句话"""
+        if self._speaking:
+            self._finalize()
+
+    async def _end_utterance(self, audio: bytes):
+        # 先通知客户端停止录音，不依赖转录是否成功；最终结果或错误随后单独推送
+        try:
+            await self._push(
+                {"data_type": "asr_endpoint", "signal": STOP_RECORDING_SIGNAL}
+            )
+            if self.send_text is not None:
+                await self.send_text(STOP_RECORDING_SIGNAL)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to send endpoint signal: {e}")
+        await self._transcribe_and_push(audio, final=True)
+
+    async def _transcribe_and_push(self, audio: bytes, final: bool):
+        data_type = "asr_final" if final else "asr_partial"
+        try:
+            text = await transcribe_file(audio, audio_format=PCM_FORMAT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Streaming transcription error: {e}")
+            if final:
+                await self._push_error(e)
+            return
+        try:
+            await self._push({"data_type": data_type, "text": text})
+            logger.debug(f"Stream {self.stream_id} {data_type}: {text}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to push {data_type}: {e}")
+
+    async def _push_error(self, error: Exception):
+        json_data = {"data_type": "asr_error", "error": str(error)}
+        if isinstance(error, HTTPException):
+            json_data["error"] = error.detail
+            json_data["status_code"] = error.status_code
+        try:
+            await self._push(json_data)
+        except Exception as e:
+            logger.error(f"Failed to push asr_error: {e}")
+
+    async def _push(self, json_data: Dict):
+        json_data["stream_id"] = self.stream_id
+        await self.send_bytes(
+            WebSocketProtocol.build_message(
+                direction=0, type_=WebSocketProtocol.TYPE_PUSH, json_data=json_data
+            )
+        )
+
+    def close(self):
+        """连接断开时取消所有进行中的转录"""
+        for task in list(self._tasks):
+            task.cancel()
+
+
+async def handle_asr_stream(
+    parsed_data: Dict[str, Union[Dict, bytes]], username: str, context: Dict
+) -> Optional[bytes]:
+    """
+    处理 WebSocket 的流式转录消息（TYPE_DATA, data_type=asr_stream）。
+    json_data: {"data_type": "asr_stream", "stream_id": "...", "final": false}
+    binary_data: 16kHz 单声道 int16 PCM 块
+    中间结果和最终结果通过 TYPE_PUSH 异步推送，本函数不返回响应。
+    """
+    json_data = parsed_data["json_data"]
+    stream_id = str(json_data.get("stream_id", "default"))
+    streams = context.setdefault("asr_streams", {})
+
+    stream = streams.get(stream_id)
+    if stream is None:
+        stream = StreamingTranscriber(
+            context["send_bytes"],
+            stream_id=stream_id,
+            send_text=context["send_text"] if json_data.get("text_signal") else None,
+        )
+        streams[stream_id] = stream
+        context.setdefault("on_close", []).append(stream.close)
+        logger.info(f"Started ASR stream {stream_id} for user: {username}")
+
+    if parsed_data["binary_data"]:
+        await stream.feed(parsed_data["binary_data"])
+    if json_data.get("final"):
+        await stream.flush()
+    return None
@@ -0,0 +1,62 @@
+"""
+TTS 缓存预热：预先合成单词列表，写入 utils.tts_cache 的磁盘缓存。
+
+用法（在 api 容器中）:
+    python3 -m services.tts_warmup                # 调用 LLM 生成一批 IELTS 单词并合成
+    python3 -m services.tts_warmup -f words.txt   # 合成文件中的单词，每行一个
+    python3 -m services.tts_warmup -r 5           # 调用 LLM 5 轮
+"""
+
+import argparse
+import asyncio
+import logging
+
+from services.llm_client import llm_client
+from services.word_generator import generate_words_service
+from utils.synthesize import synthesize_text
+from utils.tts_cache import tts_cache
+
+logger = logging.getLogger(__name__)
+
+
+async def _llm_words(rounds: int) -> list:
+    words = []
+    try:
+        for _ in range(rounds):
+            items = await generate_words_service({}, "tts_warmup")
+            words.extend(item["word"] for item in items if item.get("word"))
+    finally:
+        await llm_client.close()
+    return words
+
+
+async def warmup(words: list):
+    for i, word in enumerate(dict.fromkeys(words), 1):
+        await synthesize_text(word)
+        logger.info(f"[{i}] warmed: {word}")
+    logger.info(f"TTS cache stats: {tts_cache.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-synthesize words into TTS cache")
+    parser.add_argument("-f", "--file", help="word list file, one word per line")
+    parser.add_argument(
+        "-r", "--rounds", type=int, default=1, help="LLM rounds when no file given"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    async def run():
+        if args.file:
+            with open(args.file, encoding="utf-8") as f:
+                words = [line.strip() for line in f if line.strip()]
+        else:
+            words = await _llm_words(args.rounds)
+        await warmup(words)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
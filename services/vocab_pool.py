@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+import redis.asyncio as redis
+from fastapi import HTTPException
+
+from services.llm_client import llm_client
+from utils.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+MAX_TOKENS_ONCE = int(os.getenv("MAX_TOKENS_ONCE", 4096))
+
+# 每次请求返回的单词数
+VOCAB_WORDS_PER_REQUEST = int(os.getenv("VOCAB_WORDS_PER_REQUEST", 10))
+# 词库低于低水位时后台补充到目标数量；用户可用单词不足时额外补充，总数不超过上限
+VOCAB_POOL_LOW = int(os.getenv("VOCAB_POOL_LOW", 500))
+VOCAB_POOL_TARGET = int(os.getenv("VOCAB_POOL_TARGET", 2000))
+VOCAB_POOL_MAX = int(os.getenv("VOCAB_POOL_MAX", 10000))
+# 每次调用 LLM 生成的单词数
+VOCAB_BATCH_SIZE = int(os.getenv("VOCAB_BATCH_SIZE", 50))
+# 用户见过的单词在该天数内不再返回
+VOCAB_SEEN_DAYS = int(os.getenv("VOCAB_SEEN_DAYS", 90))
+# 后台检查词库的间隔（秒）
+VOCAB_REFILL_INTERVAL = int(os.getenv("VOCAB_REFILL_INTERVAL", 300))
+
+POOL_KEY = "vocab:pool"  # hash: 小写单词 -> {"word", "meaning", "phonetic"} JSON
+REFILL_LOCK_KEY = "vocab:refill_lock"  # 多 worker 时只有一个 worker 补充词库
+
+# 每批随机选一个主题，让 LLM 生成的单词更分散
+TOPICS = [
+    "environment",
+    "technology",
+    "education",
+    "health",
+    "economy",
+    "government and society",
+    "culture and arts",
+    "science",
+    "travel and tourism",
+    "media and advertising",
+    "crime and law",
+    "work and careers",
+    "urbanisation",
+    "family and relationships",
+    "sport and leisure",
+    "food and agriculture",
+    "psychology and behaviour",
+    "history",
+]
+
+
+def vocabulary_prompt(count: int, topic: Optional[str] = None) -> str:
+    topic_hint = f" related to {topic}" if topic else ""
+    return f"""
+        Generate a list of {count} unique IELTS vocabulary words{topic_hint}, including their Chinese translations
+        (list all significant meanings with clear differences, up to 3) and phonetic transcription (in IPA).
+        Return only in JSON format like
+        [
+          {{"word": "word", "meaning": "简体中文1, 简体中文2, ...", "phonetic": "/IPA/"}},
+          ...
+        ].
+    """.strip()
+
+
+async def generate_vocabulary(
+    count: int,
+    topic: Optional[str] = None,
+    model: str = LLM_MODEL,
+    max_tokens: int = MAX_TOKENS_ONCE,
+) -> List[Dict[str, str]]:
+    """调用 LLM 生成一批单词"""
+    upstream_payload = {
+        "model": model,
+        "messages": [{"role": "user", "content": vocabulary_prompt(count, topic)}],
+        "max_tokens": max_tokens,
+    }
+    content = await llm_client.complete(upstream_payload, endpoint="words")
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        logger.error(f"Unexpected LLM response format: {content}")
+        raise HTTPException(status_code=500, detail="Invalid response format from LLM")
+
+
+def _seen_key(username: str) -> str:
+    # zset: 单词 -> 最后一次返回给用户的时间戳
+    return f"vocab:seen:{username}"
+
+
+class VocabularyPool:
+    """
+    预先生成的 IELTS 词库，存放在 Redis 中，所有 worker 共享。
+    请求从词库中随机挑选用户最近 VOCAB_SEEN_DAYS 天没见过的单词，不等待 LLM；
+    后台任务在词库低于低水位、或有用户可用单词不足时调用 LLM 补充。
+    """
+
+    def __init__(self):
+        self._wake = asyncio.Event()
+        self._grow = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def add(self, items: List[Dict[str, str]]) -> int:
+        """把单词加入词库，返回词库大小"""
+        mapping = {
+            item["word"].strip().lower(): json.dumps(item, ensure_ascii=False)
+            for item in items
+            if isinstance(item, dict) and item.get("word")
+        }
+        async with redis_client.pipeline(transaction=False) as pipe:
+            if mapping:
+                pipe.hset(POOL_KEY, mapping=mapping)
+            pipe.hlen(POOL_KEY)
+            results = await pipe.execute()
+        return results[-1]
+
+    async def mark_seen(self, username: str, words: List[str]):
+        seen_key = _seen_key(username)
+        now = time.time()
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.zadd(seen_key, {word.strip().lower(): now for word in words})
+            pipe.expire(seen_key, VOCAB_SEEN_DAYS * 86400)
+            await pipe.execute()
+
+    async def take(
+        self, username: str, count: int = VOCAB_WORDS_PER_REQUEST
+    ) -> Optional[List[Dict[str, str]]]:
+        """
+        从词库中取 count 个用户最近没见过的单词，并记为已见。
+        词库中可用单词不足时返回 None（并通知后台补充），由调用方直接调用 LLM。
+        """
+        seen_key = _seen_key(username)
+        cutoff = time.time() - VOCAB_SEEN_DAYS * 86400
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.zremrangebyscore(seen_key, "-inf", cutoff)
+                # 多取一些候选，过滤掉见过的单词后仍有足够数量
+                pipe.hrandfield(POOL_KEY, count * 4, withvalues=True)
+                pipe.hlen(POOL_KEY)
+                _, sample, size = await pipe.execute()
+            if size < VOCAB_POOL_LOW:
+                self.request_refill()
+
+            sample = sample or []
+            candidates = list(zip(sample[::2], sample[1::2]))
+            if not candidates:
+                return None
+            scores = await redis_client.zmscore(
+                seen_key, [field for field, _ in candidates]
+            )
+        except redis.RedisError as e:
+            logger.error(f"Failed to read vocabulary pool: {e}")
+            return None
+
+        items = [
+            json.loads(value)
+            for (_, value), score in zip(candidates, scores)
+            if score is None
+        ][:count]
+        if len(items) < count:
+            logger.info(f"Vocabulary pool exhausted for user {username}")
+            self.request_refill(grow=True)
+            return None
+        await self.mark_seen(username, [item["word"] for item in items])
+        return items
+
+    def request_refill(self, grow: bool = False):
+        """通知后台任务检查词库；grow 为 True 时即使高于目标数量也补充一批"""
+        self._grow = self._grow or grow
+        self._wake.set()
+
+    def start(self):
+        """在 lifespan 中启动后台补充任务"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refill_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _refill_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), VOCAB_REFILL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            grow, self._grow = self._grow, False
+            try:
+                await self.refill(grow)
+            except Exception as e:
+                logger.error(f"Vocabulary refill failed: {e}")
+
+    async def refill(self, grow: bool = False):
+        """
+        词库低于低水位时补充到目标数量，grow 时额外补充一批。
+        使用 Redis 锁保证同一时间只有一个 worker 调用 LLM。
+        """
+        size = await redis_client.hlen(POOL_KEY)
+        if size >= VOCAB_POOL_LOW and not grow:
+            return
+        target = VOCAB_POOL_TARGET
+        if grow:
+            target = max(target, size + VOCAB_BATCH_SIZE)
+        target = min(target, VOCAB_POOL_MAX)
+        if size >= target:
+            return
+        if not await redis_client.set(REFILL_LOCK_KEY, "1", nx=True, ex=600):
+            return
+        try:
+            logger.info(f"Refilling vocabulary pool: {size} -> {target}")
+            stalled = 0
+            while size < target and stalled < 3:
+                items = await generate_vocabulary(
+                    VOCAB_BATCH_SIZE, topic=random.choice(TOPICS)
+                )
+                new_size = await self.add(items)
+                # LLM 连续几批都只返回已有的单词时停止，避免无限调用
+                stalled = stalled + 1 if new_size == size else 0
+                size = new_size
+                await redis_client.expire(REFILL_LOCK_KEY, 600)
+            logger.info(f"Vocabulary pool size: {size}")
+        finally:
+            await redis_client.delete(REFILL_LOCK_KEY)
+
+
+vocab_pool = VocabularyPool()
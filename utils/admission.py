@@ -0,0 +1,318 @@
+"""
+全局准入控制：ASR、LLM、TTS 每个阶段有并发上限和一个有界的等待队列（StageQueue），
+过载时尽早拒绝一部分请求（503 + Retry-After），而不是所有请求一起变慢。
+
+- 优先级：WebSocket 对话 > HTTP 接口 > 调试接口（/transcribe、/synthesize）。
+  名额空出时先唤醒优先级最高的等待者；队列满时，高优先级请求挤掉最低优先级中最晚到达的等待者。
+- 公平：同一优先级内按用户轮转，每个用户在一个阶段排队的请求数也有上限，
+  单个用户发再多请求也不会占满队列。
+- 截止时间：排队超过截止时间返回 504；按队列长度和平均占用时间估算，
+  排到之后也来不及在截止时间前完成的请求直接返回 503。
+  截止时间只约束排队，有空闲名额时即使已过截止时间也直接放行。
+
+请求的用户、优先级和截止时间由 set_request_context() 保存在 contextvar 中，
+各阶段取名额时读取，调用链上不需要逐层传参；请求中创建的子任务会继承这些值。
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Deque, Dict, Optional
+
+from fastapi import HTTPException
+
+from utils.metrics import Gauge, counter, histogram
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """数值越小优先级越高"""
+
+    INTERACTIVE = 0  # WebSocket 对话
+    DEFAULT = 1  # HTTP 对话、生成例句等
+    DEBUG = 2  # /transcribe、/synthesize 调试接口
+
+
+# 各优先级请求的截止时间（秒，从 set_request_context 起算），0 表示不限
+ADMISSION_DEADLINES = {
+    Priority.INTERACTIVE: float(os.getenv("ADMISSION_DEADLINE_INTERACTIVE", 30)),
+    Priority.DEFAULT: float(os.getenv("ADMISSION_DEADLINE_DEFAULT", 60)),
+    Priority.DEBUG: float(os.getenv("ADMISSION_DEADLINE_DEBUG", 60)),
+}
+# 每个用户在一个阶段排队的请求数上限，占队列长度的比例
+ADMISSION_USER_QUEUE_SHARE = float(os.getenv("ADMISSION_USER_QUEUE_SHARE", 0.25))
+
+_user: ContextVar[str] = ContextVar("admission_user", default="")
+_priority: ContextVar[Priority] = ContextVar(
+    "admission_priority", default=Priority.DEFAULT
+)
+_deadline: ContextVar[Optional[float]] = ContextVar("admission_deadline", default=None)
+
+
+def set_request_context(user: str, priority: Priority, timeout: Optional[float] = None):
+    """
+    设置当前请求的用户、优先级和截止时间（对当前 task 及之后创建的子 task 生效）。
+    :param timeout: 截止时间（秒），默认按优先级取 ADMISSION_DEADLINES，0 表示不限
+    """
+    if timeout is None:
+        timeout = ADMISSION_DEADLINES.get(priority, 0)
+    _user.set(user)
+    _priority.set(priority)
+    _deadline.set(time.monotonic() + timeout if timeout > 0 else None)
+
+
+def _rejection(status_code: int, detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status_code,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+# 名称 -> 阶段，由各阶段所在模块创建（utils/transcribe.py、utils/synthesize.py、llm_client）
+STAGES: Dict[str, "StageQueue"] = {}
+
+
+@dataclass
+class _Waiter:
+    priority: int
+    user: str
+    seq: int
+    future: asyncio.Future = field(repr=False)
+    granted: bool = False
+
+
+class StageQueue:
+    """
+    一个阶段的准入队列：最多 concurrency 个请求同时执行，最多 queue_size 个请求排队。
+    用法：async with stage.slot(): ...
+    """
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        queue_size: int,
+        user_queue_limit: Optional[int] = None,
+    ):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.user_queue_limit = user_queue_limit or max(
+            1, int(queue_size * ADMISSION_USER_QUEUE_SHARE)
+        )
+        self.in_flight = 0
+        self.waiting = 0
+        # 平均占用时间（秒，指数滑动平均），用于估算等待时间和 Retry-After
+        self.service_time = 1.0
+        # 优先级 -> 用户 -> 该用户的等待者，用户按轮转顺序排列
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Waiter]]"] = {
+            priority: OrderedDict() for priority in Priority
+        }
+        self._seq = 0
+
+        labels = {"stage": name}
+        Gauge("admission_in_flight", fn=lambda: self.in_flight, labels=labels)
+        Gauge("admission_queued", fn=lambda: self.waiting, labels=labels)
+        STAGES[name] = self
+
+    def slot(self) -> "_Slot":
+        return _Slot(self)
+
+    def try_acquire(self) -> bool:
+        """有空闲名额且没有人排队时占用一个名额，不排队"""
+        if self.in_flight < self.concurrency and not self.waiting:
+            self.in_flight += 1
+            return True
+        return False
+
+    async def acquire(self):
+        priority, user = _priority.get(), _user.get()
+        self.check(priority)
+        if self.try_acquire():
+            return
+
+        if self.waiting >= self.queue_size:
+            # check() 已确认存在优先级更低的等待者
+            victim = self._lowest_waiter()
+            self._remove(victim)
+            victim.future.set_exception(self._overloaded(victim.priority, "evicted"))
+
+        self._seq += 1
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, user, self._seq, loop.create_future())
+        self._queues[priority].setdefault(user, deque()).append(waiter)
+        self.waiting += 1
+
+        deadline = _deadline.get()
+        timer = None
+        if deadline is not None:
+            timer = loop.call_later(deadline - time.monotonic(), self._expire, waiter)
+        start = time.monotonic()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.granted:
+                # 名额已经转交给本请求，交给下一个等待者
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            histogram("admission_wait_seconds", stage=self.name).observe(
+                time.monotonic() - start
+            )
+
+    def release(self):
+        """归还名额；有人排队时直接转交给下一个等待者"""
+        while self.waiting:
+            waiter = self._pop_next()
+            if waiter.future.done():
+                continue
+            waiter.granted = True
+            waiter.future.set_result(None)
+            return
+        self.in_flight -= 1
+
+    def check(self, priority: Optional[Priority] = None):
+        """
+        当前请求如果现在排队会被拒绝（队列满、本用户排队过多、来不及在截止时间前完成），
+        抛出 503/504；有空闲名额时总是放行。
+        对话开始时对各阶段预先检查，避免做完 ASR 才在 TTS 被拒绝。
+        """
+        if priority is None:
+            priority = _priority.get()
+        # 能立即拿到名额时不检查截止时间：截止时间只约束排队，
+        # 一轮回复中逐句合成等已经开始的工作即使超过截止时间也不中断
+        if self.in_flight < self.concurrency and not self.waiting:
+            return
+
+        deadline = _deadline.get()
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._count_rejected(priority, "deadline")
+                raise _rejection(504, f"Deadline exceeded before {self.name}", 1)
+            ahead = sum(
+                len(waiters)
+                for p, users in self._queues.items()
+                if p <= priority
+                for waiters in users.values()
+            )
+            estimate = ((ahead + 1) / self.concurrency + 1) * self.service_time
+            if estimate > remaining:
+                raise self._overloaded(priority, "deadline")
+
+        if self.waiting >= self.queue_size:
+            victim = self._lowest_waiter()
+            if victim is None or victim.priority <= priority:
+                raise self._overloaded(priority, "queue_full")
+        waiters = self._queues[priority].get(_user.get())
+        if waiters is not None and len(waiters) >= self.user_queue_limit:
+            raise self._overloaded(priority, "user_limit")
+
+    def _overloaded(self, priority: int, reason: str) -> HTTPException:
+        self._count_rejected(priority, reason)
+        retry_after = (self.waiting / self.concurrency + 1) * self.service_time
+        return _rejection(503, f"Server busy ({self.name})", retry_after)
+
+    def _count_rejected(self, priority: int, reason: str):
+        counter(
+            "admission_rejected",
+            stage=self.name,
+            priority=Priority(priority).name.lower(),
+            reason=reason,
+        ).inc()
+        logger.warning(f"Admission {self.name} rejected ({reason})")
+
+    def _expire(self, waiter: _Waiter):
+        if waiter.future.done():
+            return
+        self._remove(waiter)
+        self._count_rejected(waiter.priority, "deadline")
+        waiter.future.set_exception(
+            _rejection(504, f"Deadline exceeded waiting for {self.name}", 1)
+        )
+
+    def _pop_next(self) -> _Waiter:
+        for users in self._queues.values():
+            if not users:
+                continue
+            user, waiters = next(iter(users.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                users.move_to_end(user)
+            else:
+                del users[user]
+            self.waiting -= 1
+            return waiter
+        raise IndexError("No waiters")
+
+    def _remove(self, waiter: _Waiter):
+        users = self._queues[waiter.priority]
+        waiters = users.get(waiter.user)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            del users[waiter.user]
+        self.waiting -= 1
+
+    def _lowest_waiter(self) -> Optional[_Waiter]:
+        """优先级最低的等待者中最晚到达的一个"""
+        for priority in sorted(self._queues, reverse=True):
+            users = self._queues[priority]
+            if users:
+                return max(
+                    (waiters[-1] for waiters in users.values()),
+                    key=lambda waiter: waiter.seq,
+                )
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": self.waiting,
+            "queue_size": self.queue_size,
+            "service_time_seconds": round(self.service_time, 3),
+        }
+
+
+class _Slot:
+    """
+    StageQueue.slot() 返回的上下文管理器，退出时归还名额并更新平均占用时间。
+    不用 asynccontextmanager：在异步生成器（如 LLM 流）中使用时，
+    生成器被垃圾回收可能先关闭内层生成器，导致外层关闭时报错。
+    """
+
+    def __init__(self, stage_queue: StageQueue):
+        self.stage_queue = stage_queue
+        self.start = 0.0
+
+    async def __aenter__(self):
+        await self.stage_queue.acquire()
+        self.start = time.monotonic()
+
+    async def __aexit__(self, *exc_info):
+        stage_queue = self.stage_queue
+        elapsed = time.monotonic() - self.start
+        stage_queue.service_time += 0.2 * (elapsed - stage_queue.service_time)
+        stage_queue.release()
+
+
+def admit(*names: str):
+    """一轮对话开始前检查它要经过的各阶段，任一阶段过载时直接拒绝"""
+    for name in names:
+        stage_queue = STAGES.get(name)
+        if stage_queue is not None:
+            stage_queue.check()
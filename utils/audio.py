@@ -0,0 +1,79 @@
+import os
+import logging
+import threading
+from typing import Union
+
+import numpy as np
+import webrtcvad
+
+logger = logging.getLogger(__name__)
+
+# 客户端直接上传的原始 PCM 格式：16kHz, 16-bit, 单声道, little-endian
+PCM_FORMAT = "pcm_s16le"
+PCM_SAMPLE_RATE = 16000
+
+# VAD 配置
+VAD_MODE = int(os.getenv("VAD_MODE", 3))  # 3 为最激进模式
+VAD_FRAME_MS = 30  # webrtcvad 只接受 10/20/30ms 的帧
+# 裁剪静音时在语音前后保留的余量，避免切掉首尾的弱音
+VAD_PADDING_MS = int(os.getenv("VAD_PADDING_MS", 300))
+
+# webrtcvad 不是线程安全的：流式转录每路一个实例（在事件循环中使用），
+# trim_silence 在线程池中执行，每个线程一个实例，不共享锁
+_thread_local = threading.local()
+
+PcmBuffer = Union[bytes, bytearray, memoryview]
+
+
+def pcm16_to_float32(pcm: PcmBuffer) -> np.ndarray:
+    """
+    int16 PCM 转换为 Whisper 需要的 float32 [-1, 1]。
+    np.frombuffer 直接在原缓冲区上建立视图，不复制；只在转换为 float32 时分配一次。
+    """
+    view = memoryview(pcm).cast("B")
+    samples = np.frombuffer(view[: len(view) // 2 * 2], dtype=np.int16)
+    return np.multiply(samples, 1.0 / 32768.0, dtype=np.float32)
+
+
+def create_vad() -> webrtcvad.Vad:
+    vad = webrtcvad.Vad()
+    vad.set_mode(VAD_MODE)
+    return vad
+
+
+def _thread_vad() -> webrtcvad.Vad:
+    vad = getattr(_thread_local, "vad", None)
+    if vad is None:
+        vad = _thread_local.vad = create_vad()
+    return vad
+
+
+def trim_silence(pcm: PcmBuffer, sample_rate: int = PCM_SAMPLE_RATE) -> memoryview:
+    """
+    用 VAD 去掉首尾静音，返回原缓冲区上的 memoryview 切片（不复制）。
+    整段都没有语音时返回空切片。
+    """
+    view = memoryview(pcm).cast("B")
+    frame_bytes = sample_rate * VAD_FRAME_MS // 1000 * 2
+    n_frames = len(view) // frame_bytes
+
+    vad = _thread_vad()
+    first = last = None
+    for i in range(n_frames):
+        frame = view[i * frame_bytes : (i + 1) * frame_bytes]
+        if vad.is_speech(frame, sample_rate):
+            if first is None:
+                first = i
+            last = i
+
+    if first is None:
+        return view[:0]
+
+    padding = VAD_PADDING_MS // VAD_FRAME_MS
+    start = max(0, first - padding) * frame_bytes
+    end = min(len(view), (last + 1 + padding) * frame_bytes)
+    logger.debug(
+        f"VAD trimmed {len(view)} -> {end - start} bytes "
+        f"({(len(view) - (end - start)) / 2 / sample_rate:.2f}s silence)"
+    )
+    return view[start:end]
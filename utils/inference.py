@@ -0,0 +1,116 @@
+import os
+import json
+import struct
+import asyncio
+import logging
+from multiprocessing import shared_memory
+from typing import Optional, Tuple, Union
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# local: 模型在 API worker 进程内加载（默认）
+# remote: 模型由独立的推理服务进程加载（python3 -m utils.inference_server），
+#         API worker 不加载模型，通过 Unix socket 提交任务
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "local")
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "/tmp/learnlang-inference.sock")
+# 音频通过共享内存传递（API 和推理服务需要在同一个 IPC 命名空间，例如同一容器），
+# 关闭时音频随请求一起通过 socket 发送
+INFERENCE_SHM = os.getenv("INFERENCE_SHM", "1") == "1"
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", 120))
+
+
+def is_remote() -> bool:
+    return INFERENCE_MODE == "remote"
+
+
+# 帧格式: [header_len: 4 bytes][header json][body_len: 4 bytes][body]
+async def write_frame(writer: asyncio.StreamWriter, header: dict, body: bytes = b""):
+    header_bytes = json.dumps(header).encode("utf-8")
+    writer.write(struct.pack("!I", len(header_bytes)))
+    writer.write(header_bytes)
+    writer.write(struct.pack("!I", len(body)))
+    if body:
+        writer.write(body)
+    await writer.drain()
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[dict, bytes]:
+    (header_len,) = struct.unpack("!I", await reader.readexactly(4))
+    header = json.loads(await reader.readexactly(header_len))
+    (body_len,) = struct.unpack("!I", await reader.readexactly(4))
+    body = await reader.readexactly(body_len) if body_len else b""
+    return header, body
+
+
+def _read_audio(audio) -> Union[bytes, memoryview]:
+    if isinstance(audio, str):
+        with open(audio, "rb") as f:
+            return f.read()
+    if hasattr(audio, "read"):
+        return audio.read()
+    # WebSocket 上传的 PCM 是消息上的 memoryview，直接写入共享内存或 socket，不复制
+    return memoryview(audio).cast("B")
+
+
+class InferenceClient:
+    """
+    推理服务客户端，每个请求建立一个 Unix socket 连接。
+    """
+
+    def __init__(
+        self, socket_path: str = INFERENCE_SOCKET, use_shm: bool = INFERENCE_SHM
+    ):
+        self.socket_path = socket_path
+        self.use_shm = use_shm
+
+    async def _call(self, header: dict, body: bytes = b"") -> Tuple[dict, bytes]:
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        except OSError as e:
+            logger.error(f"Inference server unavailable at {self.socket_path}: {e}")
+            raise HTTPException(status_code=503, detail="Inference server unavailable")
+        try:
+            await write_frame(writer, header, body)
+            response, payload = await asyncio.wait_for(
+                read_frame(reader), INFERENCE_TIMEOUT
+            )
+        finally:
+            writer.close()
+        if not response.get("ok"):
+            logger.error(f"Inference job failed: {response.get('error')}")
+            raise HTTPException(status_code=500, detail="Inference failed")
+        return response, payload
+
+    async def transcribe(self, audio, audio_format: Optional[str] = None) -> str:
+        data = await asyncio.to_thread(_read_audio, audio)
+        header = {"kind": "asr", "audio_format": audio_format, "size": len(data)}
+        if not self.use_shm or not data:
+            response, _ = await self._call(header, data)
+            return response["text"]
+
+        # 音频写入共享内存，只通过 socket 传递共享内存名称
+        shm = shared_memory.SharedMemory(create=True, size=len(data))
+        try:
+            shm.buf[: len(data)] = data
+            header["shm"] = shm.name
+            response, _ = await self._call(header)
+            return response["text"]
+        finally:
+            shm.close()
+            shm.unlink()
+
+    async def synthesize(self, text: str) -> bytes:
+        _, audio = await self._call({"kind": "tts", "text": text})
+        return audio
+
+    async def ping(self) -> bool:
+        try:
+            response, _ = await self._call({"kind": "ping"})
+            return bool(response.get("ok"))
+        except Exception:
+            return False
+
+
+inference_client = InferenceClient()
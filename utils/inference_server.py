@@ -0,0 +1,166 @@
+"""
+推理服务：在独立进程中加载 Whisper 和 TTS 模型，通过 Unix socket 接收任务。
+API worker 设置 INFERENCE_MODE=remote 后不再加载模型，uvicorn --workers N 时模型只占一份内存。
+
+用法:
+    python3 -m utils.inference_server --asr-workers 1 --tts-workers 1
+    INFERENCE_MODE=remote uvicorn app:app --workers 4
+"""
+
+import os
+import io
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, resource_tracker, shared_memory
+from typing import Optional
+
+from utils import inference
+from utils.inference import INFERENCE_SOCKET, read_frame, write_frame
+
+logger = logging.getLogger(__name__)
+
+# 推理 worker 进程内的任务函数，由 _init_worker 设置
+_job = None
+
+
+def _init_worker(kind: str):
+    """推理 worker 进程初始化：在本进程内加载一次模型"""
+    global _job
+    # 反序列化 initializer 时本模块已导入 utils.inference，INFERENCE_MODE 已从环境读出；
+    # 和 API 同容器运行时环境里是 remote，这里直接改模块变量，之后导入的
+    # transcribe/synthesize 才会按 local 注册模型
+    os.environ["INFERENCE_MODE"] = "local"
+    inference.INFERENCE_MODE = "local"
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+    if kind == "asr":
+        from utils.transcribe import _transcribe_blocking
+
+        _job = _transcribe_blocking
+    else:
+        from utils.synthesize import _blocking_synthesize_mp3
+
+        _job = _blocking_synthesize_mp3
+
+    from utils.model_registry import model_registry
+
+    model_registry.get(kind)
+    logger.info(f"Inference worker {os.getpid()} loaded {kind} model")
+
+
+def _asr_job(
+    audio_format: Optional[str], shm_name: Optional[str], size: int, data: bytes
+):
+    if shm_name is None:
+        audio = data if audio_format else io.BytesIO(data)
+        return _job(audio, audio_format)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # 共享内存由 API 进程创建和回收，避免本进程退出时被 resource_tracker 误删
+    resource_tracker.unregister(shm._name, "shared_memory")
+    try:
+        buf = shm.buf[:size]
+        try:
+            # PCM 直接在共享内存上建立视图；容器格式需要文件对象交给 ffmpeg 解码
+            audio = buf if audio_format else io.BytesIO(bytes(buf))
+            return _job(audio, audio_format)
+        finally:
+            audio = None
+            buf.release()
+    finally:
+        shm.close()
+
+
+def _tts_job(text: str) -> bytes:
+    return _job(text)
+
+
+class InferenceServer:
+    def __init__(self, socket_path: str, asr_workers: int, tts_workers: int):
+        self.socket_path = socket_path
+        ctx = get_context("spawn")
+        self.pools = {}
+        if asr_workers > 0:
+            self.pools["asr"] = ProcessPoolExecutor(
+                asr_workers, mp_context=ctx, initializer=_init_worker, initargs=("asr",)
+            )
+        if tts_workers > 0:
+            self.pools["tts"] = ProcessPoolExecutor(
+                tts_workers, mp_context=ctx, initializer=_init_worker, initargs=("tts",)
+            )
+
+    async def _dispatch(self, header: dict, body: bytes):
+        kind = header.get("kind")
+        if kind == "ping":
+            return {"ok": True, "kinds": list(self.pools)}, b""
+        pool = self.pools.get(kind)
+        if pool is None:
+            return {"ok": False, "error": f"unsupported kind: {kind}"}, b""
+
+        loop = asyncio.get_running_loop()
+        if kind == "asr":
+            text = await loop.run_in_executor(
+                pool,
+                _asr_job,
+                header.get("audio_format"),
+                header.get("shm"),
+                header.get("size", len(body)),
+                body,
+            )
+            return {"ok": True, "text": text}, b""
+        audio = await loop.run_in_executor(pool, _tts_job, header["text"])
+        return {"ok": True}, audio
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    header, body = await read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    response, payload = await self._dispatch(header, body)
+                except Exception as e:
+                    logger.error(f"Inference job error: {e}")
+                    response, payload = {"ok": False, "error": str(e)}, b""
+                await write_frame(writer, response, payload)
+        finally:
+            writer.close()
+
+    async def serve(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        # 预热：触发每个 worker 进程加载模型
+        loop = asyncio.get_running_loop()
+        for kind, pool in self.pools.items():
+            await loop.run_in_executor(pool, os.getpid)
+        logger.info(
+            f"Inference server listening on {self.socket_path}: {list(self.pools)}"
+        )
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ASR/TTS inference server")
+    parser.add_argument("--socket", default=INFERENCE_SOCKET)
+    parser.add_argument(
+        "--asr-workers", type=int, default=int(os.getenv("INFERENCE_ASR_WORKERS", 1))
+    )
+    parser.add_argument(
+        "--tts-workers", type=int, default=int(os.getenv("INFERENCE_TTS_WORKERS", 1))
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    )
+    server = InferenceServer(args.socket, args.asr_workers, args.tts_workers)
+    asyncio.run(server.serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import re
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+# 所有指标在创建时注册到 REGISTRY，/metrics 以 Prometheus 文本格式输出。
+# 记录指标只是加锁后的几次加法，可以在生产环境常开。
+
+_NAME_RE = re.compile(r"[^a-zA-Z0-9_:]")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """
+    进程内指标注册表。同名同标签的指标后注册的覆盖先注册的。
+    """
+
+    def __init__(self):
+        self._metrics: Dict[Tuple[str, Labels], object] = {}
+        self._lock = threading.RLock()
+
+    def register(self, metric):
+        # get_or_create 持有锁时创建的指标也会调用这里，所以使用可重入锁
+        with self._lock:
+            self._metrics[(metric.name, metric.labels)] = metric
+
+    def get_or_create(self, name: str, labels: Dict[str, str], factory):
+        key = (name, _labels(labels))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = factory()
+                    self._metrics[key] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: (m.name, m.labels))
+        lines = []
+        declared = set()
+        for metric in metrics:
+            name = _NAME_RE.sub("_", metric.name)
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class Counter:
+    """
+    进程内计数器，线程安全（executor 线程里也会计数）。
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, labels: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.labels = _labels(labels)
+        self._value = 0
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def samples(self):
+        yield "_total", _format_labels(self.labels), self._value
+
+
+class Gauge:
+    """
+    当前值指标。可以 set/inc/dec，也可以传入 fn，在输出时调用 fn 读取当前值
+    （例如队列长度、连接数，不需要在每次变化时更新）。
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        fn: Optional[Callable[[], float]] = None,
+        labels: Optional[Dict[str, str]] = None,
+    ):
+        self.name = name
+        self.labels = _labels(labels)
+        self._fn = fn
+        self._value = 0
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self) -> float:
+        if self._fn is not None:
+            try:
+                return self._fn()
+            except Exception:
+                return float("nan")
+        return self._value
+
+    def samples(self):
+        yield "", _format_labels(self.labels), self.value
+
+
+class LatencyStats:
+    """
+    记录耗时的次数、总和和最大值（单位：秒）。
+    """
+
+    type = "summary"
+
+    def __init__(self, name: str, labels: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.labels = _labels(labels)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            avg = self.total / self.count if self.count else 0.0
+            return {
+                "count": self.count,
+                "total_seconds": round(self.total, 6),
+                "avg_seconds": round(avg, 6),
+                "max_seconds": round(self.max, 6),
+            }
+
+    def samples(self):
+        labels = _format_labels(self.labels)
+        with self._lock:
+            yield "_count", labels, self.count
+            yield "_sum", labels, self.total
+
+
+# 默认的耗时分桶（秒），覆盖从毫秒级的缓存命中到分钟级的 LLM 长回复
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """
+    耗时直方图：按上界分桶计数（不累加），另外记录次数和总和。
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        buckets=DEFAULT_BUCKETS,
+        labels: Optional[Dict[str, str]] = None,
+    ):
+        self.name = name
+        self.labels = _labels(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # 最后一个是 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q: float) -> float:
+        """按分桶估算分位数（返回所在桶的上界，落在 +Inf 桶时返回最大上界）"""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self._counts):
+                seen += count
+                if seen >= rank:
+                    return bound
+            return self.buckets[-1]
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            cumulative, buckets = 0, {}
+            for bound, count in zip(self.buckets, self._counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            buckets["+Inf"] = self.count
+            result = {
+                "count": self.count,
+                "sum_seconds": round(self.sum, 6),
+                "buckets": buckets,
+            }
+        result["p50_seconds"] = self.quantile(0.5)
+        result["p95_seconds"] = self.quantile(0.95)
+        result["p99_seconds"] = self.quantile(0.99)
+        return result
+
+    def samples(self):
+        with self._lock:
+            counts, count, total = list(self._counts), self.count, self.sum
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            yield "_bucket", _format_labels(self.labels, ("le", str(bound))), cumulative
+        yield "_bucket", _format_labels(self.labels, ("le", "+Inf")), count
+        yield "_count", _format_labels(self.labels), count
+        yield "_sum", _format_labels(self.labels), total
+
+
+def histogram(name: str, **labels) -> Histogram:
+    """按名称和标签获取直方图，不存在时创建（用于标签值在运行时才确定的情况）"""
+    return REGISTRY.get_or_create(name, labels, lambda: Histogram(name, labels=labels))
+
+
+def counter(name: str, **labels) -> Counter:
+    """按名称和标签获取计数器，不存在时创建"""
+    return REGISTRY.get_or_create(name, labels, lambda: Counter(name, labels=labels))
+
+
+# 语音流水线各阶段耗时：transcribe / asr_inference / llm / tts / tts_inference / mp3_encode
+def stage(name: str) -> Histogram:
+    return histogram("pipeline_stage_seconds", stage=name)
@@ -0,0 +1,85 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable
+
+logger = logging.getLogger(__name__)
+
+# 启动时并行预加载的模型，逗号分隔；未列出的模型在第一次使用时加载
+PRELOAD_MODELS = [
+    name.strip()
+    for name in os.getenv("PRELOAD_MODELS", "asr,tts").split(",")
+    if name.strip()
+]
+
+
+class ModelRegistry:
+    """
+    模型注册表：模块导入时只注册加载函数，不加载模型。
+    get() 在第一次调用时加载（线程安全，模型只加载一次），
+    preload() 在 lifespan 中并行加载指定的模型，并记录每个模型的加载耗时。
+    """
+
+    def __init__(self):
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._models: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self.load_seconds: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+
+    def register(self, name: str, loader: Callable[[], Any]):
+        self._loaders[name] = loader
+        self._locks[name] = threading.Lock()
+
+    def is_registered(self, name: str) -> bool:
+        return name in self._loaders
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def get(self, name: str) -> Any:
+        """获取模型，未加载时在当前线程加载（会阻塞，应在线程池中调用）"""
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._locks[name]:
+            if name not in self._models:
+                logger.info(f"Loading model: {name}")
+                start = time.perf_counter()
+                try:
+                    self._models[name] = self._loaders[name]()
+                except Exception as e:
+                    self.errors[name] = str(e)
+                    logger.error(f"Failed to load model {name}: {e}")
+                    raise
+                self.load_seconds[name] = time.perf_counter() - start
+                self.errors.pop(name, None)
+                logger.info(
+                    f"Loaded model {name} in {self.load_seconds[name]:.2f}s"
+                )
+        return self._models[name]
+
+    async def preload(self, names: Iterable[str]):
+        """并行加载多个模型，单个模型加载失败不影响其他模型"""
+        names = [name for name in names if self.is_registered(name)]
+        await asyncio.gather(
+            *(asyncio.to_thread(self.get, name) for name in names),
+            return_exceptions=True,
+        )
+
+    def status(self) -> Dict[str, dict]:
+        return {
+            name: {
+                "loaded": name in self._models,
+                "load_seconds": round(self.load_seconds[name], 3)
+                if name in self.load_seconds
+                else None,
+                "error": self.errors.get(name),
+            }
+            for name in self._loaders
+        }
+
+
+model_registry = ModelRegistry()
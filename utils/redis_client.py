@@ -0,0 +1,20 @@
+import os
+import redis.asyncio as redis
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+
+# Redis 客户端（异步），进程内共享一个连接池
+redis_client = redis.Redis(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=0,
+    decode_responses=True,  # 自动解码为字符串
+)
+
+
+async def check_redis_health() -> bool:
+    try:
+        return bool(await redis_client.ping())
+    except redis.RedisError:
+        return False
@@ -0,0 +1,55 @@
+"""
+ASR/TTS 桩模型：接口与 faster-whisper WhisperModel、Coqui Synthesizer 一致，
+不加载权重，按配置的耗时 sleep（占用线程池线程，和真实推理一样阻塞调用方线程）。
+ASR_BACKEND=stub / TTS_BACKEND=stub 时由模型注册表加载，用于压测和没有 GPU 的开发环境。
+"""
+
+import os
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+# 每次转录的固定耗时
+STUB_ASR_DELAY_MS = float(os.getenv("STUB_ASR_DELAY_MS", 200))
+STUB_ASR_TEXT = os.getenv(
+    "STUB_ASR_TEXT", "I went to the zoo with my family last weekend."
+)
+# 每次合成的固定耗时，以及每个字符增加的耗时
+STUB_TTS_DELAY_MS = float(os.getenv("STUB_TTS_DELAY_MS", 100))
+STUB_TTS_MS_PER_CHAR = float(os.getenv("STUB_TTS_MS_PER_CHAR", 2))
+STUB_TTS_SAMPLE_RATE = 22050
+
+
+@dataclass
+class StubSegment:
+    text: str
+
+
+class StubWhisperModel:
+    """模拟 WhisperModel 的 transcribe"""
+
+    def transcribe(self, audio, **kwargs):
+        time.sleep(STUB_ASR_DELAY_MS / 1000)
+        return iter([StubSegment(STUB_ASR_TEXT)]), None
+
+
+class StubSynthesizer:
+    """模拟 Synthesizer.tts，返回与文本长度成正比的正弦波"""
+
+    output_sample_rate = STUB_TTS_SAMPLE_RATE
+
+    def tts(self, text: str, **kwargs):
+        time.sleep((STUB_TTS_DELAY_MS + STUB_TTS_MS_PER_CHAR * len(text)) / 1000)
+        # 约每个字符 60ms 语音
+        samples = int(self.output_sample_rate * 0.06 * max(len(text), 1))
+        t = np.arange(samples) / self.output_sample_rate
+        return 0.3 * np.sin(2 * np.pi * 220 * t)
+
+
+def load_stub_asr():
+    return StubWhisperModel()
+
+
+def load_stub_tts():
+    return StubSynthesizer()
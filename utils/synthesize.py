@@ -1,10 +1,18 @@
 import os
+import re
 import asyncio
 import logging
 import soundfile as sf
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from TTS.api import Synthesizer
+from typing import AsyncIterator, List, Tuple
 from scipy.signal import butter, lfilter
+from utils.tts_cache import tts_cache, tts_cache_key
+from utils.inference import inference_client, is_remote
+from utils.model_registry import model_registry
+from utils.stub_models import load_stub_tts
+from utils.admission import StageQueue
+from utils.metrics import Gauge, stage
 
 logger = logging.getLogger(__name__)
 
@@ -48,25 +56,114 @@ if model_name.find('xtts_v2') > 1:
     languages_file = None
     multi = True
 
-# 加载模型
-synthesizer = Synthesizer(
-    tts_checkpoint=model_checkpoint,
-    tts_config_path=config_path,
-    # tts_speakers_file=speakers_file,
-    # tts_languages_file=languages_file,
-    use_cuda=True if device == "cuda" else False,
+# 加载模型，TTS 在这里才导入，不使用 TTS 的部署不需要付出导入和加载的开销
+def _load_synthesizer():
+    from TTS.api import Synthesizer
+
+    synthesizer = Synthesizer(
+        tts_checkpoint=model_checkpoint,
+        tts_config_path=config_path,
+        # tts_speakers_file=speakers_file,
+        # tts_languages_file=languages_file,
+        use_cuda=True if device == "cuda" else False,
+    )
+    # # 获取支持的说话人和语言
+    if multi:
+        speakers = synthesizer.tts_model.speaker_manager.speaker_names
+        languages = synthesizer.tts_model.language_manager.language_names
+
+        print(f"可用说话人：{speakers}")
+        print(f"可用语言： {languages}")
+
+        # # 选择一个你喜欢的说话人和语言（例如取第一个）
+        # speaker = speakers[5]
+        # language = languages[0]
+    return synthesizer
+
+
+# TTS 后端：coqui（默认）或 stub（不加载模型，见 utils/stub_models.py）
+TTS_BACKEND = os.getenv("TTS_BACKEND", "coqui")
+
+# remote 模式下模型由推理服务进程加载，API worker 不注册
+if not is_remote():
+    if TTS_BACKEND == "stub":
+        model_registry.register("tts", load_stub_tts)
+    else:
+        model_registry.register("tts", _load_synthesizer)
+
+# 传给 synthesizer.tts 的音色参数，同时作为缓存键的一部分
+voice_params = {
+    # "speaker_name": "Claribel Dervla",
+    # "language_name": "en",
+    # "length_scale": 1.0,      # 稍快的语速，听起来更有精神
+    # "noise_scale": 0.5,       # 更高的随机性，语调更自然有起伏
+    # "noise_scale_w": 0.8      # 控制情感变化幅度，略大一点更欢快
+}
+AUDIO_FORMAT = "MP3"
+
+
+def _blocking_synthesize(text: str):
+    # 生成语音
+    synthesizer = model_registry.get("tts")
+    with stage("tts_inference").time():
+        wav = synthesizer.tts(text, **voice_params)
+    return wav
+    # wav = lowpass_filter(wav, sr=synthesizer.output_sample_rate)
+    # synthesizer.save_wav(wav, path=output_path)
+
+
+def _encode_mp3(wav) -> BytesIO:
+    # Convert NumPy array to MP3 bytes, if None, return empty stream
+    wav_buffer = BytesIO()
+    if wav is not None:
+        sample_rate = model_registry.get("tts").output_sample_rate
+        with stage("mp3_encode").time():
+            sf.write(wav_buffer, wav, sample_rate, format=AUDIO_FORMAT)
+        logger.info(f"Synthesized audio size: {wav_buffer.tell()} bytes")
+        wav_buffer.seek(0)
+    return wav_buffer
+
+
+def _blocking_synthesize_mp3(text: str) -> bytes:
+    """合成并编码为 MP3，结果按内容寻址缓存，重复的文本不再调用模型"""
+    # 桩模型的输出不能和真实模型共用缓存
+    cache_model = "stub" if TTS_BACKEND == "stub" else model_name
+    key = tts_cache_key(cache_model, text, voice_params, AUDIO_FORMAT)
+    audio = tts_cache.get(key)
+    if audio is None:
+        audio = _encode_mp3(_blocking_synthesize(text)).getvalue()
+        tts_cache.put(key, audio)
+    return audio
+
+
+# 已提交、尚未完成的合成任务数（含在准入队列中排队的）
+tts_pending = Gauge("tts_pending")
+
+# 合成使用专用线程池，不和其他 run_in_executor(None, ...) 争抢默认线程池；
+# 准入并发等于线程数，排队发生在准入队列中（按优先级和用户），而不是线程池的 FIFO 队列
+TTS_NUM_WORKERS = int(os.getenv("TTS_NUM_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+TTS_QUEUE_SIZE = int(os.getenv("TTS_QUEUE_SIZE", 128))
+_tts_executor = ThreadPoolExecutor(
+    max_workers=TTS_NUM_WORKERS, thread_name_prefix="tts"
 )
-# # 获取支持的说话人和语言
-if multi:
-    speakers = synthesizer.tts_model.speaker_manager.speaker_names
-    languages = synthesizer.tts_model.language_manager.language_names
+tts_stage = StageQueue("tts", TTS_NUM_WORKERS, TTS_QUEUE_SIZE)
 
-    print(f"可用说话人：{speakers}")
-    print(f"可用语言： {languages}")
 
-    # # 选择一个你喜欢的说话人和语言（例如取第一个）
-    # speaker = speakers[5]
-    # language = languages[0]
+async def _synthesize_mp3(text: str) -> bytes:
+    """合成一段文本为 MP3：本进程的线程池，或 remote 模式下的推理服务"""
+    tts_pending.inc()
+    try:
+        with stage("tts").time():
+            async with tts_stage.slot():
+                if is_remote():
+                    return await inference_client.synthesize(text)
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    _tts_executor, _blocking_synthesize_mp3, text
+                )
+    finally:
+        tts_pending.dec()
+
 
 async def synthesize_text(text: str) -> bytes:
     """
@@ -76,30 +173,80 @@ async def synthesize_text(text: str) -> bytes:
         output_path (str): 输出音频文件路径
     """
 
-    # 获取当前事件循环
-    loop = asyncio.get_running_loop()
-    # 将阻塞任务卸载到线程池
-    def blocking_synthesize():
-        # 生成语音
-        wav = synthesizer.tts(
-            text,
-            # speaker_name="Claribel Dervla",
-            # language_name="en",
-            # length_scale=1.0,      # 稍快的语速，听起来更有精神
-            # noise_scale=0.5,       # 更高的随机性，语调更自然有起伏
-            # noise_scale_w=0.8      # 控制情感变化幅度，略大一点更欢快
-        )
-        return wav
-        # wav = lowpass_filter(wav, sr=synthesizer.output_sample_rate)
-        # synthesizer.save_wav(wav, path=output_path)
-
-    wav = await loop.run_in_executor(None, blocking_synthesize)
+    # 将阻塞任务（查缓存、合成和 MP3 编码）卸载到线程池或推理服务
+    audio = await _synthesize_mp3(text)
 
-    # Convert NumPy array to MP3 bytes, if None, return empty stream
-    wav_buffer = BytesIO()
-    if wav is not None:
-        sf.write(wav_buffer, wav, synthesizer.output_sample_rate, format="MP3")
-        logger.info(f"Synthesized audio size: {wav_buffer.tell()} bytes")
-        wav_buffer.seek(0)
+    return BytesIO(audio)
 
-    return wav_buffer
+
+# 按句末标点切分，标点保留在前一句末尾
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?;。！？；])\s+")
+
+
+def split_sentences(text: str) -> List[str]:
+    """把文本切分为句子，去掉空白句"""
+    return [s.strip() for s in _SENTENCE_END_RE.split(text) if s.strip()]
+
+
+async def synthesize_sentence_stream(
+    sentences: AsyncIterator[str], lookahead: int = 2
+) -> AsyncIterator[Tuple[str, bytes]]:
+    """
+    流式合成一个句子流（例如 LLM 边生成边产出的句子），按顺序产出 (句子, MP3 数据)。
+    句子一到达就开始合成，最多同时合成 lookahead 句，
+    所以首段音频只需等待第一句的生成和合成。
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(lookahead)
+
+    async def produce():
+        try:
+            async for sentence in sentences:
+                await slots.acquire()
+                future = asyncio.ensure_future(_synthesize_mp3(sentence))
+                queue.put_nowait((sentence, future))
+            queue.put_nowait(None)
+        except Exception as e:
+            queue.put_nowait(e)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            sentence, future = item
+            try:
+                audio = await future
+            finally:
+                slots.release()
+            if audio:
+                yield sentence, audio
+    finally:
+        # 客户端中途断开时停止消费句子，并取消尚未开始的合成；
+        # 等 producer 退出后调用方才能关闭 sentences
+        producer.cancel()
+        await asyncio.wait([producer])
+        while not queue.empty():
+            item = queue.get_nowait()
+            if isinstance(item, tuple):
+                item[1].cancel()
+
+
+async def _iterate(items) -> AsyncIterator[str]:
+    for item in items:
+        yield item
+
+
+async def synthesize_text_stream(text: str) -> AsyncIterator[bytes]:
+    """
+    按句子流式合成语音，每合成完一句就产出该句的 MP3 数据。
+    MP3 由独立的帧组成，各句的 MP3 直接拼接即可连续播放。
+    当前句产出时下一句已经在线程池中合成，首段音频只需等待一句的合成时间。
+    """
+    async for _, audio in synthesize_sentence_stream(
+        _iterate(split_sentences(text))
+    ):
+        yield audio
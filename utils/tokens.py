@@ -0,0 +1,38 @@
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 安装了 tiktoken 时使用 BPE 分词器精确计数，否则使用估算
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+# 中日韩字符（含全角标点），每个字符大约一个 token
+_CJK_RE = re.compile(
+    r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]"
+)
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+    logger.info(f"Counting tokens with tiktoken encoding {TOKENIZER_ENCODING}")
+except Exception as e:  # 未安装或编码文件无法下载时退回估算
+    _encoding = None
+    logger.info(f"tiktoken unavailable ({e}), estimating token counts")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算 token 数：中日韩字符每个算 1 个，其余按单词数 * 1.3。
+    """
+    cjk = len(_CJK_RE.findall(text))
+    words = len(_CJK_RE.sub(" ", text).split())
+    return cjk + int(words * 1.3)
+
+
+def count_tokens(text: str) -> int:
+    """计算文本的 token 数"""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
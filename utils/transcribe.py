@@ -1,7 +1,21 @@
-from faster_whisper import WhisperModel
 import os, asyncio
 import logging
-from typing import Union, BinaryIO
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union, BinaryIO
+from fastapi import HTTPException
+
+from utils.audio import (
+    PCM_FORMAT,
+    PCM_SAMPLE_RATE,
+    PcmBuffer,
+    pcm16_to_float32,
+    trim_silence,
+)
+from utils.admission import StageQueue
+from utils.metrics import Counter, Gauge, LatencyStats, stage
+from utils.inference import inference_client, is_remote
+from utils.model_registry import model_registry
+from utils.stub_models import load_stub_asr
 
 logger = logging.getLogger(__name__)
 log_level = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -9,24 +23,139 @@ device = os.getenv("DEVICE", "cpu")
 
 logger.info(f"device in transcribe : {device}")
 
+# CTranslate2 并行推理的 worker 数，同时执行的转录数与之相同
+WHISPER_NUM_WORKERS = int(os.getenv("WHISPER_NUM_WORKERS", 2))
+# 同时执行的转录请求数上限，默认等于 worker 数；
+# 超过上限的请求在准入队列中按优先级和用户排队（见 utils/admission.py）
+ASR_CONCURRENCY = int(os.getenv("ASR_CONCURRENCY", WHISPER_NUM_WORKERS))
+# 准入队列中等待转录的请求上限，超过时返回 503
+WHISPER_QUEUE_SIZE = int(os.getenv("WHISPER_QUEUE_SIZE", 64))
+
 model_path = os.path.join("/whisper_models", "faster-whisper-large-v3")
-model = WhisperModel(model_path, device=device, compute_type="int8")
 
 
-async def transcribe_file(audio_path: Union[str, BinaryIO]) -> str:
+def _load_whisper():
     """
-    转录音频文件为文本。
-    参数:
-        audio_path (str | BinaryIO): 音频文件路径或文件对象
-    返回:
-        str: 转录的文本
+    加载 Whisper 模型。
+    faster_whisper 在这里才导入，不使用 ASR 的部署不需要付出导入和加载的开销。
     """
+    from faster_whisper import WhisperModel
+
+    return WhisperModel(
+        model_path, device=device, compute_type="int8", num_workers=WHISPER_NUM_WORKERS
+    )
+
 
-    # 获取当前事件循环, use ProcessPoolExecutor for even better performance
-    loop = asyncio.get_running_loop()
-    # 将阻塞任务卸载到线程池
-    def blocking_transcribe():
+# ASR 后端：whisper（默认）或 stub（不加载模型，见 utils/stub_models.py）
+ASR_BACKEND = os.getenv("ASR_BACKEND", "whisper")
+
+# remote 模式下模型由推理服务进程加载，API worker 不注册
+if not is_remote():
+    if ASR_BACKEND == "stub":
+        model_registry.register("asr", load_stub_asr)
+    else:
+        model_registry.register("asr", _load_whisper)
+
+AudioInput = Union[str, BinaryIO, PcmBuffer]
+
+vad_trimmed_ms = Counter("whisper_vad_trimmed_ms")
+
+
+def _transcribe_blocking(
+    audio_path: AudioInput, audio_format: Optional[str] = None
+) -> str:
+    if audio_format == PCM_FORMAT:
+        # 原始 PCM 快速路径：跳过容器解码，先用 VAD 去掉首尾静音
+        speech = trim_silence(audio_path)
+        vad_trimmed_ms.inc(
+            (len(memoryview(audio_path).cast("B")) - len(speech))
+            * 1000
+            // (2 * PCM_SAMPLE_RATE)
+        )
+        if len(speech) == 0:
+            return ""
+        audio_path = pcm16_to_float32(speech)
+
+    model = model_registry.get("asr")
+    with stage("asr_inference").time():
         segments, _ = model.transcribe(audio_path, word_timestamps=True)
+        # segments 是生成器，遍历时才真正解码
         return " ".join(segment.text for segment in segments)
 
-    return await loop.run_in_executor(None, blocking_transcribe)
+
+class TranscriptionWorkers:
+    """
+    转录 worker：每个请求单独推理，本地模式在 WHISPER_NUM_WORKERS 个线程上执行，
+    remote 模式提交给推理服务。这里不排队，同时执行的请求数由 asr_stage 限制。
+    """
+
+    def __init__(self, num_workers: int = WHISPER_NUM_WORKERS):
+        self._executor = ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="whisper"
+        )
+        self.running = 0
+
+        self.completed = Counter("whisper_jobs")
+        self.job_latency = LatencyStats("whisper_job_latency")
+        Gauge("whisper_running", fn=lambda: self.running)
+
+    async def run(
+        self, audio_path: AudioInput, audio_format: Optional[str] = None
+    ) -> str:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        self.running += 1
+        try:
+            if is_remote():
+                return await inference_client.transcribe(audio_path, audio_format)
+            return await loop.run_in_executor(
+                self._executor, _transcribe_blocking, audio_path, audio_format
+            )
+        finally:
+            self.running -= 1
+            self.completed.inc()
+            self.job_latency.observe(loop.time() - start)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "completed": self.completed.value,
+            "job_latency": self.job_latency.snapshot(),
+        }
+
+
+transcription_workers = TranscriptionWorkers()
+asr_stage = StageQueue("asr", ASR_CONCURRENCY, WHISPER_QUEUE_SIZE)
+
+
+async def transcribe_file(
+    audio_path: AudioInput,
+    audio_format: Optional[str] = None,
+    sample_rate: int = PCM_SAMPLE_RATE,
+) -> str:
+    """
+    转录音频文件为文本。
+    参数:
+        audio_path (str | BinaryIO | bytes): 音频文件路径、文件对象，或原始 PCM 数据
+        audio_format (str): 为 "pcm_s16le" 时 audio_path 是 16kHz 单声道 int16 PCM，
+            跳过解码直接送入模型；默认由 ffmpeg 自动识别容器格式
+        sample_rate (int): PCM 采样率，目前只支持 16000
+    返回:
+        str: 转录的文本
+    """
+    if audio_format is not None and audio_format != PCM_FORMAT:
+        raise HTTPException(
+            status_code=400, detail=f"Unsupported audio_format: {audio_format}"
+        )
+    if audio_format == PCM_FORMAT:
+        if sample_rate != PCM_SAMPLE_RATE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"PCM sample_rate must be {PCM_SAMPLE_RATE}",
+            )
+        if hasattr(audio_path, "read"):
+            # UploadFile.file 可能已经落盘，不在事件循环中读
+            audio_path = await asyncio.to_thread(audio_path.read)
+    with stage("transcribe").time():
+        async with asr_stage.slot():
+            return await transcription_workers.run(audio_path, audio_format)
@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from utils.metrics import Counter
+
+
+class TTLCache:
+    """
+    容量有限的 LRU 缓存，每个条目带过期时间。
+    只在事件循环线程里使用，不加锁。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        ttl: float,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+    ):
+        """
+        :param name: 缓存名称，用于计数器命名
+        :param maxsize: 最大条目数，超出时淘汰最久未使用的条目
+        :param ttl: 默认存活秒数
+        :param on_evict: 条目因容量或过期被移除时的回调，参数为 (key, value)
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = Counter(f"{name}_hits")
+        self.misses = Counter(f"{name}_misses")
+        self.evictions = Counter(f"{name}_evictions")
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses.inc()
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self._evicted(key, value)
+            self.misses.inc()
+            return default
+        self._data.move_to_end(key)
+        self.hits.inc()
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            self._data.pop(key, None)
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            evicted_key, (_, evicted) = self._data.popitem(last=False)
+            self._evicted(evicted_key, evicted)
+
+    def _evicted(self, key: Hashable, value: Any):
+        self.evictions.inc()
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def expire(self) -> int:
+        """移除所有已过期的条目，返回移除的数量"""
+        now = time.monotonic()
+        expired = [
+            key for key, (expires_at, _) in self._data.items() if expires_at <= now
+        ]
+        for key in expired:
+            _, value = self._data.pop(key)
+            self._evicted(key, value)
+        return len(expired)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def values(self):
+        return [value for _, value in self._data.values()]
+
+    def items(self):
+        return [(key, value) for key, (_, value) in self._data.items()]
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits.value,
+            "misses": self.misses.value,
+            "evictions": self.evictions.value,
+        }
@@ -0,0 +1,181 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from utils.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# 磁盘缓存目录，多个 worker 可以共享同一个目录
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "/tmp/tts_cache")
+# 内存层和磁盘层的容量上限（字节），为 0 时关闭对应层
+TTS_CACHE_MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+TTS_CACHE_DISK_BYTES = int(os.getenv("TTS_CACHE_DISK_BYTES", 1024 * 1024 * 1024))
+
+
+def tts_cache_key(model_name: str, text: str, voice_params: dict, fmt: str) -> str:
+    """按 (模型, 文本, 音色参数, 输出格式) 计算内容寻址的缓存键"""
+    raw = json.dumps(
+        [model_name, text, voice_params, fmt], sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTSAudioCache:
+    """
+    两级 TTS 音频缓存：内存 LRU + 磁盘分片文件（<dir>/ab/cd/<key>），均按 LRU 淘汰。
+    合成在线程池中执行，缓存也在线程池中读写，所以内部加锁。
+    多个 worker 共享磁盘目录时各自维护索引，文件被其他 worker 淘汰后读取按未命中处理。
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = TTS_CACHE_DIR,
+        memory_bytes: int = TTS_CACHE_MEMORY_BYTES,
+        disk_bytes: int = TTS_CACHE_DISK_BYTES,
+    ):
+        self.cache_dir = cache_dir
+        self.memory_limit = memory_bytes
+        self.disk_limit = disk_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_size = 0
+        self._lock = threading.Lock()
+
+        self.memory_hits = Counter("tts_cache_memory_hits")
+        self.disk_hits = Counter("tts_cache_disk_hits")
+        self.misses = Counter("tts_cache_misses")
+        self.evictions = Counter("tts_cache_evictions")
+
+        if self.disk_limit > 0:
+            self._load_disk_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key[2:4], key)
+
+    def _load_disk_index(self):
+        """启动时扫描磁盘目录，按修改时间重建 LRU 顺序"""
+        entries = []
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if name.endswith(".tmp"):
+                        continue
+                    st = os.stat(os.path.join(root, name))
+                    entries.append((st.st_mtime, name, st.st_size))
+        except OSError as e:
+            logger.warning(f"TTS disk cache disabled, cannot use {self.cache_dir}: {e}")
+            self.disk_limit = 0
+            return
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._evict_disk()
+        logger.info(
+            f"TTS disk cache: {len(self._disk)} entries, {self._disk_size} bytes"
+        )
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits.inc()
+                return data
+            on_disk = key in self._disk
+
+        if on_disk:
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            with self._lock:
+                if data is None:
+                    self._forget_disk(key)
+                else:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self.disk_hits.inc()
+                    self._put_memory(key, data)
+                    return data
+
+        self.misses.inc()
+        return None
+
+    def put(self, key: str, data: bytes):
+        if not data:
+            return
+        with self._lock:
+            self._put_memory(key, data)
+            if self.disk_limit <= 0 or key in self._disk:
+                return
+
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write TTS cache entry {key}: {e}")
+            return
+
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = len(data)
+                self._disk_size += len(data)
+            self._evict_disk()
+
+    def _put_memory(self, key: str, data: bytes):
+        if self.memory_limit <= 0 or len(data) > self.memory_limit:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old)
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            self.evictions.inc()
+
+    def _forget_disk(self, key: str):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_size -= size
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_limit and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self.evictions.inc()
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        hits = self.memory_hits.value + self.disk_hits.value
+        total = hits + self.misses.value
+        return {
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_size,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_size,
+            "memory_hits": self.memory_hits.value,
+            "disk_hits": self.disk_hits.value,
+            "misses": self.misses.value,
+            "evictions": self.evictions.value,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        }
+
+
+tts_cache = TTSAudioCache()
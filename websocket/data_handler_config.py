@@ -1,6 +1,7 @@
 import logging
 from websocket.data_handlers import WsDataHandlerRegistry
 from services.conversation import handle_conversation
+from services.streaming_asr import handle_asr_stream
 
 logger = logging.getLogger(__name__)
 
@@ -12,7 +13,12 @@ def ws_configure_data_handlers(registry: WsDataHandlerRegistry):
     在此注册所有 data_type 和对应的处理器函数。
     """
     # 注册 conversation 处理器
-    registry.register("conversation", handle_conversation)
+    # stream_audio 模式下需要连接上下文来分段推送音频
+    registry.register("conversation", handle_conversation, with_context=True)
+
+    # 注册流式转录处理器，需要连接上下文来保存每路流的状态和推送中间结果；
+    # 音频块必须按顺序送入，且转录在后台任务中进行，所以在接收循环中直接执行
+    registry.register("asr_stream", handle_asr_stream, with_context=True, inline=True)
 
     # 示例：注册其他处理器（用户可在此添加）
     # registry.register("analytics", handle_analytics)
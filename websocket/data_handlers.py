@@ -1,5 +1,9 @@
 import logging
-from typing import Dict, Callable, Optional, Union
+from typing import Dict, Callable, Optional, Set, Union
+
+from fastapi import HTTPException
+
+from utils.metrics import counter, histogram
 
 logger = logging.getLogger(__name__)
 
@@ -14,13 +18,35 @@ class WsDataHandlerRegistry:
 
     def __init__(self):
         self.handlers: Dict[str, Callable] = {}
+        self.with_context: Set[str] = set()
+        self.inline: Set[str] = set()
 
-    def register(self, data_type: str, handler: Callable):
-        """注册新的 TYPE_DATA 处理器"""
+    def register(
+        self,
+        data_type: str,
+        handler: Callable,
+        with_context: bool = False,
+        inline: bool = False,
+    ):
+        """
+        注册新的 TYPE_DATA 处理器。
+        :param with_context: 为 True 时 handler 额外接收连接上下文 context，
+            用于需要跨消息保存状态或主动推送消息的处理器（例如流式转录）
+        :param inline: 为 True 时在接收循环中按到达顺序直接执行，
+            只适用于很快返回、且依赖消息顺序的处理器（例如流式转录的音频块）；
+            默认每条消息在独立任务中处理，不阻塞接收循环
+        """
         self.handlers[data_type] = handler
+        for flag, names in ((with_context, self.with_context), (inline, self.inline)):
+            if flag:
+                names.add(data_type)
+            else:
+                names.discard(data_type)
         logger.info(f"Registered handler for data_type: {data_type}")
 
-    async def dispatch(self, parsed_data: Dict, username: str) -> Optional[bytes]:
+    async def dispatch(
+        self, parsed_data: Dict, username: str, context: Optional[Dict] = None
+    ) -> Optional[bytes]:
         """分发 TYPE_DATA 消息到对应处理器"""
         data_type = parsed_data["json_data"].get("data_type")
         if not data_type:
@@ -33,7 +59,16 @@ class WsDataHandlerRegistry:
             return None
 
         try:
-            return await handler(parsed_data, username)
+            with histogram("ws_message_seconds", data_type=data_type).time():
+                if data_type in self.with_context:
+                    return await handler(parsed_data, username, context)
+                return await handler(parsed_data, username)
+        except HTTPException as e:
+            # 过载、超时等需要告知客户端的错误，由 WebSocketHandler 回复给客户端
+            counter("ws_message_errors", data_type=data_type).inc()
+            logger.warning(f"Handler error for {data_type}: {e.detail}")
+            raise
         except Exception as e:
+            counter("ws_message_errors", data_type=data_type).inc()
             logger.error(f"Handler error for {data_type}: {e}")
             return None
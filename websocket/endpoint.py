@@ -1,48 +1,91 @@
-import os
+import base64
+import asyncio
+import binascii
 import logging
-from jose import jwt
+from typing import Any, Awaitable, Callable, Dict, Optional
 from fastapi import WebSocket, WebSocketDisconnect
 from starlette.websockets import WebSocketState
-from .protocol import WebSocketProtocol
+from .protocol import WebSocketProtocol, current_request_id
 from .handlers import WebSocketHandler
 from .manager import WebSocketManager
-from auth import get_token_websocket, get_current_user, get_db
+from .registry import connection_registry
+from .fragmentation import FragmentAssembler, FragmentError, FragmentSender
+from auth import get_token_websocket, get_current_user, get_expiry_time
 from websocket.data_handlers import WsDataHandlerRegistry
+from utils.admission import Priority, set_request_context
+from utils.metrics import Gauge, counter
 
 logger = logging.getLogger(__name__)
-JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-please-change-this")
+
+# 所有连接上正在处理的 TYPE_DATA 请求数
+active_requests = Gauge("websocket_requests_inflight")
 
 
 async def websocket_endpoint(
     websocket: WebSocket, data_handler_registry: WsDataHandlerRegistry
 ):
-    db_gen = None
     try:
         token = await get_token_websocket(websocket)
-        db_gen = get_db()
-        db_and_cursor = await anext(db_gen)
-        current_user = await get_current_user(token, db_and_cursor=db_and_cursor)
-        token_expiry_time = jwt.decode(token, JWT_SECRET_KEY, algorithms=["HS256"]).get(
-            "exp", float("inf")
-        )
+        current_user = await get_current_user(websocket, token)
+        token_expiry_time = get_expiry_time(token)
     except Exception as e:
         await websocket.close(code=1008, reason=f"Invalid token: {str(e)}")
         logger.warning(f"Invalid token: {e}")
         return
-    finally:
-        if db_gen is not None:
-            await db_gen.aclose()
 
     await websocket.accept()
-    manager = WebSocketManager(websocket, token_expiry_time)
+    # WebSocket 对话优先于 HTTP 接口；连接本身不设截止时间，每个请求在 _run_request 中设置
+    set_request_context(current_user["username"], Priority.INTERACTIVE, timeout=0)
+    manager = WebSocketManager(websocket, token_expiry_time, current_user["username"])
 
     # 使用 registry.dispatch 作为数据处理器，支持根据 data_type 类型对ws data进行动态分发
     data_handler = WebSocketHandler(data_handler=data_handler_registry.dispatch)
-    await manager.start()
+    # 分片重组和流控：客户端发送过分片后，大消息也按分片回复
+    assembler = FragmentAssembler()
+    sender = FragmentSender(
+        websocket.send_bytes, on_error=lambda e: websocket.close(code=1011)
+    )
+    # 连接上下文，供需要主动推送的 data handler 使用
+    manager.context["send_bytes"] = sender.send
+    manager.context["send_text"] = websocket.send_text
+    # 注册后由连接注册表统一检查 PING 超时和 token 过期
+    connection_registry.register(manager)
+
+    async def release(message: dict):
+        # 分片重组的消息处理完毕，归还占用的字节并补充客户端额度
+        if not message.get("reassembled"):
+            return
+        assembler.release(message["length"])
+        try:
+            await _send_credit(websocket, assembler)
+        except Exception as e:
+            logger.debug(f"Failed to send credit: {e}")
 
     try:
         while True:
-            data = await websocket.receive_bytes()
+            received = await websocket.receive()
+            if received["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(received.get("code", 1000))
+
+            if received.get("text") is not None:
+                # 兼容 scripts/test_websocket_VAD.py：文本帧为 base64 编码的 PCM 块，
+                # 作为 asr_stream 处理，语音结束时回复文本 "stop_recording"
+                try:
+                    pcm = base64.b64decode(received["text"], validate=True)
+                except binascii.Error:
+                    logger.warning("Ignored non-base64 text frame")
+                    continue
+                await data_handler.handle_data(
+                    {
+                        "json_data": {"data_type": "asr_stream", "text_signal": True},
+                        "binary_data": pcm,
+                    },
+                    current_user["username"],
+                    manager.context,
+                )
+                continue
+
+            data = received.get("bytes")
             if not isinstance(data, bytes):
                 continue
 
@@ -50,6 +93,14 @@ async def websocket_endpoint(
             if not message:
                 continue
 
+            if message["direction"] == 0 and message["type"] in (
+                WebSocketProtocol.TYPE_FRAGMENT,
+                WebSocketProtocol.TYPE_CREDIT,
+            ):
+                message = await _receive_fragment(websocket, message, assembler, sender)
+                if message is None:
+                    continue
+
             direction = message["direction"]
             type_ = message["type"]
             payload = message["payload"]
@@ -57,16 +108,31 @@ async def websocket_endpoint(
             if direction == 0:  # 客户端消息
                 if type_ == WebSocketProtocol.TYPE_PING:
                     pong_message = await data_handler.handle_ping(manager.context)
-                    await websocket.send_bytes(pong_message)
+                    await sender.send_control(pong_message)
                 elif type_ == WebSocketProtocol.TYPE_DATA:
                     parsed_data = WebSocketProtocol.parse_data_payload(payload)
-                    logger.info(f"Received data, length: {message['length']} bytes")
-                    logger.info(f"Parsed data JSON: {parsed_data['json_data']}")
+                    logger.debug(f"Received data, length: {message['length']} bytes")
+                    logger.debug(f"Parsed data JSON: {parsed_data['json_data']}")
+                    data_type = parsed_data["json_data"].get("data_type")
+                    if data_type not in data_handler_registry.inline:
+                        # 在独立任务中处理，接收循环继续读取 PING 和取消消息；
+                        # 分片重组的消息在任务结束时归还额度
+                        await _start_request(
+                            manager,
+                            data_handler,
+                            sender,
+                            parsed_data,
+                            current_user["username"],
+                            lambda message=message: release(message),
+                        )
+                        continue
                     response_message = await data_handler.handle_data(
-                        parsed_data, current_user["username"]
+                        parsed_data, current_user["username"], manager.context
                     )
                     if response_message:
-                        await websocket.send_bytes(response_message)
+                        await sender.send_control(response_message)
+                elif type_ == WebSocketProtocol.TYPE_CANCEL:
+                    await _cancel_requests(manager, sender, payload)
             elif direction == 1:  # 回应
                 parsed_data = WebSocketProtocol.parse_data_payload(payload)
                 if type_ == WebSocketProtocol.TYPE_PUSH:
@@ -74,11 +140,151 @@ async def websocket_endpoint(
                 elif type_ == WebSocketProtocol.TYPE_TIMEOUT:
                     await data_handler.handle_timeout(websocket)
 
+            await release(message)
+
     except WebSocketDisconnect:
         logger.info("WebSocket client disconnected")
     except Exception as e:
         logger.error(f"WebSocket error: {str(e)}")
     finally:
-        manager.cancel_tasks()
+        connection_registry.unregister(manager)
+        manager.cancel_requests()
+        sender.stop()
+        assembler.clear()
+        for on_close in manager.context.get("on_close", []):
+            on_close()
         if websocket.client_state == WebSocketState.CONNECTED:
             await websocket.close(code=1000)
+
+
+async def _start_request(
+    manager: WebSocketManager,
+    data_handler: WebSocketHandler,
+    sender: FragmentSender,
+    parsed_data: Dict,
+    username: str,
+    on_done: Callable[[], Awaitable[None]],
+):
+    """
+    为一条 TYPE_DATA 请求创建处理任务。json_data 中的 request_id 原样带回；
+    超过每连接的并发上限或 request_id 与处理中的请求重复时回复 TYPE_ERROR。
+    """
+    request_id = parsed_data["json_data"].get("request_id")
+    if not manager.can_accept(request_id):
+        counter("ws_requests_rejected").inc()
+        if request_id in manager.requests:
+            error = "Duplicate request_id"
+        else:
+            error = "Too many concurrent requests"
+        await on_done()
+        await sender.send_control(
+            WebSocketProtocol.build_message(
+                direction=1,
+                type_=WebSocketProtocol.TYPE_ERROR,
+                json_data={"error": error, "request_id": request_id},
+            )
+        )
+        return
+    manager.start_request(
+        request_id,
+        _run_request(
+            request_id, data_handler, sender, parsed_data, username, manager, on_done
+        ),
+    )
+
+
+async def _run_request(
+    request_id: Optional[Any],
+    data_handler: WebSocketHandler,
+    sender: FragmentSender,
+    parsed_data: Dict,
+    username: str,
+    manager: WebSocketManager,
+    on_done: Callable[[], Awaitable[None]],
+):
+    # 只在本任务的上下文中生效，回复和处理过程中推送的消息都带上 request_id
+    current_request_id.set(request_id)
+    set_request_context(username, Priority.INTERACTIVE)
+    active_requests.inc()
+    try:
+        response_message = await data_handler.handle_data(
+            parsed_data, username, manager.context
+        )
+        if response_message:
+            await sender.send(response_message)
+    except asyncio.CancelledError:
+        counter("ws_requests_cancelled").inc()
+        logger.info(f"WebSocket request {request_id} cancelled")
+        raise
+    except Exception as e:
+        logger.error(f"WebSocket request {request_id} failed: {e}")
+    finally:
+        active_requests.dec()
+        await on_done()
+
+
+async def _cancel_requests(
+    manager: WebSocketManager, sender: FragmentSender, payload: memoryview
+):
+    """
+    处理客户端的 TYPE_CANCEL：json_data 为 {"request_id": ...}，不带 request_id 时取消全部。
+    取消后处理任务中的转录、LLM 流和未开始的合成随之取消，
+    回复 TYPE_CANCEL {"request_id": ..., "cancelled": 取消的请求数}。
+    """
+    request_id = WebSocketProtocol.parse_data_payload(payload)["json_data"].get(
+        "request_id"
+    )
+    cancelled = manager.cancel_requests(request_id)
+    logger.info(f"Cancelled {cancelled} WebSocket request(s) for {request_id}")
+    await sender.send_control(
+        WebSocketProtocol.build_message(
+            direction=1,
+            type_=WebSocketProtocol.TYPE_CANCEL,
+            json_data={"request_id": request_id, "cancelled": cancelled},
+        )
+    )
+
+
+async def _send_credit(websocket: WebSocket, assembler: FragmentAssembler):
+    # 直接发送，不经过 FragmentSender 的队列：写任务可能正在等待客户端的额度
+    credit = assembler.grant()
+    if credit:
+        await websocket.send_bytes(WebSocketProtocol.build_credit(1, credit))
+
+
+async def _receive_fragment(
+    websocket: WebSocket,
+    message: dict,
+    assembler: FragmentAssembler,
+    sender: FragmentSender,
+) -> Optional[dict]:
+    """
+    处理客户端的 TYPE_CREDIT 和 TYPE_FRAGMENT。
+    分片组成完整消息时返回重组后的消息（与 parse_message 结构相同），否则返回 None。
+    """
+    if message["type"] == WebSocketProtocol.TYPE_CREDIT:
+        credit = WebSocketProtocol.parse_credit(message["payload"])
+        if credit is not None:
+            sender.add_credit(credit)
+        return None
+
+    fragment = WebSocketProtocol.parse_fragment(message["payload"])
+    if fragment is None:
+        return None
+    sender.enable()
+    try:
+        reassembled = assembler.feed(message["direction"], fragment)
+    except FragmentError as e:
+        logger.warning(f"Dropped fragmented message: {e}")
+        await websocket.send_bytes(
+            WebSocketProtocol.build_message(
+                direction=1,
+                type_=WebSocketProtocol.TYPE_ERROR,
+                json_data={"error": str(e), "message_id": e.message_id},
+            )
+        )
+        reassembled = None
+    await _send_credit(websocket, assembler)
+    if reassembled is not None:
+        reassembled["reassembled"] = True
+    return reassembled
@@ -0,0 +1,312 @@
+import os
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional, Union
+
+from .protocol import WebSocketProtocol
+
+logger = logging.getLogger(__name__)
+
+# 服务端发送的分片大小（分片数据部分，不含头）
+WS_FRAGMENT_SIZE = int(os.getenv("WS_FRAGMENT_SIZE", 64 * 1024))
+# 流控窗口：每个方向上，未收到对方 TYPE_CREDIT 之前最多可以发送的分片数据字节数
+WS_FRAGMENT_WINDOW = int(os.getenv("WS_FRAGMENT_WINDOW", 1024 * 1024))
+# 单条重组消息的大小上限
+WS_MAX_MESSAGE_BYTES = int(os.getenv("WS_MAX_MESSAGE_BYTES", 16 * 1024 * 1024))
+# 每个连接上正在重组和正在处理的消息总字节数上限（不小于单条消息上限）
+WS_MAX_INFLIGHT_BYTES = max(
+    int(os.getenv("WS_MAX_INFLIGHT_BYTES", 32 * 1024 * 1024)), WS_MAX_MESSAGE_BYTES
+)
+# 每个连接同时重组的消息数上限
+WS_MAX_PARTIAL_MESSAGES = int(os.getenv("WS_MAX_PARTIAL_MESSAGES", 4))
+# 发送分片时等待对方 TYPE_CREDIT 的超时（秒）
+WS_CREDIT_TIMEOUT = float(os.getenv("WS_CREDIT_TIMEOUT", 30))
+# 支持分片的连接上等待发送（含正在发送）的处理结果总字节数上限
+WS_SEND_QUEUE_BYTES = int(os.getenv("WS_SEND_QUEUE_BYTES", 4 * 1024 * 1024))
+
+
+class FragmentError(Exception):
+    """分片违反协议（序号不连续、超出流控额度或大小上限），对应的消息被丢弃"""
+
+    def __init__(self, message: str, message_id: Optional[int] = None):
+        super().__init__(message)
+        self.message_id = message_id
+
+
+@dataclass
+class _PartialMessage:
+    direction: int
+    type: int
+    next_seq: int = 0
+    buffer: bytearray = field(default_factory=bytearray)
+
+
+class FragmentAssembler:
+    """
+    接收方向：把 TYPE_FRAGMENT 分片重组成完整消息，并按信用额度做流控。
+
+    客户端在每个连接上初始有 window 字节的额度，每发送一个分片扣除其数据长度，
+    额度不足时必须等待服务端的 TYPE_CREDIT。服务端只在
+    “已缓存字节 + 剩余额度 <= max_inflight” 时补充额度，
+    所以重组缓冲区和处理中的消息合计不超过 max_inflight 字节。
+    完整消息处理完后调用 release() 归还其字节数。
+    """
+
+    def __init__(
+        self,
+        window: int = WS_FRAGMENT_WINDOW,
+        max_message_bytes: int = WS_MAX_MESSAGE_BYTES,
+        max_inflight_bytes: int = WS_MAX_INFLIGHT_BYTES,
+        max_partial: int = WS_MAX_PARTIAL_MESSAGES,
+    ):
+        self.window = window
+        self.max_message_bytes = max_message_bytes
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_partial = max_partial
+        self.credit = window
+        self.inflight = 0
+        self._partial: Dict[int, _PartialMessage] = {}
+
+    def feed(self, direction: int, fragment: Dict) -> Optional[Dict]:
+        """
+        处理一个分片。消息完整时返回与 parse_message 相同结构的 dict
+        （payload 为重组缓冲区上的 memoryview），否则返回 None。
+        违反协议时丢弃该消息并抛出 FragmentError。
+        """
+        message_id = fragment["message_id"]
+        data = fragment["data"]
+        size = len(data)
+
+        # 先检查消息 ID、序号和数量上限，分片被接受后才扣除额度
+        partial = self._partial.get(message_id)
+        if partial is None:
+            if fragment["seq"] != 0:
+                raise FragmentError(
+                    f"Unknown message {message_id} (seq {fragment['seq']})", message_id
+                )
+            if len(self._partial) >= self.max_partial:
+                raise FragmentError("Too many partial messages", message_id)
+            buffered = 0
+        elif fragment["seq"] != partial.next_seq:
+            self._discard(message_id)
+            raise FragmentError(
+                f"Fragment seq {fragment['seq']} out of order, "
+                f"expected {partial.next_seq}",
+                message_id,
+            )
+        else:
+            buffered = len(partial.buffer)
+
+        if size > self.credit:
+            self._discard(message_id)
+            raise FragmentError(
+                f"Fragment of {size} bytes exceeds credit {self.credit}", message_id
+            )
+        if buffered + size > self.max_message_bytes:
+            self._discard(message_id)
+            raise FragmentError(
+                f"Message exceeds {self.max_message_bytes} bytes", message_id
+            )
+
+        if partial is None:
+            partial = self._partial[message_id] = _PartialMessage(
+                direction=direction, type=fragment["type"]
+            )
+        self.credit -= size
+        partial.buffer += data
+        partial.next_seq += 1
+        self.inflight += size
+
+        if not fragment["final"]:
+            return None
+        del self._partial[message_id]
+        return {
+            "direction": partial.direction,
+            "type": partial.type,
+            "length": len(partial.buffer),
+            "payload": memoryview(partial.buffer),
+        }
+
+    def release(self, size: int):
+        """完整消息处理完毕，归还其占用的字节"""
+        self.inflight = max(0, self.inflight - size)
+
+    def grant(self) -> int:
+        """
+        计算应补充给客户端的额度并计入 self.credit，返回 0 表示暂不发送 TYPE_CREDIT。
+        额度用完或可补充量达到窗口的一半时才发送，减少 TYPE_CREDIT 消息数量。
+        """
+        target = min(self.window, self.max_inflight_bytes - self.inflight)
+        increment = target - self.credit
+        if increment <= 0:
+            return 0
+        if self.credit > 0 and increment < self.window // 2:
+            return 0
+        self.credit += increment
+        return increment
+
+    def _discard(self, message_id: int):
+        partial = self._partial.pop(message_id, None)
+        if partial is not None:
+            self.inflight = max(0, self.inflight - len(partial.buffer))
+
+    def clear(self):
+        self._partial.clear()
+        self.inflight = 0
+
+
+class FragmentSender:
+    """
+    发送方向：客户端发送过 TYPE_FRAGMENT 或 TYPE_CREDIT（即支持分片）之前，
+    消息直接整条发送，与不支持分片的旧客户端兼容。
+    支持分片后，消息由写任务发送：超过 fragment_size 的消息按分片发送，
+    并遵守客户端的信用额度。
+
+    消息分两条通道：
+    - send()：处理任务的回复和推送，进入按字节计数的有界队列，
+      队列满时等待，发送方内存有界；
+    - send_control()：接收循环自己的回复（PONG、CANCEL、ERROR 和 inline 处理器的回复），
+      从不等待队列空间。不超过一个分片的直接发送，更大的进入无界的控制通道，
+      由写任务优先发送。
+    等待额度的只有写任务和调用 send() 的处理任务，接收循环不会被阻塞，
+    仍能读到客户端的 TYPE_CREDIT。
+    """
+
+    def __init__(
+        self,
+        send_bytes: Callable[[Union[bytes, bytearray]], Awaitable[None]],
+        fragment_size: int = WS_FRAGMENT_SIZE,
+        window: int = WS_FRAGMENT_WINDOW,
+        credit_timeout: float = WS_CREDIT_TIMEOUT,
+        queue_bytes: int = WS_SEND_QUEUE_BYTES,
+        on_error: Optional[Callable[[Exception], Awaitable[None]]] = None,
+    ):
+        self._send_bytes = send_bytes
+        self.fragment_size = fragment_size
+        self.credit_timeout = credit_timeout
+        self.credit = window
+        self.queue_bytes = queue_bytes
+        self.enabled = False
+        self._on_error = on_error
+        self._credit_added = asyncio.Event()
+        self._control: deque = deque()
+        self._data: deque = deque()
+        self._queued_bytes = 0
+        self._ready = asyncio.Event()  # 有消息等待写任务发送
+        self._drained = asyncio.Event()  # 数据队列腾出了空间或写任务已停止
+        self._writer: Optional[asyncio.Task] = None
+        self._error: Optional[Exception] = None
+        self._next_id = 1
+
+    def enable(self):
+        """客户端支持分片，之后的消息经写任务发送"""
+        if not self.enabled:
+            self.enabled = True
+            self._writer = asyncio.create_task(self._write_loop())
+
+    def add_credit(self, credit: int):
+        self.enable()
+        self.credit += credit
+        self._credit_added.set()
+
+    async def send(self, message: Union[bytes, bytearray]):
+        """发送一条由 build_message 构造的完整消息；数据队列满时等待"""
+        self._check_error()
+        if not self.enabled:
+            await self._send_bytes(message)
+            return
+        size = len(message)
+        # 队列为空时总是放行，超过上限的单条消息也能发送
+        while self._queued_bytes and self._queued_bytes + size > self.queue_bytes:
+            self._drained.clear()
+            await self._drained.wait()
+            self._check_error()
+        self._data.append(message)
+        self._queued_bytes += size
+        self._ready.set()
+
+    async def send_control(self, message: Union[bytes, bytearray]):
+        """接收循环发送回复，不等待数据队列"""
+        self._check_error()
+        if (
+            not self.enabled
+            or len(message) - WebSocketProtocol.HEADER_SIZE <= self.fragment_size
+        ):
+            await self._send_bytes(message)
+            return
+        self._control.append(message)
+        self._ready.set()
+
+    def stop(self):
+        if self._writer is not None:
+            self._writer.cancel()
+        if self._error is None:
+            self._error = FragmentError("Connection closed")
+        self._drained.set()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise FragmentError(f"Sender stopped: {self._error}")
+
+    async def _write_loop(self):
+        try:
+            while True:
+                if self._control:
+                    await self._send_message(self._control.popleft())
+                elif self._data:
+                    # 发送完成后才出队，正在发送的消息也计入 queue_bytes
+                    message = self._data[0]
+                    await self._send_message(message)
+                    self._data.popleft()
+                    self._queued_bytes -= len(message)
+                    self._drained.set()
+                else:
+                    self._ready.clear()
+                    await self._ready.wait()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"WebSocket fragment sender failed: {e}")
+            self._error = e
+            self._drained.set()
+            if self._on_error is not None:
+                await self._on_error(e)
+
+    async def _send_message(self, message: Union[bytes, bytearray]):
+        if len(message) - WebSocketProtocol.HEADER_SIZE <= self.fragment_size:
+            await self._send_bytes(message)
+        else:
+            await self._send_fragments(message)
+
+    async def _send_fragments(self, message: Union[bytes, bytearray]):
+        parsed = WebSocketProtocol.parse_message(message)
+        payload = parsed["payload"]
+        message_id = self._next_id
+        self._next_id = (self._next_id + 1) & 0xFFFFFFFF or 1
+
+        for seq, offset in enumerate(range(0, len(payload), self.fragment_size)):
+            chunk = payload[offset : offset + self.fragment_size]
+            await self._wait_credit(len(chunk))
+            self.credit -= len(chunk)
+            await self._send_bytes(
+                WebSocketProtocol.build_fragment(
+                    parsed["direction"],
+                    message_id,
+                    seq,
+                    parsed["type"],
+                    chunk,
+                    final=offset + self.fragment_size >= len(payload),
+                )
+            )
+
+    async def _wait_credit(self, size: int):
+        while self.credit < size:
+            self._credit_added.clear()
+            try:
+                await asyncio.wait_for(self._credit_added.wait(), self.credit_timeout)
+            except asyncio.TimeoutError:
+                raise FragmentError(
+                    f"No credit from client for {self.credit_timeout}s"
+                ) from None
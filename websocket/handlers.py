@@ -2,7 +2,7 @@ import time
 import logging
 
 from typing import Dict, Callable, Optional
-from fastapi import WebSocket
+from fastapi import HTTPException, WebSocket
 from .protocol import WebSocketProtocol
 
 logger = logging.getLogger(__name__)
@@ -11,7 +11,7 @@ class WebSocketHandler:
     def __init__(self, data_handler: Optional[Callable] = None):
         """
         WebSocket 消息处理器。
-        :param data_handler: 可选的 TYPE_DATA 消息处理器，接受 parsed_data 和 username，返回 bytes。
+        :param data_handler: 可选的 TYPE_DATA 消息处理器，接受 parsed_data、username 和连接上下文 context，返回 bytes。
         """
         self.data_handler = data_handler
 
@@ -23,13 +23,23 @@ class WebSocketHandler:
             direction=1, type_=WebSocketProtocol.TYPE_PONG
         )
 
-    async def handle_data(self, parsed_data: Dict, username: str) -> Optional[bytes]:
+    async def handle_data(
+        self, parsed_data: Dict, username: str, context: Optional[Dict] = None
+    ) -> Optional[bytes]:
         """处理 TYPE_DATA 消息，调用注册的处理器"""
         if self.data_handler is None:
             logger.error("No data handler registered for TYPE_DATA")
             return None
         try:
-            return await self.data_handler(parsed_data, username)
+            return await self.data_handler(parsed_data, username, context)
+        except HTTPException as e:
+            json_data = {"error": e.detail, "status": e.status_code}
+            retry_after = (e.headers or {}).get("Retry-After")
+            if retry_after is not None:
+                json_data["retry_after"] = int(retry_after)
+            return WebSocketProtocol.build_message(
+                direction=1, type_=WebSocketProtocol.TYPE_DATA, json_data=json_data
+            )
         except Exception as e:
             logger.error(f"Data handler error: {e}")
             return WebSocketProtocol.build_message(
@@ -1,65 +1,61 @@
+import os
 import asyncio
 import time
 import logging
+from typing import Any, Coroutine, Dict, Optional
 from fastapi import WebSocket
-from .protocol import WebSocketProtocol
 
 logger = logging.getLogger(__name__)
 
+# 每个连接同时处理的 TYPE_DATA 请求数上限
+WS_MAX_CONCURRENT_REQUESTS = int(os.getenv("WS_MAX_CONCURRENT_REQUESTS", 4))
+
 
 class WebSocketManager:
-    def __init__(self, websocket: WebSocket, token_expiry_time: float):
+    """
+    一个 WebSocket 连接的记录：连接上下文和正在处理的请求。
+    PING 超时和 token 过期由 registry.connection_registry 的时间轮统一检查，
+    连接本身不创建后台任务。
+    """
+
+    __slots__ = (
+        "websocket",
+        "username",
+        "context",
+        "token_expiry_time",
+        "requests",
+        "timer_tick",
+    )
+
+    def __init__(self, websocket: WebSocket, token_expiry_time: float, username: str):
         self.websocket = websocket
+        self.username = username
         self.context = {"last_ping": time.time()}
         self.token_expiry_time = token_expiry_time
-        self.timeout_task = None
-
-    async def start(self):
-        """启动超时和推送任务"""
-        self.timeout_task = asyncio.create_task(self.check_timeout_and_expiry())
-        # self.push_task = asyncio.create_task(self.push_messages())
+        # 正在处理的请求：request_id（客户端未提供时为内部生成的键）-> 处理任务
+        self.requests: Dict[Any, asyncio.Task] = {}
+        # 时间轮上的到期刻度，由 TimerWheel 维护
+        self.timer_tick: Optional[int] = None
 
-    async def check_timeout_and_expiry(self):
-        """检查超时和 token 过期"""
-        while True:
-            current_time = time.time()
-            logger.debug(
-                f"check_timeout_and_expiry: {current_time}, {self.context['last_ping']}"
-            )
-            if current_time - self.context["last_ping"] > 90:
-                await self.websocket.send_bytes(
-                    WebSocketProtocol.build_message(
-                        direction=0, type_=WebSocketProtocol.TYPE_TIMEOUT
-                    )
-                )
-                logger.info("WebSocket timeout due to no ping")
-                await self.websocket.close(code=1000)
-                break
-            if current_time > self.token_expiry_time:
-                await self.websocket.send_bytes(
-                    WebSocketProtocol.build_message(
-                        direction=0, type_=WebSocketProtocol.TYPE_TOKEN_EXPIRED
-                    )
-                )
-                logger.info("WebSocket timeout due to token expired")
-                await self.websocket.close(code=1008)
-                break
-            await asyncio.sleep(30)
+    def can_accept(self, request_id: Optional[Any] = None) -> bool:
+        """未达到并发上限，且 request_id 没有与正在处理的请求重复"""
+        if request_id is not None and request_id in self.requests:
+            return False
+        return len(self.requests) < WS_MAX_CONCURRENT_REQUESTS
 
-    async def push_messages(self):
-        """定期推送消息"""
-        while True:
-            await asyncio.sleep(10)
-            json_content = {"text1": "Server Push", "text2": f"At {time.time()}"}
-            push_message = WebSocketProtocol.build_message(
-                direction=0, type_=WebSocketProtocol.TYPE_PUSH, json_data=json_content
-            )
-            await self.websocket.send_bytes(push_message)
-            logger.info("Pushed message")
+    def start_request(self, request_id: Optional[Any], coro: Coroutine) -> asyncio.Task:
+        """在独立任务中处理一个请求，完成后自动移除"""
+        key = request_id if request_id is not None else object()
+        task = asyncio.create_task(coro)
+        self.requests[key] = task
+        task.add_done_callback(lambda _: self.requests.pop(key, None))
+        return task
 
-    def cancel_tasks(self):
-        """取消后台任务"""
-        if self.timeout_task:
-            self.timeout_task.cancel()
-        # if self.push_task:
-        #     self.push_task.cancel()
+    def cancel_requests(self, request_id: Optional[Any] = None) -> int:
+        """取消指定请求，request_id 为 None 时取消全部，返回被取消的任务数"""
+        if request_id is None:
+            tasks = list(self.requests.values())
+        else:
+            task = self.requests.get(request_id)
+            tasks = [task] if task is not None else []
+        return sum(1 for task in tasks if task.cancel())
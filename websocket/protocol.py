@@ -2,10 +2,17 @@ import struct
 import json
 import io
 import logging
-from typing import Dict, Union, Optional
+from contextvars import ContextVar
+from typing import Any, Dict, Union, Optional
 
 logger = logging.getLogger(__name__)
 
+# 当前正在处理的客户端请求 ID（TYPE_DATA 的 json_data["request_id"]）。
+# 在请求的处理任务中设置，build_message 构造的回复和推送消息都会带上它
+current_request_id: ContextVar[Optional[Any]] = ContextVar(
+    "ws_request_id", default=None
+)
+
 
 class WebSocketProtocol:
     # 消息类型
@@ -15,19 +22,37 @@ class WebSocketProtocol:
     TYPE_PUSH = 0x04
     TYPE_TIMEOUT = 0x05
     TYPE_TOKEN_EXPIRED = 0x06
+    TYPE_FRAGMENT = 0x07
+    TYPE_CREDIT = 0x08
+    TYPE_CANCEL = 0x09
     TYPE_ERROR = 0xFF
 
+    # 分片标志：最后一个分片
+    FLAG_FINAL = 0x01
+
+    # 消息头 [direction: 1][type: 1][length: 4]，payload 内的长度字段 [length: 4]
+    _HEADER = struct.Struct("!BBI")
+    _LENGTH = struct.Struct("!I")
+    HEADER_SIZE = _HEADER.size
+    # 分片 payload 头 [message_id: 4][seq: 4][flags: 1][type: 1]，之后是分片数据
+    _FRAGMENT = struct.Struct("!IIBB")
+    FRAGMENT_HEADER_SIZE = _FRAGMENT.size
+
     @staticmethod
-    def parse_message(data: bytes) -> Optional[Dict[str, Union[int, bytes, Dict]]]:
-        """解析二进制消息 [direction: 1 byte][type: 1 byte][length: 4 bytes][data]"""
-        if len(data) < 6:
+    def parse_message(
+        data: Union[bytes, bytearray, memoryview],
+    ) -> Optional[Dict[str, Union[int, memoryview]]]:
+        """
+        解析二进制消息 [direction: 1 byte][type: 1 byte][length: 4 bytes][data]
+        payload 是 data 上的 memoryview，不复制（音频上传可达数 MB）。
+        """
+        if len(data) < WebSocketProtocol.HEADER_SIZE:
             logger.warning("消息长度不足6字节")
             return None
 
-        direction = data[0]
-        type_ = data[1]
-        length = struct.unpack("!I", data[2:6])[0]
-        payload = data[6 : 6 + length]
+        direction, type_, length = WebSocketProtocol._HEADER.unpack_from(data, 0)
+        offset = WebSocketProtocol.HEADER_SIZE
+        payload = memoryview(data)[offset : offset + length]
 
         if len(payload) != length:
             logger.error(
@@ -43,29 +68,41 @@ class WebSocketProtocol:
         }
 
     @staticmethod
-    def parse_data_payload(payload: bytes) -> Dict[str, Union[Dict, bytes]]:
-        """解析 payload [length_json: 4 bytes][json][length_binary: 4 bytes][binary]"""
-        if len(payload) < 8:
+    def parse_data_payload(
+        payload: Union[bytes, memoryview],
+    ) -> Dict[str, Union[Dict, memoryview]]:
+        """
+        解析 payload [length_json: 4 bytes][json][length_binary: 4 bytes][binary]
+        binary_data 是 payload 上的 memoryview，不复制；需要长期保存时由调用方 bytes() 复制。
+        """
+        view = memoryview(payload)
+        if len(view) < 8:
             return {"json_data": {}, "binary_data": b""}
 
+        unpack_length = WebSocketProtocol._LENGTH.unpack_from
         offset = 0
-        json_length = struct.unpack("!I", payload[offset : offset + 4])[0]
+        (json_length,) = unpack_length(view, offset)
         offset += 4
 
-        json_str = payload[offset : offset + json_length].decode("utf-8")
+        json_view = view[offset : offset + json_length]
         offset += json_length
 
-        binary_length = struct.unpack("!I", payload[offset : offset + 4])[0]
+        if len(view) < offset + 4:
+            logger.error("Data payload truncated before binary length")
+            return {"json_data": {}, "binary_data": b""}
+        (binary_length,) = unpack_length(view, offset)
         offset += 4
 
         binary_data = (
-            payload[offset : offset + binary_length] if binary_length > 0 else b""
+            view[offset : offset + binary_length] if binary_length > 0 else b""
         )
 
         try:
-            json_obj = json.loads(json_str)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to decode JSON: {e}, original string: {json_str}")
+            json_obj = json.loads(str(json_view, "utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            logger.error(
+                f"Failed to decode JSON: {e}, original string: {bytes(json_view)!r}"
+            )
             json_obj = {}
 
         return {"json_data": json_obj, "binary_data": binary_data}
@@ -75,23 +112,111 @@ class WebSocketProtocol:
         direction: int,
         type_: int,
         json_data: Optional[Dict] = None,
-        binary_data: Optional[Union[bytes, io.BytesIO]] = None,
-    ) -> bytes:
-        """构造二进制消息"""
+        binary_data: Optional[Union[bytes, bytearray, memoryview, io.BytesIO]] = None,
+    ) -> bytearray:
+        """
+        构造二进制消息。
+        按总长度一次分配 bytearray，用 pack_into 写入各长度字段，
+        音频只复制一次（BytesIO 通过 getbuffer() 读取，不经过 getvalue()）。
+        返回的 bytearray 可以直接传给 websocket.send_bytes。
+        在请求的处理任务中调用时，json_data 自动带上该请求的 request_id。
+        """
+        request_id = current_request_id.get()
+        if request_id is not None:
+            json_data = {"request_id": request_id, **(json_data or {})}
         json_bytes = json.dumps(json_data if json_data is not None else {}).encode(
             "utf-8"
         )
-        binary_bytes = (
-            binary_data.getvalue()
-            if isinstance(binary_data, io.BytesIO)
-            else binary_data if binary_data else b""
+        if isinstance(binary_data, io.BytesIO):
+            with binary_data.getbuffer() as view:
+                return WebSocketProtocol._pack(direction, type_, json_bytes, view)
+        return WebSocketProtocol._pack(
+            direction, type_, json_bytes, binary_data if binary_data else b""
         )
 
-        payload = (
-            struct.pack("!I", len(json_bytes))
-            + json_bytes
-            + struct.pack("!I", len(binary_bytes))
-            + binary_bytes
+    @staticmethod
+    def _pack(direction: int, type_: int, json_bytes: bytes, binary) -> bytearray:
+        binary = memoryview(binary).cast("B")
+        header_size = WebSocketProtocol.HEADER_SIZE
+        json_end = header_size + 4 + len(json_bytes)
+        payload_length = 4 + len(json_bytes) + 4 + len(binary)
+
+        message = bytearray(header_size + payload_length)
+        WebSocketProtocol._HEADER.pack_into(
+            message, 0, direction, type_, payload_length
         )
+        WebSocketProtocol._LENGTH.pack_into(message, header_size, len(json_bytes))
+        WebSocketProtocol._LENGTH.pack_into(message, json_end, len(binary))
+        # 通过 memoryview 赋值直接复制到目标位置
+        # （bytearray 的切片赋值会先把非 bytearray 的值转换成新的 bytearray）
+        with memoryview(message) as out:
+            out[header_size + 4 : json_end] = json_bytes
+            out[json_end + 4 :] = binary
+        return message
 
-        return struct.pack("!BBI", direction, type_, len(payload)) + payload
+    @staticmethod
+    def parse_fragment(
+        payload: Union[bytes, memoryview],
+    ) -> Optional[Dict[str, Union[int, bool, memoryview]]]:
+        """
+        解析 TYPE_FRAGMENT 的 payload [message_id: 4][seq: 4][flags: 1][type: 1][data]
+        一条消息（type 为原消息类型，通常是 TYPE_DATA）的 payload 按顺序切成多个分片，
+        seq 从 0 开始连续递增，最后一个分片带 FLAG_FINAL。data 是 payload 上的 memoryview。
+        """
+        view = memoryview(payload)
+        if len(view) < WebSocketProtocol.FRAGMENT_HEADER_SIZE:
+            logger.warning("Fragment payload too short")
+            return None
+        message_id, seq, flags, type_ = WebSocketProtocol._FRAGMENT.unpack_from(view, 0)
+        return {
+            "message_id": message_id,
+            "seq": seq,
+            "final": bool(flags & WebSocketProtocol.FLAG_FINAL),
+            "type": type_,
+            "data": view[WebSocketProtocol.FRAGMENT_HEADER_SIZE :],
+        }
+
+    @staticmethod
+    def build_fragment(
+        direction: int,
+        message_id: int,
+        seq: int,
+        type_: int,
+        data: Union[bytes, bytearray, memoryview],
+        final: bool,
+    ) -> bytearray:
+        """构造 TYPE_FRAGMENT 消息，data 只复制一次"""
+        data = memoryview(data).cast("B")
+        header_size = WebSocketProtocol.HEADER_SIZE
+        payload_length = WebSocketProtocol.FRAGMENT_HEADER_SIZE + len(data)
+
+        message = bytearray(header_size + payload_length)
+        WebSocketProtocol._HEADER.pack_into(
+            message, 0, direction, WebSocketProtocol.TYPE_FRAGMENT, payload_length
+        )
+        WebSocketProtocol._FRAGMENT.pack_into(
+            message,
+            header_size,
+            message_id,
+            seq,
+            WebSocketProtocol.FLAG_FINAL if final else 0,
+            type_,
+        )
+        with memoryview(message) as out:
+            out[header_size + WebSocketProtocol.FRAGMENT_HEADER_SIZE :] = data
+        return message
+
+    @staticmethod
+    def parse_credit(payload: Union[bytes, memoryview]) -> Optional[int]:
+        """解析 TYPE_CREDIT 的 payload [credit: 4]：对方允许再发送的分片数据字节数"""
+        if len(payload) < WebSocketProtocol._LENGTH.size:
+            logger.warning("Credit payload too short")
+            return None
+        return WebSocketProtocol._LENGTH.unpack_from(payload, 0)[0]
+
+    @staticmethod
+    def build_credit(direction: int, credit: int) -> bytes:
+        """构造 TYPE_CREDIT 消息"""
+        return WebSocketProtocol._HEADER.pack(
+            direction, WebSocketProtocol.TYPE_CREDIT, WebSocketProtocol._LENGTH.size
+        ) + WebSocketProtocol._LENGTH.pack(credit)
@@ -0,0 +1,210 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Union
+
+from .manager import WebSocketManager
+from .protocol import WebSocketProtocol, current_request_id
+from utils.metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+# 超过该时间（秒）没有收到 PING 的连接会被关闭
+WS_PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", 90))
+# 时间轮的刻度（秒），即超时检查的精度
+WS_TIMER_TICK = float(os.getenv("WS_TIMER_TICK", 1))
+# 时间轮的槽数，超过 槽数 x 刻度 的定时在轮上转多圈
+WS_TIMER_SLOTS = int(os.getenv("WS_TIMER_SLOTS", 512))
+
+
+class TimerWheel:
+    """
+    哈希时间轮：定时按到期刻度放入 刻度 % 槽数 的槽中，每个刻度只检查一个槽，
+    添加和取消都是 O(1)。记录对象上的 timer_tick 保存到期刻度，
+    槽中 timer_tick 大于当前刻度的记录属于之后的圈，留在槽中。
+    """
+
+    def __init__(self, tick: float = WS_TIMER_TICK, slots: int = WS_TIMER_SLOTS):
+        self.tick = tick
+        self.slots = slots
+        self._wheel: List[Set[WebSocketManager]] = [set() for _ in range(slots)]
+        self._current = int(time.time() / tick)
+
+    def schedule(self, record: WebSocketManager, when: float):
+        """在时间 when（time.time()）之后触发，已有的定时被替换"""
+        self.cancel(record)
+        tick = max(math.ceil(when / self.tick), self._current + 1)
+        record.timer_tick = tick
+        self._wheel[tick % self.slots].add(record)
+
+    def cancel(self, record: WebSocketManager):
+        if record.timer_tick is not None:
+            self._wheel[record.timer_tick % self.slots].discard(record)
+            record.timer_tick = None
+
+    def advance(self, now: float) -> List[WebSocketManager]:
+        """推进到时间 now，返回到期的记录"""
+        target = int(now / self.tick)
+        steps = target - self._current
+        if steps <= 0:
+            return []
+        # 落后超过一圈时（例如事件循环长时间阻塞）每个槽检查一次即可
+        first = self._current + 1 if steps < self.slots else target - self.slots + 1
+        expired = []
+        for tick in range(first, target + 1):
+            bucket = self._wheel[tick % self.slots]
+            due = [record for record in bucket if record.timer_tick <= target]
+            for record in due:
+                bucket.discard(record)
+                record.timer_tick = None
+            expired.extend(due)
+        self._current = target
+        return expired
+
+
+class ConnectionRegistry:
+    """
+    进程内的 WebSocket 连接注册表：
+    - 所有连接的 PING 超时和 token 过期由一个时间轮和一个后台任务检查，
+      每个连接只是一条 WebSocketManager 记录，不再各自创建定时任务；
+    - 按用户索引连接，支持 TYPE_PUSH 广播；
+    - 以指标输出连接数和在线用户数。
+    PING 只更新 context["last_ping"]，不操作时间轮：定时到期时如果期间收到过 PING，
+    按新的 last_ping 重新定时。
+    """
+
+    def __init__(
+        self, ping_timeout: float = WS_PING_TIMEOUT, wheel: Optional[TimerWheel] = None
+    ):
+        self.ping_timeout = ping_timeout
+        self.connections: Set[WebSocketManager] = set()
+        self._by_user: Dict[str, Set[WebSocketManager]] = {}
+        self._wheel = wheel or TimerWheel()
+        self._task: Optional[asyncio.Task] = None
+        self._closing: Set[asyncio.Task] = set()
+
+        Gauge("websocket_connections", fn=lambda: len(self.connections))
+        Gauge("websocket_users", fn=lambda: len(self._by_user))
+
+    def register(self, manager: WebSocketManager):
+        self.connections.add(manager)
+        self._by_user.setdefault(manager.username, set()).add(manager)
+        self._schedule(manager)
+
+    def start(self):
+        """在 lifespan 中启动检查超时的后台任务"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务，并等待进行中的超时通知和关闭完成"""
+        if self._task is not None:
+            self._task.cancel()
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+
+    def unregister(self, manager: WebSocketManager):
+        self._wheel.cancel(manager)
+        self.connections.discard(manager)
+        user_connections = self._by_user.get(manager.username)
+        if user_connections is not None:
+            user_connections.discard(manager)
+            if not user_connections:
+                del self._by_user[manager.username]
+
+    def user_connections(self, username: str) -> Set[WebSocketManager]:
+        return self._by_user.get(username, set())
+
+    async def broadcast(
+        self,
+        json_data: Optional[Dict] = None,
+        binary_data: Optional[Union[bytes, bytearray, memoryview]] = None,
+        usernames: Optional[Iterable[str]] = None,
+    ) -> int:
+        """
+        向所有连接（或 usernames 中用户的连接）推送 TYPE_PUSH 消息，返回成功发送的连接数。
+        消息只构造一次，各连接并发发送，经各自的 FragmentSender 排队。
+        """
+        if usernames is None:
+            targets = list(self.connections)
+        else:
+            targets = [m for name in usernames for m in self.user_connections(name)]
+        if not targets:
+            return 0
+        # 在 /ws 请求任务中调用时 current_request_id 是调用方的请求，不能带给其它连接
+        token = current_request_id.set(None)
+        try:
+            message = WebSocketProtocol.build_message(
+                direction=0,
+                type_=WebSocketProtocol.TYPE_PUSH,
+                json_data=json_data,
+                binary_data=binary_data,
+            )
+        finally:
+            current_request_id.reset(token)
+        results = await asyncio.gather(
+            *(manager.context["send_bytes"](message) for manager in targets),
+            return_exceptions=True,
+        )
+        failed = sum(1 for result in results if isinstance(result, Exception))
+        if failed:
+            logger.warning(
+                f"Broadcast failed on {failed} of {len(targets)} connections"
+            )
+        return len(targets) - failed
+
+    def stats(self) -> dict:
+        return {"connections": len(self.connections), "users": len(self._by_user)}
+
+    def _schedule(self, manager: WebSocketManager):
+        self._wheel.schedule(
+            manager,
+            min(
+                manager.context["last_ping"] + self.ping_timeout,
+                manager.token_expiry_time,
+            ),
+        )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._wheel.tick)
+            now = time.time()
+            for manager in self._wheel.advance(now):
+                try:
+                    self._check(manager, now)
+                except Exception as e:
+                    logger.error(f"WebSocket timer check failed: {e}")
+
+    def _check(self, manager: WebSocketManager, now: float):
+        if manager not in self.connections:
+            return
+        if now - manager.context["last_ping"] > self.ping_timeout:
+            logger.info("WebSocket timeout due to no ping")
+            self._close(manager, WebSocketProtocol.TYPE_TIMEOUT, 1000)
+        elif now > manager.token_expiry_time:
+            logger.info("WebSocket timeout due to token expired")
+            self._close(manager, WebSocketProtocol.TYPE_TOKEN_EXPIRED, 1008)
+        else:
+            # 期间收到过 PING，按新的 last_ping 重新定时
+            self._schedule(manager)
+
+    def _close(self, manager: WebSocketManager, type_: int, code: int):
+        # 通知和关闭在单独的任务中进行，一个慢连接不会拖住时间轮；
+        # 连接关闭后由接收循环的 finally 调用 unregister
+        task = asyncio.create_task(self._notify_and_close(manager, type_, code))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _notify_and_close(self, manager: WebSocketManager, type_: int, code: int):
+        try:
+            await manager.websocket.send_bytes(
+                WebSocketProtocol.build_message(direction=0, type_=type_)
+            )
+            await manager.websocket.close(code=code)
+        except Exception as e:
+            logger.debug(f"Failed to close expired WebSocket: {e}")
+
+
+connection_registry = ConnectionRegistry()